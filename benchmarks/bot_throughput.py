@@ -0,0 +1,200 @@
+#!/usr/bin/env python
+'''
+Replay a synthetic stream of updates through a real `Bot` in webhook mode,
+against local fakes of the Telegram and Trello APIs.
+
+Usage: python -m benchmarks.bot_throughput [--rate 50] [--updates 500]
+
+With `--shards 1 2 4` the run is repeated with a front process routing
+updates to that many worker processes, and throughputs are compared.
+'''
+import argparse
+import os
+import resource
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.fakes import FakeTelegram, FakeTrello, telegram_update
+
+bench_token = '343445268:31f983_134f98has_asdf9_q9dpheq09uro'
+default_mix = ['/start', '/help', '/set 3600 bench', '/list Board0']
+
+
+def percentile(values, fraction):
+    if len(values) == 0:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def configure_environment(telegram, trello, options):
+    os.environ.update({
+        'TELEGRAM_BOT_TOKEN': bench_token,
+        'TELEGRAM_BOT_API_URL': telegram.base_url,
+        'TELEGRAM_BOT_MODE': 'webhook',
+        'TELEGRAM_BOT_ADMINS': 'bench',
+        'TELEGRAM_WEBHOOK_LISTEN': '127.0.0.1',
+        'TELEGRAM_WEBHOOK_PORT': '0',
+        'TELEGRAM_WEBHOOK_PATH': 'hook',
+        'TELEGRAM_OUTBOX_GLOBAL_RATE': str(options.global_rate),
+        'TRELLO_API_URL': trello.api_url,
+        'TRELLO_API_KEY': 'bench',
+        'TRELLO_API_SECRET': 'bench-secret',
+        'TRELLO_API_TOKEN': 'bench-token',
+        'TRELLO_ADMINS': 'bench',
+        'POMODORO_DB': ':memory:',
+        'TELEGRAM_UPDATES_DB': ':memory:',
+        'REVENTLOV_STATE_DB': ':memory:',
+    })
+
+
+def wait_for_replies(telegram, expected, timeout):
+    deadline = time.perf_counter() + timeout
+    while len(telegram.sent) < expected and time.perf_counter() < deadline:
+        time.sleep(0.01)
+
+
+def start_bot(shards):
+    if shards is None:
+        from reventlov.bot import Bot
+
+        bot = Bot()
+        bot.run()
+        for plugin_name in bot.plugins:
+            while bot.plugins[plugin_name].state == 'warming':
+                time.sleep(0.01)
+    else:
+        from reventlov.bot_shards import ShardedBot
+
+        bot = ShardedBot(shards)
+        bot.run()
+        bot.ready.wait()
+    return bot, f'http://127.0.0.1:{bot.webhook_server.port}/hook'
+
+
+def run(options, shards=None):
+    telegram = FakeTelegram(options.telegram_latency).start()
+    trello = FakeTrello(
+        options.trello_latency,
+        boards=options.boards,
+        lists=options.lists,
+        cards=options.cards,
+    ).start()
+    configure_environment(telegram, trello, options)
+
+    from reventlov.bot_metrics import registry
+
+    bot, webhook_url = start_bot(shards)
+    telegram.calls.clear()
+    trello.calls.clear()
+
+    posted = {}
+    posts = []
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=options.senders) as senders:
+        for number in range(options.updates):
+            due = started + number / options.rate
+            delay = due - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            chat_id = number + 1
+            text = options.mix[number % len(options.mix)]
+            posted[chat_id] = (time.perf_counter(), text.split()[0])
+            posts.append(senders.submit(
+                telegram.post_update,
+                webhook_url,
+                telegram_update(number + 1, text, chat_id),
+            ))
+    failed = len([post for post in posts if post.exception() is not None])
+    wait_for_replies(telegram, options.updates - failed, options.timeout)
+    finished = time.perf_counter()
+
+    latencies = {}
+    replied = set()
+    for sent_at, data in list(telegram.sent):
+        chat_id = data['chat_id']
+        if chat_id in posted and chat_id not in replied:
+            replied.add(chat_id)
+            posted_at, command = posted[chat_id]
+            latencies.setdefault(command, []).append(sent_at - posted_at)
+    every_latency = [
+        latency for values in latencies.values() for latency in values
+    ]
+    bot.stop()
+    telegram.stop()
+    trello.stop()
+
+    throughput = len(replied) / (finished - started)
+    if shards is not None:
+        print(f'shards:            {shards}')
+    print(f'updates sent:      {options.updates} at {options.rate}/s')
+    print(f'posts failed:      {failed}')
+    print(f'replies received:  {len(replied)}')
+    print(f'throughput:        {throughput:.1f} updates/s')
+    for command, values in sorted(latencies.items()) + [
+            ('all', every_latency),
+    ]:
+        print(
+            f'latency {command:<10} '
+            f'p50 {percentile(values, 0.5) * 1000:7.1f}ms  '
+            f'p95 {percentile(values, 0.95) * 1000:7.1f}ms  '
+            f'p99 {percentile(values, 0.99) * 1000:7.1f}ms'
+        )
+    print('telegram calls:    ' + ', '.join(
+        f'{name}={count}' for name, count in sorted(telegram.calls.items())
+    ))
+    print('trello calls:      ' + ', '.join(
+        f'{name}={count}' for name, count in sorted(trello.calls.items())
+    ))
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    if shards is None:
+        print(f'peak RSS:          {peak_rss:.1f}MB')
+    else:
+        # Only the largest child is reported, the workers can not be summed.
+        worker_rss = resource.getrusage(
+            resource.RUSAGE_CHILDREN,
+        ).ru_maxrss / 1024
+        print(f'peak RSS:          {peak_rss:.1f}MB front process only')
+        print(f'worker peak RSS:   {worker_rss:.1f}MB largest worker so far')
+    if options.verbose and shards is None:
+        print(registry.summary())
+    return throughput, every_latency
+
+
+def compare_shards(options):
+    throughputs = {}
+    for shards in options.shards:
+        throughputs[shards], _ = run(options, shards)
+        print()
+    baseline = throughputs[options.shards[0]]
+    for shards, throughput in throughputs.items():
+        print(
+            f'{shards} shards: {throughput:8.1f} updates/s  '
+            f'x{throughput / baseline:.2f}'
+        )
+
+
+def parse_options(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('--rate', type=float, default=50)
+    parser.add_argument('--updates', type=int, default=500)
+    parser.add_argument('--mix', nargs='+', default=default_mix)
+    parser.add_argument('--telegram-latency', type=float, default=0.02)
+    parser.add_argument('--trello-latency', type=float, default=0.1)
+    parser.add_argument('--global-rate', type=int, default=1000)
+    parser.add_argument('--boards', type=int, default=5)
+    parser.add_argument('--lists', type=int, default=15)
+    parser.add_argument('--cards', type=int, default=10)
+    parser.add_argument('--senders', type=int, default=8)
+    parser.add_argument('--timeout', type=float, default=60)
+    parser.add_argument('--shards', type=int, nargs='+')
+    parser.add_argument('--verbose', action='store_true')
+    return parser.parse_args(args)
+
+
+if __name__ == '__main__':
+    options = parse_options()
+    if options.shards is None:
+        run(options)
+    else:
+        compare_shards(options)
@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+'''
+Cost of finding the handler of a command, scanning the handlers like the
+dispatcher does, or looking it up in the command router.
+
+Usage: benchmarks/command_routing.py [commands...]
+'''
+import sys
+import time
+
+from telegram import Update
+from telegram.ext import CommandHandler
+
+from reventlov.bot_router import CommandRouter
+
+
+class BotInterface(object):
+    username = 'reventlovbot'
+
+
+class Dispatcher(object):
+    bot = BotInterface()
+
+
+def command_update(text):
+    return Update.de_json({
+        'update_id': 1,
+        'message': {
+            'message_id': 1,
+            'date': 0,
+            'text': text,
+            'chat': {'id': 1, 'type': 'private'},
+        },
+    }, BotInterface())
+
+
+def scan(handlers, update):
+    for handler in handlers:
+        if handler.check_update(update):
+            return handler
+    return None
+
+
+def per_call(find, update, rounds=2000):
+    started = time.perf_counter()
+    for _ in range(rounds):
+        find(update)
+    return (time.perf_counter() - started) / rounds
+
+
+def run(counts):
+    print(f'{"commands":>8}  {"scan":>10}  {"router":>10}')
+    for count in counts:
+        handlers = [
+            CommandHandler(f'command{number}', None)
+            for number in range(count)
+        ]
+        router = CommandRouter(Dispatcher())
+        for handler in handlers:
+            router.add_handler(handler)
+        # The last command registered is the worst case of the scan.
+        update = command_update(f'/command{count - 1} now')
+        assert scan(handlers, update) is router.find(update)
+        print(
+            f'{count:>8}  '
+            f'{per_call(lambda u: scan(handlers, u), update) * 1e6:>8.1f}us  '
+            f'{per_call(router.find, update) * 1e6:>8.1f}us'
+        )
+
+
+if __name__ == '__main__':
+    run([int(count) for count in sys.argv[1:]] or [10, 100, 500])
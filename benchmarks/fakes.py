@@ -0,0 +1,227 @@
+'''
+Local stand-ins of the Telegram Bot API and the Trello REST API.
+
+Both servers answer after an injected `latency` and count the calls they
+get per endpoint, so benchmarks can run offline against a real `Bot`.
+'''
+import json
+import re
+import threading
+import time
+import urllib.request
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import urlparse
+
+bot_user = {
+    'id': 1,
+    'is_bot': True,
+    'first_name': 'R. Giskard Reventlov',
+    'username': 'reventlovbot',
+}
+
+
+def object_id(kind, number):
+    return f'{kind:08x}{number:016x}'
+
+
+def telegram_update(update_id, text, chat_id, username='bench'):
+    command = text.split()[0]
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': int(time.time()),
+            'text': text,
+            'entities': [{
+                'type': 'bot_command',
+                'offset': 0,
+                'length': len(command),
+            }],
+            'chat': {'id': chat_id, 'type': 'private'},
+            'from': {
+                'id': chat_id,
+                'is_bot': False,
+                'first_name': 'Bench',
+                'username': username,
+            },
+        },
+    }
+
+
+class FakeRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def reply_json(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def read_json(self):
+        length = int(self.headers.get('Content-Length', 0))
+        if length == 0:
+            return {}
+        return json.loads(self.rfile.read(length).decode())
+
+    def handle_call(self, method):
+        path = urlparse(self.path).path
+        self.server.count(path)
+        time.sleep(self.server.latency)
+        status, payload = self.server.answer(method, path, self.read_json())
+        self.reply_json(status, payload)
+
+    def do_GET(self):
+        self.handle_call('GET')
+
+    def do_POST(self):
+        self.handle_call('POST')
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, latency=0.0):
+        super().__init__(('127.0.0.1', 0), FakeRequestHandler)
+        self.latency = latency
+        self.calls = Counter()
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.server_address[1]}'
+
+    def endpoint(self, path):
+        return path
+
+    def count(self, path):
+        with self.lock:
+            self.calls[self.endpoint(path)] += 1
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class FakeTelegram(FakeServer):
+    '''
+    Fake Bot API recording every message sent, and the time it arrived.
+    '''
+    def __init__(self, latency=0.0):
+        super().__init__(latency)
+        self.sent = []
+        self.message_ids = iter(range(1, 1 << 62))
+
+    @property
+    def base_url(self):
+        return f'{self.url}/bot'
+
+    def endpoint(self, path):
+        return path.rsplit('/', 1)[-1]
+
+    def answer(self, method, path, data):
+        api_method = self.endpoint(path)
+        if api_method == 'getMe':
+            return 200, {'ok': True, 'result': bot_user}
+        if api_method == 'sendMessage':
+            with self.lock:
+                self.sent.append((time.perf_counter(), data))
+                message_id = next(self.message_ids)
+            return 200, {'ok': True, 'result': {
+                'message_id': message_id,
+                'date': int(time.time()),
+                'chat': {'id': data['chat_id'], 'type': 'private'},
+                'text': data.get('text', ''),
+            }}
+        if api_method in ('setWebhook', 'deleteWebhook'):
+            return 200, {'ok': True, 'result': True}
+        return 404, {'ok': False, 'error_code': 404, 'description': 'Nope'}
+
+    def post_update(self, webhook_url, update):
+        request = urllib.request.Request(
+            webhook_url,
+            data=json.dumps(update).encode(),
+            headers={'Content-Type': 'application/json'},
+            method='POST',
+        )
+        return urllib.request.urlopen(request).status
+
+
+class FakeTrello(FakeServer):
+    '''
+    Fake Trello API with one organization holding `boards` boards of
+    `lists` lists and `cards` cards each.
+    '''
+    def __init__(self, latency=0.0, boards=5, lists=15, cards=10):
+        super().__init__(latency)
+        self.org = {
+            'id': object_id(0, 1),
+            'name': 'bench',
+            'url': 'https://trello.com/bench',
+        }
+        self.boards = {}
+        for board_number in range(boards):
+            board_id = object_id(1, board_number)
+            columns = [
+                {
+                    'id': object_id(2, board_number * 10000 + list_number),
+                    'name': f'List {list_number}',
+                    'pos': list_number,
+                    'closed': False,
+                }
+                for list_number in range(lists)
+            ]
+            self.boards[board_id] = {
+                'id': board_id,
+                'name': f'Board{board_number}',
+                'closed': False,
+                'url': f'https://trello.com/b/{board_id}',
+                'lists': columns,
+                'cards': [
+                    {
+                        'id': object_id(3, board_number * 10000000 + number),
+                        'name': f'Card {number}',
+                        'desc': '',
+                        'idList': columns[number % lists]['id'],
+                        'pos': number,
+                        'closed': False,
+                    }
+                    for number in range(lists * cards)
+                ],
+            }
+
+    @property
+    def api_url(self):
+        return f'{self.url}/1'
+
+    def endpoint(self, path):
+        return re.sub(r'/[0-9a-f]{24}(?=/|$)', '/{id}', path)
+
+    def answer(self, method, path, data):
+        parts = path.strip('/').split('/')[1:]
+        if parts == ['members', 'me', 'organizations']:
+            return 200, [self.org]
+        if parts[:1] == ['organizations'] and parts[2:] == ['boards']:
+            return 200, [
+                {key: board[key] for key in ('id', 'name', 'closed', 'url')}
+                for board in self.boards.values()
+            ]
+        if parts[:1] == ['boards'] and parts[1] in self.boards:
+            board = self.boards[parts[1]]
+            if parts[2:] == ['dateLastActivity']:
+                return 200, {'_value': None}
+            if parts[2:] == []:
+                return 200, board
+            if parts[2:] == ['lists']:
+                return 200, board['lists']
+        return 404, {'message': 'not found'}
@@ -0,0 +1,45 @@
+#!/usr/bin/env python
+'''
+Memory and tick cost of pomodoro cycles driven by the shared ticker.
+
+Usage: benchmarks/pomodoro_cycles.py [sessions]
+'''
+import sys
+import time
+import tracemalloc
+
+from reventlov.plugins.pomodoro.cycles import CycleConfig, CycleTicker
+
+
+def run(sessions):
+    ticker = CycleTicker(lambda advanced: None)
+    config = CycleConfig(work=60, short_break=10, long_break=30)
+    now = 0.0
+
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    for chat_id in range(sessions):
+        ticker.start_cycle(chat_id, config, now=now + chat_id % 60)
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    allocated = sum(
+        stat.size_diff for stat in after.compare_to(before, 'filename')
+    )
+
+    ticks = []
+    advanced = 0
+    for second in range(1, 121):
+        started = time.perf_counter()
+        advanced += len(ticker.advance(now + second))
+        ticks.append(time.perf_counter() - started)
+    ticks.sort()
+
+    print(f'sessions:              {sessions}')
+    print(f'memory per session:    {allocated / sessions:.0f} bytes')
+    print(f'phase changes:         {advanced}')
+    print(f'tick p50:              {ticks[len(ticks) // 2] * 1000:.2f}ms')
+    print(f'tick max:              {ticks[-1] * 1000:.2f}ms')
+
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
@@ -1,12 +1,39 @@
 #!/usr/bin/env python
 from reventlov.bot import Bot
+from reventlov.bot_plugins import get_int_from_environment
+from reventlov.bot_plugins import get_list_from_environment
+from reventlov.bot_shards import ShardedBot
+from reventlov.bot_tenants import TenantBots
 import logging
+import signal
+import threading
 
 logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
     level=logging.INFO,
 )
 
+
+def wait_for_signal(*signums):
+    stopped = threading.Event()
+    for signum in signums:
+        signal.signal(signum, lambda signum, frame: stopped.set())
+    while not stopped.wait(1):
+        pass
+
+
 if __name__ == '__main__':
-    bot = Bot()
+    tenants = get_list_from_environment('REVENTLOV_TENANTS')
+    shards = get_int_from_environment('REVENTLOV_SHARDS', 1)
+    if len(tenants) > 0:
+        bot = TenantBots(tenants)
+    elif shards > 1:
+        bot = ShardedBot(shards)
+    else:
+        bot = Bot()
     bot.run()
+    # Stopping flushes the chat and user data and the update offset, which
+    # would be lost on deploys otherwise.
+    wait_for_signal(signal.SIGINT, signal.SIGTERM)
+    logging.getLogger(__name__).info('Stopping')
+    bot.stop()
@@ -1,40 +1,183 @@
-import os
 import logging
+import sys
+import threading
 
-from telegram import ParseMode
-from telegram.ext import Updater, CommandHandler
+from telegram import ParseMode, Update
+from telegram.ext import Updater, CommandHandler, TypeHandler
+from telegram.utils.request import Request
 
-from reventlov.bot_plugins import BotPlugins, get_list_from_environment
+from reventlov.bot_admission import AdmissionControl
+from reventlov.bot_admission import get_costs_from_environment
+from reventlov.bot_identity import BotIdentity
+from reventlov.bot_loop import event_loop
+from reventlov.bot_metrics import MetricsServer, registry
+from reventlov.bot_messages import BotMessages
+from reventlov.bot_outbox import Outbox, QueuedBot
+from reventlov.bot_state import BotState, SQLiteStateBackend
+from reventlov.bot_updates import UpdateStore, UpdateTracker
+from reventlov.bot_webhook import TelegramWebhookServer
+from reventlov.bot_plugins import BotPlugins
+from reventlov.bot_plugins import get_from_environment
+from reventlov.bot_plugins import get_int_from_environment
+from reventlov.bot_plugins import get_list_from_environment
+from reventlov.bot_plugins import get_path_from_environment
+from reventlov.bot_resources import shared_resources
+from reventlov.bot_router import CommandRouter
 
 logger = logging.getLogger(__name__)
 
 
 class Bot(object):
-    def __init__(self):
-        self.updater = Updater(token=os.getenv('TELEGRAM_BOT_TOKEN'))
-        self.admins = get_list_from_environment('TELEGRAM_BOT_ADMINS')
-        self.dispatcher.add_handler(CommandHandler('start', self.start))
-        self.dispatcher.add_handler(CommandHandler('help', self.help))
-        self.dispatcher.add_handler(CommandHandler('settings', self.settings))
-        self.dispatcher.add_handler(CommandHandler(
-            'enable_plugin',
-            self.enable_plugin,
-            pass_args=True,
-        ))
-        self.dispatcher.add_handler(CommandHandler(
+    def __init__(self, tenant=None):
+        self.tenant = tenant
+        workers = self.int_setting('TELEGRAM_BOT_WORKERS', 4)
+        self.outbox = Outbox(
+            global_rate=self.int_setting(
+                'TELEGRAM_OUTBOX_GLOBAL_RATE',
+                30,
+            ),
+            chat_rate=self.int_setting('TELEGRAM_OUTBOX_CHAT_RATE', 1),
+            group_rate=self.int_setting(
+                'TELEGRAM_OUTBOX_GROUP_RATE',
+                20,
+            ) / 60,
+            workers=self.int_setting('TELEGRAM_OUTBOX_WORKERS', 4),
+        )
+        self.updater = Updater(
+            bot=QueuedBot(
+                self.setting('TELEGRAM_BOT_TOKEN'),
+                self.outbox,
+                base_url=self.setting('TELEGRAM_BOT_API_URL'),
+                request=Request(con_pool_size=workers + 4),
+            ),
+            workers=workers,
+        )
+        self.router = CommandRouter(self.dispatcher)
+        self.dispatcher.add_handler(self.router)
+        self.updates = UpdateTracker(
+            UpdateStore(get_path_from_environment(
+                'TELEGRAM_UPDATES_DB',
+                'updates.db',
+                tenant,
+            )),
+            window=self.int_setting('TELEGRAM_DEDUP_WINDOW', 600),
+        )
+        self.dispatcher.add_handler(
+            TypeHandler(Update, self.updates.track),
+            group=-2,
+        )
+        # Last group, so offsets are saved once the update went through.
+        self.dispatcher.add_handler(
+            TypeHandler(Update, self.updates.processed),
+            group=sys.maxsize,
+        )
+        self.state = BotState(
+            SQLiteStateBackend(get_path_from_environment(
+                'REVENTLOV_STATE_DB',
+                'state.db',
+                tenant,
+            )),
+            capacity=self.int_setting('REVENTLOV_STATE_CACHE', 10000),
+            interval=self.int_setting('REVENTLOV_STATE_FLUSH', 1),
+        )
+        self.dispatcher.chat_data = self.state.chat_data
+        self.dispatcher.user_data = self.state.user_data
+        self.webhook_server = None
+        self.peers = None
+        self.admins = get_list_from_environment('TELEGRAM_BOT_ADMINS', tenant)
+        self.identity = BotIdentity(
+            self.bot,
+            self.int_setting('TELEGRAM_BOT_IDENTITY_REFRESH', 3600),
+            on_change=self.invalidate_messages,
+        )
+        self.metrics_server = None
+        self.core_commands = []
+        self.add_command('start', self.start)
+        self.add_command('help', self.help)
+        self.add_command('settings', self.settings)
+        self.add_command('enable_plugin', self.enable_plugin, pass_args=True)
+        self.add_command(
             'disable_plugin',
             self.disable_plugin,
             pass_args=True,
+        )
+        self.add_command('stats', self.stats)
+        self.admission_costs = get_costs_from_environment(
+            self.setting('REVENTLOV_ADMISSION_COSTS'),
+        )
+        self.admission_queue = self.int_setting(
+            'REVENTLOV_ADMISSION_QUEUE',
+            100,
+        )
+        self.admission = AdmissionControl(
+            cost=self.command_cost,
+            core=self.core_commands,
+            admins=self.admins,
+            user_rate=self.int_setting(
+                'REVENTLOV_ADMISSION_USER_RATE',
+                1,
+            ),
+            user_burst=self.int_setting(
+                'REVENTLOV_ADMISSION_USER_BURST',
+                5,
+            ),
+            chat_rate=self.int_setting(
+                'REVENTLOV_ADMISSION_CHAT_RATE',
+                3,
+            ),
+            chat_burst=self.int_setting(
+                'REVENTLOV_ADMISSION_CHAT_BURST',
+                10,
+            ),
+            shed_cost=self.int_setting(
+                'REVENTLOV_ADMISSION_SHED_COST',
+                2,
+            ),
+            overloaded=self.overloaded,
+        )
+        self.dispatcher.add_handler(
+            TypeHandler(Update, self.admission.check),
+            group=-1,
+        )
+        self.plugins = BotPlugins(self.router, tenant)
+        self.messages = BotMessages(self.plugins)
+        self.messages.register('start', self.build_start_message)
+        self.messages.register('help', self.build_help_message)
+        self.messages.register('admin_help', self.build_admin_help_message)
+        self.messages.register('settings', self.build_settings_message)
+
+    def setting(self, env_var_name, default=None):
+        return get_from_environment(env_var_name, default, self.tenant)
+
+    def int_setting(self, env_var_name, default=0):
+        return get_int_from_environment(env_var_name, default, self.tenant)
+
+    def add_command(self, command, callback, **kwargs):
+        self.core_commands.append(command)
+        self.router.add_handler(CommandHandler(
+            command,
+            registry.instrument('core', command, callback, self.tenant),
+            **kwargs
         ))
-        self.plugins = BotPlugins(self.dispatcher)
+
+    def command_cost(self, command):
+        if command in self.admission_costs:
+            return self.admission_costs[command]
+        return self.plugins.command_costs.get(command, 1)
+
+    def overloaded(self):
+        return self.dispatcher.update_queue.qsize() >= self.admission_queue
+
+    def invalidate_messages(self):
+        self.messages.invalidate()
 
     @property
     def name(self):
-        return self.bot.get_me()['first_name']
+        return self.identity.name
 
     @property
     def username(self):
-        return self.bot.get_me()['username']
+        return self.identity.username
 
     @property
     def bot(self):
@@ -46,6 +189,9 @@ class Bot(object):
 
     @property
     def start_message(self):
+        return self.messages['start']
+
+    def build_start_message(self):
         msg = f'I am {self.name} (@{self.username})'
         features_msg = ''
         for feature_desc in self.plugins.feature_descs:
@@ -64,7 +210,8 @@ class Bot(object):
     @property
     def admin_help_message(self):
         msg = f'\n-/enable\_plugin: `plugin_name` Enable `plugin_name`' \
-              f'\n-/disable\_plugin: `plugin_name` Disable `plugin_name`'
+              f'\n-/disable\_plugin: `plugin_name` Disable `plugin_name`' \
+              f'\n-/stats: View my performance figures.'
         return msg
 
     @property
@@ -74,6 +221,18 @@ class Bot(object):
             msg = f'{msg}\n-{command}: {message}'
         return msg
 
+    def build_help_message(self):
+        return self.help_message + self.plugin_help_messages
+
+    def build_admin_help_message(self):
+        return self.help_message + self.admin_help_message + \
+            self.plugin_help_messages
+
+    def build_settings_message(self):
+        return 'Here is a list of my settings:' \
+               f'\n- `enabled_plugins`: {self.enabled_plugins}' \
+               f'\n- `disabled_plugins`: {self.disabled_plugins}'
+
     @property
     def disabled_plugins(self):
         return ', '.join(sorted(self.plugins.disabled_plugins))
@@ -102,10 +261,10 @@ class Bot(object):
         The list might include many different kinds of help text from all the
         different plugins loaded.
         '''
-        msg = self.help_message
         if update.message.from_user.username in self.admins:
-            msg += self.admin_help_message
-        msg += self.plugin_help_messages
+            msg = self.messages['admin_help']
+        else:
+            msg = self.messages['help']
         bot.send_message(
             chat_id=update.message.chat_id,
             text=msg,
@@ -118,9 +277,7 @@ class Bot(object):
 
         These settings can include loaded plugins' settings.
         '''
-        msg = 'Here is a list of my settings:' \
-              f'\n- `enabled_plugins`: {self.enabled_plugins}' \
-              f'\n- `disabled_plugins`: {self.disabled_plugins}'
+        msg = self.messages['settings']
         bot.send_message(
             chat_id=update.message.chat_id,
             text=msg,
@@ -136,8 +293,9 @@ class Bot(object):
         msg = ''
         if update.message.from_user.username in self.admins:
             if len(args) == 1:
-                if args[0] in self.disabled_plugins:
+                if args[0] in self.plugins.disabled_plugins:
                     self.plugins.enable(args[0])
+                    self.publish_plugin_change('enable', args[0])
                     msg = f'Plugin {args[0]} enabled'
                 else:
                     msg = f'Plugin {args[0]} is not disabled'
@@ -159,8 +317,9 @@ class Bot(object):
         msg = ''
         if update.message.from_user.username in self.admins:
             if len(args) == 1:
-                if args[0] in self.enabled_plugins:
+                if args[0] in self.plugins.enabled_plugins:
                     self.plugins.disable(args[0])
+                    self.publish_plugin_change('disable', args[0])
                     msg = f'Plugin {args[0]} disabled'
                 else:
                     msg = f'Plugin {args[0]} is not enabled'
@@ -173,6 +332,163 @@ class Bot(object):
             text=msg,
         )
 
+    def publish_plugin_change(self, action, plugin_name):
+        if self.peers is not None:
+            self.peers.publish(action, plugin_name)
+
+    def apply_plugin_change(self, action, plugin_name):
+        '''
+        Enable or disable a plugin as a peer process did.
+        '''
+        if action == 'enable' and plugin_name in self.plugins.disabled_plugins:
+            self.plugins.enable(plugin_name)
+        elif action == 'disable' and plugin_name in self.plugins.plugins:
+            self.plugins.disable(plugin_name)
+
+    @property
+    def gauges(self):
+        gauges = {
+            f'outbox_{name}': value
+            for name, value in self.outbox.stats.items()
+        }
+        for plugin_name, stats in self.plugins.bulkhead_stats.items():
+            for name, value in stats.items():
+                gauges[f'bulkhead_{name}{{plugin="{plugin_name}"}}'] = value
+        gauges.update(self.plugins.gauges)
+        gauges['get_me_calls_avoided'] = self.identity.avoided_calls
+        gauges['duplicate_updates'] = self.updates.duplicates
+        gauges.update({
+            f'admission_{name}': value
+            for name, value in self.admission.stats.items()
+        })
+        gauges.update({
+            f'state_{name}': value
+            for name, value in self.state.stats.items()
+        })
+        return gauges
+
+    def stats(self, bot, update):
+        '''
+        View my performance figures.
+
+        Call counts, errors and latencies of commands and upstream calls.
+        '''
+        if update.message.from_user.username in self.admins:
+            msg = registry.summary(self.tenant) + '\nOutbox:\n' + '\n'.join([
+                f'- {name}: {value}'
+                for name, value in self.outbox.stats.items()
+            ]) + '\nBulkheads:\n' + '\n'.join([
+                f'- {plugin_name}: ' + ', '.join([
+                    f'{name} {value}' for name, value in stats.items()
+                ])
+                for plugin_name, stats in self.plugins.bulkhead_stats.items()
+            ])
+        else:
+            msg = 'You must be admin to view stats'
+        bot.send_message(
+            chat_id=update.message.chat_id,
+            text=msg,
+        )
+
+    def start_metrics_server(self):
+        self.metrics_server = MetricsServer(
+            (
+                self.setting('REVENTLOV_METRICS_LISTEN', '127.0.0.1'),
+                self.int_setting('REVENTLOV_METRICS_PORT'),
+            ),
+            gauges=lambda: self.gauges,
+        )
+        self.metrics_server.start()
+
     def run(self):
+        # Tenant bots are served metrics by their host.
+        if self.tenant is None and \
+                self.setting('REVENTLOV_METRICS_PORT') is not None:
+            self.start_metrics_server()
+        self.outbox.start()
+        self.state.start()
+        self.updates.start()
+        self.identity.fetch()
+        self.identity.schedule(self.updater.job_queue)
         logger.info(f'I am {self.name} (@{self.username})')
-        self.updater.start_polling()
+        mode = self.setting('TELEGRAM_BOT_MODE', 'polling')
+        if mode == 'webhook':
+            self.start_webhook()
+        elif mode == 'worker':
+            self.start_dispatcher()
+        else:
+            self.updater.last_update_id = self.updates.offset + 1
+            self.updater.start_polling()
+
+    def start_webhook(self):
+        '''
+        Serve the webhook, on a server shared with the bots of other
+        tenants listening to the same address.
+        '''
+        address = (
+            self.setting('TELEGRAM_WEBHOOK_LISTEN', '0.0.0.0'),
+            self.int_setting(
+                'TELEGRAM_WEBHOOK_PORT',
+                self.int_setting('PORT', 8443),
+            ),
+        )
+        self.webhook_path = self.setting(
+            'TELEGRAM_WEBHOOK_PATH',
+            self.setting('TELEGRAM_BOT_TOKEN', ''),
+        )
+        self.webhook_key = ('telegram-webhook',) + address
+        self.webhook_server = shared_resources.acquire(
+            self.webhook_key,
+            lambda: TelegramWebhookServer(
+                address,
+                self.bot,
+                self.dispatcher.update_queue,
+                url_path=self.webhook_path,
+                workers=self.int_setting('TELEGRAM_WEBHOOK_WORKERS', 4),
+                max_body_size=self.int_setting(
+                    'TELEGRAM_WEBHOOK_MAX_BODY',
+                    1 << 20,
+                ),
+            ),
+        )
+        self.webhook_server.add_route(
+            self.webhook_path,
+            self.bot,
+            self.dispatcher.update_queue,
+        )
+        self.start_dispatcher()
+        self.webhook_server.start()
+        webhook_url = self.setting('TELEGRAM_WEBHOOK_URL')
+        if webhook_url is not None:
+            self.bot.set_webhook(url=webhook_url)
+
+    def start_dispatcher(self):
+        '''
+        Handle updates put in the update queue by someone else.
+        '''
+        self.updater.job_queue.start()
+        dispatcher_ready = threading.Event()
+        threading.Thread(
+            target=self.dispatcher.start,
+            name='dispatcher',
+            kwargs={'ready': dispatcher_ready},
+        ).start()
+        dispatcher_ready.wait()
+        self.updater.running = True
+
+    def stop(self):
+        if self.webhook_server is not None:
+            self.webhook_server.remove_route(self.webhook_path)
+            shared_resources.release(
+                self.webhook_key,
+                TelegramWebhookServer.stop,
+            )
+        if self.metrics_server is not None:
+            self.metrics_server.stop()
+        self.updater.stop()
+        self.plugins.stop()
+        if self.tenant is None:
+            event_loop.stop()
+        self.outbox.stop()
+        self.state.stop()
+        self.updates.close()
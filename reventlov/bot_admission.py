@@ -0,0 +1,162 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from telegram.ext import DispatcherHandlerStop
+
+from reventlov.bot_metrics import registry
+from reventlov.bot_outbox import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+
+def command_of(update):
+    message = update.effective_message
+    text = '' if message is None else message.text or ''
+    words = text[1:].split()
+    if not text.startswith('/') or len(words) == 0:
+        return None
+    return words[0].split('@')[0].lower()
+
+
+def get_costs_from_environment(value):
+    '''
+    Command costs from a `command=cost,...` setting.
+    '''
+    costs = {}
+    for item in (value or '').split(','):
+        if '=' in item:
+            command, cost = item.split('=', 1)
+            costs[command.strip().lstrip('/')] = int(cost)
+    return costs
+
+
+class AdmissionControl(object):
+    '''
+    Admits or sheds updates before the dispatcher handles them.
+
+    Every command costs `cost(command)` tokens from a bucket of its user
+    and one of its chat, and is shed when they hold not enough tokens.
+    While `overloaded()`, commands costing `shed_cost` or more are shed
+    right away. Admins, `core` commands and updates other than commands
+    are always admitted. Users get one cheap reply per run of shed
+    commands. Only the `max_buckets` most recently used buckets of each
+    kind are kept.
+    '''
+    shed_message = 'Slow down please, I will not answer that right now'
+
+    def __init__(
+            self,
+            cost=lambda command: 1,
+            core=(),
+            admins=(),
+            user_rate=1,
+            user_burst=5,
+            chat_rate=3,
+            chat_burst=10,
+            shed_cost=2,
+            overloaded=lambda: False,
+            max_buckets=10000,
+    ):
+        self.cost = cost
+        self.core = set(core)
+        self.admins = set(admins)
+        self.user_rate = user_rate
+        self.user_burst = user_burst
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.shed_cost = shed_cost
+        self.overloaded = overloaded
+        self.max_buckets = max_buckets
+        self.user_buckets = OrderedDict()
+        self.chat_buckets = OrderedDict()
+        self.warned = set()
+        self.admitted = 0
+        self.shed = {'user': 0, 'chat': 0, 'overload': 0}
+        self.lock = threading.Lock()
+
+    def bucket(self, buckets, key, rate, burst):
+        bucket = buckets.get(key)
+        if bucket is not None:
+            buckets.move_to_end(key)
+            return bucket
+        bucket = buckets[key] = TokenBucket(rate, burst)
+        while len(buckets) > self.max_buckets:
+            buckets.popitem(last=False)
+        return bucket
+
+    def admit(self, user_id, chat_id, username, command, now=None):
+        '''
+        Whether to handle an update, or the reason to shed it.
+        '''
+        if command is None or command in self.core or \
+                username in self.admins:
+            return None
+        cost = self.cost(command)
+        if cost >= self.shed_cost and self.overloaded():
+            return 'overload'
+        now = time.monotonic() if now is None else now
+        buckets = []
+        if user_id is not None:
+            buckets.append(('user', self.bucket(
+                self.user_buckets,
+                user_id,
+                self.user_rate,
+                self.user_burst,
+            )))
+        if chat_id is not None and chat_id != user_id:
+            buckets.append(('chat', self.bucket(
+                self.chat_buckets,
+                chat_id,
+                self.chat_rate,
+                self.chat_burst,
+            )))
+        for reason, bucket in buckets:
+            if bucket.delay(now, min(cost, bucket.capacity)) > 0:
+                return reason
+        for _, bucket in buckets:
+            bucket.take(now, min(cost, bucket.capacity))
+        return None
+
+    def check(self, bot, update):
+        '''
+        Dispatcher callback stopping shed commands before any handler.
+        '''
+        command = command_of(update)
+        if command is None:
+            return
+        user = update.effective_user
+        chat = update.effective_chat
+        user_id = None if user is None else user.id
+        with self.lock:
+            reason = self.admit(
+                user_id,
+                None if chat is None else chat.id,
+                None if user is None else user.username,
+                command,
+            )
+            if reason is None:
+                self.admitted += 1
+                self.warned.discard(user_id)
+                return
+            self.shed[reason] += 1
+            warn = user_id not in self.warned
+            self.warned.add(user_id)
+            if len(self.warned) > self.max_buckets:
+                self.warned = {user_id}
+        registry.count('admission', command, f'shed_{reason}')
+        logger.info(f'Shedding update {update.update_id} ({reason})')
+        if warn and update.effective_message is not None:
+            update.effective_message.reply_text(self.shed_message)
+        raise DispatcherHandlerStop()
+
+    @property
+    def stats(self):
+        with self.lock:
+            stats = {'admitted': self.admitted}
+            stats.update({
+                f'shed_{reason}': count
+                for reason, count in self.shed.items()
+            })
+            return stats
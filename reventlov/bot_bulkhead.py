@@ -0,0 +1,76 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+class BulkheadFull(Exception):
+    pass
+
+
+class Bulkhead(object):
+    '''
+    Bounded pool of worker threads for the blocking handlers of a plugin.
+
+    At most `workers` calls run at once and `queue_size` more wait for a
+    free worker. Calls beyond that are rejected, so a plugin stuck on a slow
+    upstream cannot take the dispatcher threads, or other plugins' workers,
+    with it.
+    '''
+    def __init__(self, name, workers=4, queue_size=16):
+        self.name = name
+        self.workers = workers
+        self.queue_size = queue_size
+        self.executor = ThreadPoolExecutor(
+            max_workers=workers,
+            thread_name_prefix=f'{name}-bulkhead',
+        )
+        self.slots = threading.BoundedSemaphore(workers + queue_size)
+        self.lock = threading.Lock()
+        self.queued = 0
+        self.active = 0
+        self.completed = 0
+        self.rejected = 0
+
+    def run(self, callback, args, kwargs):
+        with self.lock:
+            self.queued -= 1
+            self.active += 1
+        try:
+            return callback(*args, **kwargs)
+        except Exception:
+            logger.exception(f'Call failed in the {self.name} bulkhead')
+            raise
+        finally:
+            with self.lock:
+                self.active -= 1
+                self.completed += 1
+            self.slots.release()
+
+    def submit(self, callback, *args, **kwargs):
+        '''
+        Run `callback` in a worker, or return None if the bulkhead is full.
+        '''
+        if not self.slots.acquire(blocking=False):
+            with self.lock:
+                self.rejected += 1
+            logger.warning(f'The {self.name} bulkhead is full')
+            return None
+        with self.lock:
+            self.queued += 1
+        return self.executor.submit(self.run, callback, args, kwargs)
+
+    @property
+    def stats(self):
+        with self.lock:
+            return {
+                'workers': self.workers,
+                'active': self.active,
+                'queued': self.queued,
+                'completed': self.completed,
+                'rejected': self.rejected,
+            }
+
+    def shutdown(self, wait=True):
+        self.executor.shutdown(wait=wait)
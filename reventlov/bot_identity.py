@@ -0,0 +1,69 @@
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class BotIdentity(object):
+    '''
+    Cached result of `get_me` for a Telegram bot.
+
+    The identity is fetched once, refreshed every `refresh_interval` seconds
+    from the job queue, and can be invalidated to force a new fetch on next
+    access. `on_change` is called when the identity is invalidated or a
+    refresh finds a different name.
+    '''
+    def __init__(self, bot, refresh_interval=0, on_change=None):
+        self.bot = bot
+        self.refresh_interval = refresh_interval
+        self.on_change = on_change
+        self.avoided_calls = 0
+        self.__me = None
+        self.__lock = threading.Lock()
+
+    def fetch(self):
+        logger.info('Getting bot identity')
+        me = self.bot.get_me()
+        with self.__lock:
+            previous, self.__me = self.__me, me
+        if previous is not None and self.on_change and (
+            previous['first_name'] != me['first_name'] or
+            previous['username'] != me['username']
+        ):
+            self.on_change()
+        return me
+
+    def invalidate(self):
+        with self.__lock:
+            self.__me = None
+        if self.on_change:
+            self.on_change()
+
+    def refresh(self, bot, job):
+        self.fetch()
+
+    def schedule(self, job_queue):
+        if self.refresh_interval > 0:
+            job_queue.run_repeating(
+                self.refresh,
+                self.refresh_interval,
+                first=self.refresh_interval,
+            )
+
+    @property
+    def me(self):
+        with self.__lock:
+            me = self.__me
+            if me is not None:
+                self.avoided_calls += 1
+        if me is None:
+            me = self.fetch()
+        return me
+
+    @property
+    def name(self):
+        return self.me['first_name']
+
+    @property
+    def username(self):
+        return self.me['username']
@@ -0,0 +1,69 @@
+import asyncio
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class EventLoop(object):
+    '''
+    asyncio event loop running in its own thread, next to the dispatcher.
+
+    `async` plugin handlers are scheduled on it from the dispatcher thread,
+    so any number of them can wait on upstream calls at once without
+    holding a thread each. It is started on first use.
+    '''
+    def __init__(self):
+        self.loop = None
+        self.thread = None
+        self.lock = threading.Lock()
+
+    @property
+    def running(self):
+        return self.loop is not None and self.loop.is_running()
+
+    def start(self):
+        with self.lock:
+            if self.thread is not None:
+                return
+            self.loop = asyncio.new_event_loop()
+            started = threading.Event()
+            self.loop.call_soon(started.set)
+            self.thread = threading.Thread(
+                target=self.loop.run_forever,
+                name='event-loop',
+                daemon=True,
+            )
+            self.thread.start()
+        started.wait()
+
+    def submit(self, coroutine):
+        '''
+        Schedule `coroutine` on the loop from any thread.
+
+        Returns a `concurrent.futures.Future` of its result.
+        '''
+        self.start()
+        future = asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+        future.add_done_callback(self.log_failure)
+        return future
+
+    def log_failure(self, future):
+        if not future.cancelled() and future.exception() is not None:
+            logger.error(
+                'Coroutine failed in the event loop',
+                exc_info=future.exception(),
+            )
+
+    def stop(self):
+        with self.lock:
+            if self.thread is None:
+                return
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join()
+            self.loop.close()
+            self.loop = None
+            self.thread = None
+
+
+event_loop = EventLoop()
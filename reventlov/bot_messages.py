@@ -0,0 +1,74 @@
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+message_limit = 4096
+
+
+def iter_fitting_lines(lines, limit):
+    for line in lines:
+        while len(line) > limit:
+            yield line[:limit]
+            line = line[limit:]
+        yield line
+
+
+def iter_chunks(lines, limit=message_limit):
+    '''
+    Join `lines` into messages of at most `limit` characters.
+
+    Messages are cut between lines, only lines longer than `limit` are cut
+    in pieces. Each message is yielded as soon as it is full, so `lines`
+    can be produced lazily.
+    '''
+    chunk = []
+    size = 0
+    for line in iter_fitting_lines(lines, limit):
+        if len(chunk) > 0 and size + 1 + len(line) > limit:
+            yield '\n'.join(chunk)
+            chunk = []
+        if len(chunk) == 0 and line.strip() == '':
+            # Telegram refuses messages made of whitespace only.
+            continue
+        size = len(line) if len(chunk) == 0 else size + 1 + len(line)
+        chunk.append(line)
+    if len(chunk) > 0:
+        yield '\n'.join(chunk)
+
+
+class BotMessages(object):
+    '''
+    Registry of rendered bot messages.
+
+    Messages are built once and kept until the plugin set changes, as
+    reported by `plugins.generation`, or until `invalidate` is called.
+    '''
+    def __init__(self, plugins):
+        self.plugins = plugins
+        self.builders = {}
+        self.messages = {}
+        self.generation = None
+        self.builds = 0
+        self.lock = threading.Lock()
+
+    def register(self, name, builder):
+        self.builders[name] = builder
+
+    def invalidate(self):
+        with self.lock:
+            self.messages = {}
+
+    def get(self, name):
+        with self.lock:
+            if self.generation != self.plugins.generation:
+                self.messages = {}
+                self.generation = self.plugins.generation
+            if name not in self.messages:
+                logger.debug(f'Building {name} message')
+                self.messages[name] = self.builders[name]()
+                self.builds += 1
+            return self.messages[name]
+
+    def __getitem__(self, name):
+        return self.get(name)
@@ -0,0 +1,302 @@
+import asyncio
+import functools
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+logger = logging.getLogger(__name__)
+
+default_buckets = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+    float('inf'),
+)
+
+
+class Histogram(object):
+    '''
+    Latency histogram with fixed, Prometheus style, buckets.
+
+    Percentiles are estimated by interpolating inside the bucket holding
+    them.
+    '''
+    def __init__(self, buckets=default_buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+                break
+        self.count += 1
+        self.sum += value
+
+    def percentile(self, fraction):
+        if self.count == 0:
+            return 0.0
+        rank = fraction * self.count
+        seen = 0
+        lower = 0.0
+        for bound, count in zip(self.buckets, self.counts):
+            if count > 0 and seen + count >= rank:
+                if bound == float('inf'):
+                    return lower
+                return lower + (bound - lower) * (rank - seen) / count
+            seen += count
+            lower = bound
+        return lower
+
+
+class CallStats(object):
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.latency = Histogram()
+
+    def record(self, elapsed, failed):
+        self.calls += 1
+        if failed:
+            self.errors += 1
+        self.latency.observe(elapsed)
+
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"')
+
+
+def tenant_labels(tenant):
+    return () if tenant is None else (tenant,)
+
+
+class Metrics(object):
+    '''
+    Call counts, error counts and latencies of handlers and upstream calls.
+
+    Handlers are keyed by plugin and command, followed by the tenant for
+    tenant bots, upstream calls by service (`telegram`, `trello`) and
+    operation.
+    '''
+    def __init__(self):
+        self.handlers = {}
+        self.upstream = {}
+        self.counters = {}
+        self.lock = threading.Lock()
+
+    def record(self, table, key, elapsed, failed):
+        with self.lock:
+            stats = table.get(key)
+            if stats is None:
+                stats = table[key] = CallStats()
+            stats.record(elapsed, failed)
+
+    @contextmanager
+    def timed_call(self, table, key):
+        started = time.perf_counter()
+        failed = True
+        try:
+            yield
+            failed = False
+        finally:
+            self.record(table, key, time.perf_counter() - started, failed)
+
+    def instrument(self, plugin, command, callback, tenant=None):
+        key = (plugin, command) + tenant_labels(tenant)
+        if asyncio.iscoroutinefunction(callback):
+            @functools.wraps(callback)
+            async def instrumented_async(*args, **kwargs):
+                with self.timed_call(self.handlers, key):
+                    return await callback(*args, **kwargs)
+            return instrumented_async
+
+        @functools.wraps(callback)
+        def instrumented(*args, **kwargs):
+            with self.timed_call(self.handlers, key):
+                return callback(*args, **kwargs)
+        return instrumented
+
+    def timed(self, service, operation):
+        return self.timed_call(self.upstream, (service, operation))
+
+    def count(self, service, operation, name):
+        '''
+        Count an upstream event other than a call, e.g. a coalesced call.
+        '''
+        with self.lock:
+            key = (service, operation, name)
+            self.counters[key] = self.counters.get(key, 0) + 1
+
+    def describe(self, table, tenant=None):
+        labels = tenant_labels(tenant)
+        with self.lock:
+            return [
+                f'{"/".join(key[:2])}: {stats.calls} calls, '
+                f'{stats.errors} errors, '
+                f'p50 {stats.latency.percentile(0.5) * 1000:.0f}ms, '
+                f'p95 {stats.latency.percentile(0.95) * 1000:.0f}ms, '
+                f'p99 {stats.latency.percentile(0.99) * 1000:.0f}ms'
+                for key, stats in sorted(table.items())
+                if key[2:] == labels
+            ]
+
+    def plugin_totals(self, tenant=None):
+        labels = tenant_labels(tenant)
+        totals = {}
+        with self.lock:
+            for key, stats in self.handlers.items():
+                if key[2:] != labels:
+                    continue
+                calls, errors = totals.get(key[0], (0, 0))
+                totals[key[0]] = (calls + stats.calls, errors + stats.errors)
+        return totals
+
+    def summary(self, tenant=None):
+        '''
+        Figures of the handlers of `tenant`, or of the single bot.
+
+        Upstream calls are shared by all the tenants, so they are only
+        summarised for the single bot.
+        '''
+        lines = ['Handlers:']
+        lines.extend([
+            f'- {line}' for line in self.describe(self.handlers, tenant)
+        ])
+        lines.append('Plugins:')
+        lines.extend([
+            f'- {plugin}: {calls} calls, {errors} errors'
+            for plugin, (calls, errors)
+            in sorted(self.plugin_totals(tenant).items())
+        ])
+        if tenant is not None:
+            return '\n'.join(lines)
+        lines.append('Upstream:')
+        lines.extend([f'- {line}' for line in self.describe(self.upstream)])
+        with self.lock:
+            lines.extend([
+                f'- {service}/{operation}: {count} {name}'
+                for (service, operation, name), count
+                in sorted(self.counters.items())
+            ])
+        return '\n'.join(lines)
+
+    def render_table(self, name, table, labels):
+        lines = [
+            f'# TYPE {name}_calls_total counter',
+            f'# TYPE {name}_errors_total counter',
+            f'# TYPE {name}_seconds histogram',
+        ]
+        with self.lock:
+            for key, stats in sorted(table.items()):
+                label = ','.join(
+                    f'{label}="{escape_label(value)}"'
+                    for label, value in zip(labels, key)
+                )
+                lines.append(f'{name}_calls_total{{{label}}} {stats.calls}')
+                lines.append(f'{name}_errors_total{{{label}}} {stats.errors}')
+                cumulative = 0
+                for bound, count in zip(
+                        stats.latency.buckets,
+                        stats.latency.counts,
+                ):
+                    cumulative += count
+                    le = '+Inf' if bound == float('inf') else bound
+                    lines.append(
+                        f'{name}_seconds_bucket{{{label},le="{le}"}} '
+                        f'{cumulative}'
+                    )
+                lines.append(
+                    f'{name}_seconds_sum{{{label}}} {stats.latency.sum}'
+                )
+                lines.append(
+                    f'{name}_seconds_count{{{label}}} {stats.latency.count}'
+                )
+        return lines
+
+    def render_prometheus(self, gauges=None):
+        lines = self.render_table(
+            'reventlov_handler',
+            self.handlers,
+            ('plugin', 'command', 'tenant'),
+        )
+        lines.extend(self.render_table(
+            'reventlov_upstream',
+            self.upstream,
+            ('service', 'operation'),
+        ))
+        typed = set()
+        with self.lock:
+            for (service, operation, name), count in sorted(
+                    self.counters.items(),
+            ):
+                metric = f'reventlov_upstream_{name}_total'
+                if metric not in typed:
+                    typed.add(metric)
+                    lines.append(f'# TYPE {metric} counter')
+                lines.append(
+                    f'{metric}{{service="{escape_label(service)}",'
+                    f'operation="{escape_label(operation)}"}} {count}'
+                )
+        for name, value in sorted((gauges or {}).items()):
+            # Gauge names may carry labels, e.g. `bulkhead_queued{...}`.
+            metric = f'reventlov_{name.split("{")[0]}'
+            if metric not in typed:
+                typed.add(metric)
+                lines.append(f'# TYPE {metric} gauge')
+            lines.append(f'reventlov_{name} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = Metrics()
+
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != '/metrics':
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        body = self.server.registry.render_prometheus(
+            self.server.gauges(),
+        ).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+
+class MetricsServer(HTTPServer):
+    '''
+    Local HTTP endpoint serving metrics in Prometheus text format.
+
+    `gauges` is called on every scrape and returns extra values to expose.
+    '''
+    def __init__(self, address, registry=registry, gauges=dict):
+        super().__init__(address, MetricsRequestHandler)
+        self.registry = registry
+        self.gauges = gauges
+        self.thread = None
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def start(self):
+        self.thread = threading.Thread(
+            target=self.serve_forever,
+            name='metrics',
+            daemon=True,
+        )
+        self.thread.start()
+        logger.info(f'Serving metrics on port {self.port}')
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
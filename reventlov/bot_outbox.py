@@ -0,0 +1,320 @@
+import heapq
+import itertools
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from telegram import Bot
+from telegram.error import RetryAfter
+
+from reventlov.bot_metrics import registry
+
+logger = logging.getLogger(__name__)
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 10
+
+
+def percentile(values, fraction):
+    if len(values) == 0:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class TokenBucket(object):
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def refill(self, now):
+        if now <= self.updated:
+            return
+        self.tokens = min(
+            self.capacity,
+            self.tokens + (now - self.updated) * self.rate,
+        )
+        self.updated = now
+
+    def delay(self, now, tokens=1):
+        self.refill(now)
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        if self.tokens >= tokens:
+            return 0.0
+        return (tokens - self.tokens) / self.rate
+
+    def take(self, now, tokens=1):
+        self.refill(now)
+        self.tokens -= tokens
+
+    def block(self, seconds, now):
+        self.blocked_until = max(self.blocked_until, now + seconds)
+
+    @property
+    def idle(self):
+        self.refill(time.monotonic())
+        return self.tokens >= self.capacity and \
+            self.blocked_until <= self.updated
+
+
+class OutgoingMessage(object):
+    def __init__(self, send, chat_id, priority, args, kwargs):
+        self.send = send
+        self.chat_id = chat_id
+        self.priority = priority
+        self.args = args
+        self.kwargs = kwargs
+        self.future = Future()
+        self.enqueued_at = time.monotonic()
+        self.attempts = 0
+        self.seq = None
+
+
+class Outbox(object):
+    '''
+    Rate limited queue of outgoing Telegram messages.
+
+    Messages wait for a token from the global bucket and from their chat's
+    bucket, interactive replies go before background ones, and a chat only
+    has one message in flight at a time so its messages keep their order.
+    Chats answering with `RetryAfter` are paused for the time requested.
+
+    Each chat has its own queue. Chats that can send are kept in a heap by
+    their first message, and chats waiting for tokens in a heap by the time
+    they can send again, so picking a message costs the same however many
+    are queued.
+    '''
+    def __init__(
+            self,
+            global_rate=30,
+            chat_rate=1,
+            group_rate=20 / 60,
+            burst=3,
+            workers=4,
+            max_retries=3,
+    ):
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chat_rate = chat_rate
+        self.group_rate = group_rate
+        self.burst = burst
+        self.workers = workers
+        self.max_retries = max_retries
+        self.chat_buckets = {}
+        self.queues = {}
+        self.ready = []
+        self.ready_keys = {}
+        self.waiting = []
+        self.waiting_chats = set()
+        self.in_flight = set()
+        self.depth = 0
+        self.counter = itertools.count()
+        self.condition = threading.Condition()
+        self.latencies = deque(maxlen=1000)
+        self.sent = 0
+        self.retried = 0
+        self.failed = 0
+        self.running = False
+        self.executor = None
+        self.thread = None
+
+    def chat_bucket(self, chat_id):
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self.chat_buckets) > 10000:
+                self.chat_buckets = {
+                    bucket_chat_id: bucket
+                    for bucket_chat_id, bucket in self.chat_buckets.items()
+                    if not bucket.idle
+                }
+            # Negative chat ids are groups, which have a per-minute limit.
+            if isinstance(chat_id, int) and chat_id < 0:
+                bucket = TokenBucket(self.group_rate, self.burst)
+            else:
+                bucket = TokenBucket(self.chat_rate, self.burst)
+            self.chat_buckets[chat_id] = bucket
+        return bucket
+
+    def push(self, priority, message):
+        # Retried messages keep their place in their chat's queue.
+        if message.seq is None:
+            message.seq = next(self.counter)
+        queue = self.queues.setdefault(message.chat_id, [])
+        heapq.heappush(queue, (priority, message.seq, message))
+        self.depth += 1
+        self.wake(message.chat_id)
+        self.condition.notify()
+
+    def put(self, send, chat_id, priority, *args, **kwargs):
+        message = OutgoingMessage(send, chat_id, priority, args, kwargs)
+        with self.condition:
+            self.push(priority, message)
+        return message.future
+
+    def wake(self, chat_id):
+        '''
+        Make `chat_id` ready to send its first message.
+        '''
+        if chat_id in self.in_flight or chat_id in self.waiting_chats:
+            return
+        queue = self.queues.get(chat_id)
+        if queue is None:
+            return
+        key = queue[0][:2]
+        if self.ready_keys.get(chat_id) == key:
+            return
+        # Entries left behind by a new first message are skipped when popped.
+        self.ready_keys[chat_id] = key
+        heapq.heappush(self.ready, key + (chat_id,))
+
+    def next_message(self):
+        now = time.monotonic()
+        if self.depth == 0:
+            return None, None
+        global_delay = self.global_bucket.delay(now)
+        if global_delay > 0:
+            return None, global_delay
+        while len(self.waiting) > 0 and self.waiting[0][0] <= now:
+            _, chat_id = heapq.heappop(self.waiting)
+            self.waiting_chats.discard(chat_id)
+            self.wake(chat_id)
+        while len(self.ready) > 0:
+            priority, seq, chat_id = heapq.heappop(self.ready)
+            if self.ready_keys.get(chat_id) != (priority, seq):
+                continue
+            del self.ready_keys[chat_id]
+            chat_bucket = self.chat_bucket(chat_id)
+            chat_delay = chat_bucket.delay(now)
+            if chat_delay > 0:
+                self.waiting_chats.add(chat_id)
+                heapq.heappush(self.waiting, (now + chat_delay, chat_id))
+                continue
+            queue = self.queues[chat_id]
+            _, _, chosen = heapq.heappop(queue)
+            if len(queue) == 0:
+                del self.queues[chat_id]
+            self.depth -= 1
+            self.global_bucket.take(now)
+            chat_bucket.take(now)
+            self.in_flight.add(chat_id)
+            return chosen, None
+        if len(self.waiting) == 0:
+            return None, None
+        return None, self.waiting[0][0] - now
+
+    def deliver(self, message):
+        message.attempts += 1
+        try:
+            result = message.send(*message.args, **message.kwargs)
+        except RetryAfter as error:
+            with self.condition:
+                self.chat_bucket(message.chat_id).block(
+                    error.retry_after,
+                    time.monotonic(),
+                )
+                if message.attempts <= self.max_retries:
+                    self.retried += 1
+                    self.push(message.priority, message)
+                else:
+                    self.failed += 1
+                    message.future.set_exception(error)
+        except Exception as error:
+            logger.exception(f'Could not send message to {message.chat_id}')
+            with self.condition:
+                self.failed += 1
+            message.future.set_exception(error)
+        else:
+            with self.condition:
+                self.sent += 1
+                self.latencies.append(time.monotonic() - message.enqueued_at)
+            message.future.set_result(result)
+        finally:
+            with self.condition:
+                self.in_flight.discard(message.chat_id)
+                self.wake(message.chat_id)
+                self.condition.notify()
+
+    def run(self):
+        while True:
+            with self.condition:
+                message, delay = self.next_message()
+                while self.running and message is None:
+                    self.condition.wait(delay)
+                    message, delay = self.next_message()
+                if not self.running:
+                    return
+            self.executor.submit(self.deliver, message)
+
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        self.executor = ThreadPoolExecutor(max_workers=self.workers)
+        self.thread = threading.Thread(
+            target=self.run,
+            name='outbox',
+            daemon=True,
+        )
+        self.thread.start()
+
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+        if self.thread is not None:
+            self.thread.join()
+            self.executor.shutdown()
+
+    @property
+    def stats(self):
+        with self.condition:
+            latencies = list(self.latencies)
+            return {
+                'depth': self.depth,
+                'in_flight': len(self.in_flight),
+                'sent': self.sent,
+                'retried': self.retried,
+                'failed': self.failed,
+                'latency_p50': percentile(latencies, 0.5),
+                'latency_p95': percentile(latencies, 0.95),
+                'latency_p99': percentile(latencies, 0.99),
+            }
+
+
+class QueuedBot(Bot):
+    '''
+    Telegram bot sending its messages through an `Outbox`.
+
+    `send_message` returns a future instead of the sent message, and takes
+    a `priority` to let interactive replies overtake background ones.
+    '''
+    def __init__(self, token, outbox, **kwargs):
+        super().__init__(token, **kwargs)
+        self.outbox = outbox
+
+    def send_message(
+            self,
+            chat_id,
+            text,
+            *args,
+            priority=PRIORITY_INTERACTIVE,
+            **kwargs
+    ):
+        return self.outbox.put(
+            self.timed_send_message,
+            chat_id,
+            priority,
+            chat_id,
+            text,
+            *args,
+            **kwargs
+        )
+
+    def timed_send_message(self, *args, **kwargs):
+        with registry.timed('telegram', 'send_message'):
+            return super().send_message(*args, **kwargs)
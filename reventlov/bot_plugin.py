@@ -1,7 +1,35 @@
+import asyncio
+import functools
+import logging
+import threading
+
 from telegram.ext import CommandHandler
 
+from reventlov.bot_bulkhead import Bulkhead, BulkheadFull
+from reventlov.bot_loop import event_loop
+from reventlov.bot_metrics import registry
+from reventlov.bot_resources import shared_resources
+
+logger = logging.getLogger(__name__)
+
 
 class BotPlugin(object):
+    warming_message = 'I am still warming up, I will answer you in a moment'
+    failed_message = 'Sorry, I could not get ready to answer that'
+    busy_message = 'I am too busy right now, please try again in a moment'
+    blocking_commands = ()
+    command_costs = {}
+    bulkhead_workers = 4
+    bulkhead_queue = 16
+    bulkhead = None
+    bootstrap_backoff = 1
+    bootstrap_max_backoff = 300
+    max_pending_calls = 100
+    tenant = None
+    _shared = ()
+    _bootstrap_state = 'ready'
+    _bootstrap_stopped = None
+
     @property
     def commands(self):
         return [
@@ -10,8 +38,242 @@ class BotPlugin(object):
             if handler.__class__ == CommandHandler
         ]
 
+    @property
+    def plugin_name(self):
+        return type(self).__module__.split('.')[-1]
+
+    @property
+    def gauges(self):
+        '''
+        Plugin specific figures exported along the bot metrics.
+        '''
+        return {}
+
+    @property
+    def state(self):
+        return self._bootstrap_state
+
+    @property
+    def ready(self):
+        return self.state == 'ready'
+
+    def bootstrap(self):
+        '''
+        Remote work needed before handlers can answer.
+
+        Plugins overriding it register their handlers in `__init__` and get
+        bootstrapped in a background thread by `start_bootstrap`, retried
+        with an exponential backoff until it succeeds.
+        '''
+
+    def start_bootstrap(self):
+        if type(self).bootstrap is BotPlugin.bootstrap:
+            return
+        self._bootstrap_state = 'warming'
+        self._pending_calls = []
+        self._bootstrap_lock = threading.Lock()
+        self._bootstrap_stopped = threading.Event()
+        threading.Thread(
+            target=self.run_bootstrap,
+            name=f'{type(self).__name__}-bootstrap',
+            daemon=True,
+        ).start()
+
+    def run_bootstrap(self):
+        backoff = self.bootstrap_backoff
+        while True:
+            try:
+                self.bootstrap()
+                state = 'ready'
+            except Exception:
+                logger.exception(f'Could not bootstrap {type(self).__name__}')
+                state = 'failed'
+            self.finish_bootstrap(state)
+            if state == 'ready' or self._bootstrap_stopped.wait(backoff):
+                return
+            backoff = min(2 * backoff, self.bootstrap_max_backoff)
+            logger.info(f'Retrying to bootstrap {type(self).__name__}')
+
+    def finish_bootstrap(self, state):
+        with self._bootstrap_lock:
+            self._bootstrap_state = state
+            pending_calls = self._pending_calls
+            self._pending_calls = []
+        logger.info(f'{type(self).__name__} is {state}')
+        for callback, args, kwargs in pending_calls:
+            try:
+                if state == 'ready':
+                    callback(*args, **kwargs)
+                else:
+                    args[1].message.reply_text(self.failed_message)
+            except Exception:
+                logger.exception(
+                    f'Could not answer a call queued for '
+                    f'{type(self).__name__}'
+                )
+
+    def defer_while_warming(self, callback):
+        @functools.wraps(callback)
+        def deferred(bot, update, *args, **kwargs):
+            if self.state == 'warming':
+                with self._bootstrap_lock:
+                    if self._bootstrap_state == 'warming':
+                        if len(self._pending_calls) >= \
+                                self.max_pending_calls:
+                            update.message.reply_text(self.busy_message)
+                            return
+                        self._pending_calls.append(
+                            (callback, (bot, update) + args, kwargs),
+                        )
+                        update.message.reply_text(self.warming_message)
+                        return
+            if self.state == 'failed':
+                update.message.reply_text(self.failed_message)
+                return
+            return callback(bot, update, *args, **kwargs)
+        return deferred
+
+    def start_bulkhead(self):
+        '''
+        Give the plugin its own pool for the `blocking_commands`.
+
+        Its size can be set with `<PLUGIN>_BULKHEAD_WORKERS` and
+        `<PLUGIN>_BULKHEAD_QUEUE`.
+        '''
+        # bot_plugins imports this module.
+        from reventlov.bot_plugins import get_int_from_environment
+        prefix = self.plugin_name.upper()
+        self.bulkhead = Bulkhead(
+            self.plugin_name,
+            workers=get_int_from_environment(
+                f'{prefix}_BULKHEAD_WORKERS',
+                self.bulkhead_workers,
+                self.tenant,
+            ),
+            queue_size=get_int_from_environment(
+                f'{prefix}_BULKHEAD_QUEUE',
+                self.bulkhead_queue,
+                self.tenant,
+            ),
+        )
+
+    def stop_bulkhead(self):
+        if self.bulkhead is not None:
+            self.bulkhead.shutdown()
+
+    def share(self, name, key, factory, close=None):
+        '''
+        Resource built by `factory`, shared with the plugins of the other
+        tenant bots using the same `key`.
+
+        Plugins of a single bot get their own. Resources are closed with
+        `close` when the last plugin holding them stops.
+        '''
+        if self.tenant is None:
+            resource = factory()
+            self._shared = self._shared + ((None, resource, close),)
+            return resource
+        key = (self.plugin_name, name) + tuple(key)
+        resource = shared_resources.acquire(key, factory)
+        self._shared = self._shared + ((key, resource, close),)
+        return resource
+
+    def release_shared(self):
+        shared, self._shared = self._shared, ()
+        for key, resource, close in shared:
+            if key is None:
+                if close is not None:
+                    close(resource)
+            else:
+                shared_resources.release(key, close)
+
+    def stop(self):
+        '''
+        Release the plugin resources when the bot stops.
+        '''
+        if self._bootstrap_stopped is not None:
+            self._bootstrap_stopped.set()
+        self.stop_bulkhead()
+        self.release_shared()
+
+    def offload(self, callback):
+        @functools.wraps(callback)
+        def offloaded(bot, update, *args, **kwargs):
+            future = self.bulkhead.submit(
+                callback,
+                bot,
+                update,
+                *args,
+                **kwargs
+            )
+            if future is None:
+                update.message.reply_text(self.busy_message)
+        return offloaded
+
+    async def run_blocking(self, callback, *args, **kwargs):
+        '''
+        Await a blocking call from an `async` handler.
+
+        The call runs in the plugin's bulkhead, raising `BulkheadFull` when
+        there is no room left in it.
+        '''
+        future = self.bulkhead.submit(callback, *args, **kwargs)
+        if future is None:
+            raise BulkheadFull(self.plugin_name)
+        return await asyncio.wrap_future(future)
+
+    async def run_coroutine_handler(self, callback, bot, update, *args,
+                                    **kwargs):
+        try:
+            return await callback(bot, update, *args, **kwargs)
+        except BulkheadFull:
+            update.message.reply_text(self.busy_message)
+
+    def schedule(self, callback):
+        @functools.wraps(callback)
+        def scheduled(bot, update, *args, **kwargs):
+            return event_loop.submit(self.run_coroutine_handler(
+                callback,
+                bot,
+                update,
+                *args,
+                **kwargs
+            ))
+        return scheduled
+
+    def adapt(self, command, callback):
+        '''
+        Make a handler callable from the dispatcher thread.
+
+        `async` handlers are scheduled on the event loop, blocking ones are
+        run in the bulkhead, and the rest are called right away.
+        '''
+        callback = registry.instrument(
+            self.plugin_name,
+            command,
+            callback,
+            self.tenant,
+        )
+        if asyncio.iscoroutinefunction(callback):
+            callback = self.schedule(callback)
+        elif command in self.blocking_commands:
+            callback = self.offload(callback)
+        return self.defer_while_warming(callback)
+
     def add_handlers(self, dispatcher):
+        coroutine_handlers = [
+            handler
+            for handler in self.handlers
+            if asyncio.iscoroutinefunction(handler.callback)
+        ]
+        if self.bulkhead is None and (
+                len(self.blocking_commands) > 0 or
+                len(coroutine_handlers) > 0
+        ):
+            self.start_bulkhead()
         for handler in self.handlers:
+            command = getattr(handler, 'command', [type(handler).__name__])
+            handler.callback = self.adapt(command[0], handler.callback)
             dispatcher.add_handler(handler)
 
     def remove_handlers(self, dispatcher):
@@ -1,7 +1,9 @@
 import os
+import ast
 import logging
 import importlib
 import pkgutil
+import time
 
 from reventlov.bot_plugin import BotPlugin
 
@@ -19,13 +21,54 @@ def find_bot(module):
     return bot_class
 
 
-def get_list_from_environment(env_var_name):
-    env_var_value = os.getenv(env_var_name)
+def tenant_variable(env_var_name, tenant=None):
+    '''
+    `<TENANT>_<env_var_name>` when set, so tenants can override anything.
+    '''
+    if tenant is not None:
+        tenant_var_name = f'{tenant.upper()}_{env_var_name}'
+        if tenant_var_name in os.environ:
+            return tenant_var_name
+    return env_var_name
+
+
+def get_from_environment(env_var_name, default=None, tenant=None):
+    return os.getenv(tenant_variable(env_var_name, tenant), default)
+
+
+def get_list_from_environment(env_var_name, tenant=None):
+    env_var_value = get_from_environment(env_var_name, tenant=tenant)
     if env_var_value is None:
         return []
     return env_var_value.split(',')
 
 
+def get_int_from_environment(env_var_name, default=0, tenant=None):
+    env_var_value = get_from_environment(env_var_name, tenant=tenant)
+    if env_var_value is None or env_var_value == '':
+        return default
+    return int(env_var_value)
+
+
+def get_float_from_environment(env_var_name, default=0.0, tenant=None):
+    env_var_value = get_from_environment(env_var_name, tenant=tenant)
+    if env_var_value is None or env_var_value == '':
+        return default
+    return float(env_var_value)
+
+
+def get_path_from_environment(env_var_name, default, tenant=None):
+    '''
+    A database path, prefixed with the tenant unless set for the tenant.
+    '''
+    variable = tenant_variable(env_var_name, tenant)
+    path = os.getenv(variable, default)
+    if tenant is None or variable != env_var_name or path == ':memory:':
+        return path
+    directory, name = os.path.split(path)
+    return os.path.join(directory, f'{tenant}-{name}')
+
+
 def iter_namespaces():
     return pkgutil.iter_modules(
         [os.path.join(os.path.dirname(__file__), 'plugins')],
@@ -33,19 +76,90 @@ def iter_namespaces():
     )
 
 
-def import_plugin_modules():
-    modules = {
-        name: importlib.import_module(name)
-        for finder, name, ispkg
-        in iter_namespaces()
-    }
-    return modules
+def literal(node):
+    try:
+        return ast.literal_eval(node)
+    except ValueError:
+        return None
+
+
+def first_doc_line(node):
+    doc = ast.get_docstring(node)
+    if doc is None:
+        return None
+    return doc.splitlines()[0].strip()
+
+
+class PluginInfo(object):
+    '''
+    Plugin metadata read from its source without importing it.
+    '''
+    def __init__(self, module_name, path):
+        self.module_name = module_name
+        self.name = module_name.split('.')[-1]
+        self.path = path
+        self.entry_class = None
+        self.description = None
+        self.commands = {}
+
+    @classmethod
+    def from_source(cls, module_name, path):
+        info = cls(module_name, path)
+        with open(path) as source:
+            tree = ast.parse(source.read(), path)
+        for node in tree.body:
+            if isinstance(node, ast.ClassDef) and any(
+                isinstance(base, ast.Name) and base.id == 'BotPlugin'
+                for base in node.bases
+            ):
+                info.read_class(node)
+                break
+        return info
+
+    def read_class(self, class_node):
+        self.entry_class = class_node.name
+        self.description = first_doc_line(class_node)
+        methods = {
+            node.name: first_doc_line(node)
+            for node in class_node.body
+            if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef))
+        }
+        for node in ast.walk(class_node):
+            if (
+                isinstance(node, ast.Call) and
+                isinstance(node.func, ast.Name) and
+                node.func.id == 'CommandHandler' and
+                len(node.args) >= 2
+            ):
+                command = literal(node.args[0])
+                callback = node.args[1]
+                if isinstance(callback, ast.Attribute):
+                    self.commands[command] = methods.get(callback.attr)
+                else:
+                    self.commands[command] = None
+
+
+def discover_plugins():
+    plugins = {}
+    for finder, name, ispkg in iter_namespaces():
+        path = os.path.join(finder.path, name.split('.')[-1])
+        path = os.path.join(path, '__init__.py') if ispkg else f'{path}.py'
+        try:
+            plugins[name] = PluginInfo.from_source(name, path)
+        except (OSError, SyntaxError) as error:
+            logger.warning(f'Could not read plugin {name}: {error}')
+    return plugins
 
 
 class BotPlugins(object):
-    def __init__(self, dispatcher):
+    generation = 0
+
+    def __init__(self, dispatcher, tenant=None):
         self.dispatcher = dispatcher
-        self.modules = import_plugin_modules()
+        self.tenant = tenant
+        self.infos = discover_plugins()
+        self.modules = {}
+        self.timings = {}
         self.plugins = {}
         self.__disabled_plugins()
         self.load_plugins()
@@ -56,11 +170,12 @@ class BotPlugins(object):
 
     def __disabled_plugins(self, disabled_plugins=None):
         if disabled_plugins is None:
-            self.__disabled_plugins = get_list_from_environment(
+            self.__disabled_plugins = set(get_list_from_environment(
                 'REVENTLOV_DISABLED_PLUGINS',
-            )
+                tenant=self.tenant,
+            ))
         else:
-            self.__disabled_plugins = disabled_plugins
+            self.__disabled_plugins = set(disabled_plugins)
 
     @property
     def enabled_plugins(self):
@@ -79,6 +194,13 @@ class BotPlugins(object):
                 command_help[command] = msg
         return command_help
 
+    @property
+    def command_costs(self):
+        costs = {}
+        for plugin in self.plugins.values():
+            costs.update(plugin.command_costs)
+        return costs
+
     @property
     def feature_descs(self):
         return [
@@ -87,29 +209,81 @@ class BotPlugins(object):
             if self.plugins[plugin_name].__doc__ is not None
         ]
 
+    @property
+    def bulkhead_stats(self):
+        return {
+            plugin_name: plugin.bulkhead.stats
+            for plugin_name, plugin in self.plugins.items()
+            if plugin.bulkhead is not None
+        }
+
+    @property
+    def gauges(self):
+        return {
+            f'{plugin_name}_{name}': value
+            for plugin_name, plugin in self.plugins.items()
+            for name, value in plugin.gauges.items()
+        }
+
+    def stop(self):
+        for plugin in self.plugins.values():
+            plugin.stop()
+
     def disable(self, plugin_name):
-        del self.plugins[plugin_name]
-        self.disabled_plugins.append(plugin_name)
+        plugin = self.plugins.pop(plugin_name)
+        plugin.remove_handlers(self.dispatcher)
+        plugin.stop()
+        self.disabled_plugins.add(plugin_name)
+        self.generation += 1
+
+    def import_module(self, module_name):
+        if module_name not in self.modules:
+            started = time.perf_counter()
+            self.modules[module_name] = importlib.import_module(module_name)
+            self.timings[module_name]['import'] = \
+                time.perf_counter() - started
+        return self.modules[module_name]
+
+    def find_bot_class(self, module_name):
+        module = self.import_module(module_name)
+        info = self.infos.get(module_name)
+        if info is not None and info.entry_class is not None:
+            return getattr(module, info.entry_class, None)
+        return find_bot(module)
 
     def load_plugin(self, module_name):
         plugin_name = module_name.split('.')[-1]
-        bot_class = find_bot(self.modules[module_name])
+        self.timings.setdefault(module_name, {'import': 0.0, 'init': 0.0})
+        bot_class = self.find_bot_class(module_name)
         if bot_class is None:
             logger.warning(f'No BotPlugin subclass found for {module_name}')
         else:
-            bot = bot_class(self.dispatcher)
+            started = time.perf_counter()
+            bot = bot_class(self.dispatcher, tenant=self.tenant)
+            self.timings[module_name]['init'] = time.perf_counter() - started
             self.plugins[plugin_name] = bot
+            self.generation += 1
+            bot.start_bootstrap()
+
+    @property
+    def timing_report(self):
+        return '\n'.join([
+            f'- {module_name}: import {timing["import"] * 1000:.1f}ms, '
+            f'init {timing["init"] * 1000:.1f}ms'
+            for module_name, timing in sorted(self.timings.items())
+        ])
 
     def enable(self, plugin_name):
         module_name = f'reventlov.plugins.{plugin_name}'
-        del self.disabled_plugins[self.disabled_plugins.index(plugin_name)]
+        self.disabled_plugins.discard(plugin_name)
+        self.generation += 1
         self.load_plugin(module_name)
 
     def load_plugins(self):
-        for module_name in self.modules:
-            plugin_name = module_name.split('.')[-1]
-            if plugin_name not in self.disabled_plugins:
+        for module_name, info in self.infos.items():
+            if info.name not in self.disabled_plugins:
                 self.load_plugin(module_name)
+        logger.info(f'Plugins loaded:\n{self.timing_report}')
 
     def __iter__(self):
         return self.plugins.__iter__()
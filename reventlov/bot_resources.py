@@ -0,0 +1,52 @@
+import threading
+
+
+class SharedResources(object):
+    '''
+    Resources shared by the bots hosted in one process.
+
+    A resource is built by `factory` the first time its key is acquired,
+    handed to every later holder, and closed when the last one releases it.
+    '''
+    def __init__(self):
+        self.resources = {}
+        self.holders = {}
+        self.created = 0
+        self.reused = 0
+        self.lock = threading.Lock()
+
+    def acquire(self, key, factory):
+        with self.lock:
+            if key in self.resources:
+                self.holders[key] += 1
+                self.reused += 1
+                return self.resources[key]
+            resource = self.resources[key] = factory()
+            self.holders[key] = 1
+            self.created += 1
+            return resource
+
+    def release(self, key, close=None):
+        with self.lock:
+            self.holders[key] -= 1
+            if self.holders[key] > 0:
+                return
+            del self.holders[key]
+            resource = self.resources.pop(key)
+        if close is not None:
+            close(resource)
+
+    def __len__(self):
+        return len(self.resources)
+
+    @property
+    def stats(self):
+        with self.lock:
+            return {
+                'resources': len(self.resources),
+                'created': self.created,
+                'reused': self.reused,
+            }
+
+
+shared_resources = SharedResources()
@@ -0,0 +1,68 @@
+from telegram import Update
+from telegram.ext import CommandHandler, Handler
+
+
+def command_name(update):
+    if not isinstance(update, Update):
+        return None
+    message = update.message or update.edited_message
+    if message is None or not (message.text or '').startswith('/'):
+        return None
+    return message.text.split(None, 1)[0][1:].split('@')[0].lower()
+
+
+class CommandRouter(Handler):
+    '''
+    Dispatcher handler routing commands to their handlers by name.
+
+    The dispatcher tries its handlers one after the other, so command
+    handlers are kept here instead, indexed by command, and routing costs
+    the same whatever the number of commands. It stands in for the
+    dispatcher when adding or removing handlers: other handlers are handed
+    to it.
+    '''
+    def __init__(self, dispatcher):
+        super().__init__(None)
+        self.dispatcher = dispatcher
+        self.routes = {}
+
+    @property
+    def bot(self):
+        return self.dispatcher.bot
+
+    @property
+    def commands(self):
+        return list(self.routes)
+
+    def add_handler(self, handler, group=0):
+        if group != 0 or not isinstance(handler, CommandHandler):
+            self.dispatcher.add_handler(handler, group)
+            return
+        for command in handler.command:
+            self.routes.setdefault(command.lower(), []).append(handler)
+
+    def remove_handler(self, handler, group=0):
+        if group != 0 or not isinstance(handler, CommandHandler):
+            self.dispatcher.remove_handler(handler, group)
+            return
+        for command in handler.command:
+            handlers = self.routes.get(command.lower(), [])
+            if handler in handlers:
+                handlers.remove(handler)
+            if len(handlers) == 0:
+                self.routes.pop(command.lower(), None)
+
+    def find(self, update):
+        '''
+        The handler of the command in `update`, if any.
+        '''
+        for handler in self.routes.get(command_name(update), ()):
+            if handler.check_update(update):
+                return handler
+        return None
+
+    def check_update(self, update):
+        return self.find(update) is not None
+
+    def handle_update(self, update, dispatcher):
+        return self.find(update).handle_update(update, dispatcher)
@@ -0,0 +1,22 @@
+import os
+
+
+def shard_for(chat_id, shards):
+    return chat_id % shards
+
+
+def shard_settings():
+    '''
+    This process' shard and the number of shards, `(0, 1)` unsharded.
+    '''
+    shards = int(os.getenv('REVENTLOV_SHARDS') or 1)
+    shard = int(os.getenv('REVENTLOV_SHARD') or 0)
+    return shard, max(1, shards)
+
+
+def owns_chat(chat_id):
+    '''
+    Whether `chat_id` is served by this process.
+    '''
+    shard, shards = shard_settings()
+    return shards == 1 or shard_for(chat_id, shards) == shard
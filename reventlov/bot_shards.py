@@ -0,0 +1,262 @@
+import os
+import logging
+import multiprocessing
+import signal
+import threading
+import time
+
+from telegram import Bot as TelegramBot, Update
+from telegram.error import TelegramError
+
+from reventlov.bot import Bot
+from reventlov.bot_metrics import MetricsServer
+from reventlov.bot_updates import UpdateStore, UpdateTracker
+from reventlov.bot_webhook import TelegramWebhookServer
+from reventlov.bot_plugins import get_int_from_environment
+from reventlov.bot_sharding import shard_for
+
+logger = logging.getLogger(__name__)
+
+
+def chat_key(update):
+    if update.effective_chat is not None:
+        return update.effective_chat.id
+    if update.effective_user is not None:
+        return update.effective_user.id
+    return update.update_id
+
+
+def worker_environment(shard, shards):
+    '''
+    Settings of worker `shard` out of `shards`.
+
+    Workers share the bot-wide outbox rate and Trello prefetch budget,
+    only the front process tracks update ids and serves metrics, and only
+    the first worker listens to Trello webhooks, so workers do not fight
+    over ports.
+    '''
+    environment = {
+        'REVENTLOV_SHARD': str(shard),
+        'REVENTLOV_SHARDS': str(shards),
+        'TELEGRAM_BOT_MODE': 'worker',
+        'TELEGRAM_UPDATES_DB': ':memory:',
+        'TELEGRAM_OUTBOX_GLOBAL_RATE': str(max(1, get_int_from_environment(
+            'TELEGRAM_OUTBOX_GLOBAL_RATE',
+            30,
+        ) // shards)),
+        'TRELLO_PREFETCH_BUDGET': str(max(1, get_int_from_environment(
+            'TRELLO_PREFETCH_BUDGET',
+            30,
+        ) // shards)),
+    }
+    removed = ['REVENTLOV_METRICS_PORT']
+    if shard > 0:
+        removed.append('TRELLO_WEBHOOK_PORT')
+    return environment, removed
+
+
+def run_worker(shard, shards, inbox, control):
+    # The front process stops workers once it is signalled, letting them
+    # save their state, even when the whole process group is signalled.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    environment, removed = worker_environment(shard, shards)
+    os.environ.update(environment)
+    for name in removed:
+        os.environ.pop(name, None)
+    bot = Bot()
+    bot.peers = ShardPeers(shard, control)
+    bot.run()
+    for plugin_name in bot.plugins:
+        while bot.plugins[plugin_name].state == 'warming':
+            time.sleep(0.1)
+    control.put(('ready', shard, None))
+    logger.info(f'Shard {shard} ready')
+    while True:
+        message = inbox.get()
+        if message is None:
+            break
+        kind, payload = message
+        if kind == 'update':
+            bot.dispatcher.update_queue.put(Update.de_json(payload, bot.bot))
+        else:
+            bot.apply_plugin_change(kind, payload)
+    bot.stop()
+
+
+class ShardPeers(object):
+    '''
+    Tells the front process about plugin changes made by a worker.
+    '''
+    def __init__(self, shard, control):
+        self.shard = shard
+        self.control = control
+
+    def publish(self, action, plugin_name):
+        self.control.put((action, self.shard, plugin_name))
+
+
+class ShardRouter(object):
+    '''
+    Update queue of the front process, routing updates to the workers.
+
+    Updates of a chat always go to the same worker, so they are handled in
+    order and its `chat_data` stays in one process.
+    '''
+    def __init__(self, inboxes, tracker):
+        self.inboxes = inboxes
+        self.tracker = tracker
+        self.routed = [0] * len(inboxes)
+        self.lock = threading.Lock()
+
+    def put(self, update):
+        if not self.tracker.accept(update.update_id):
+            logger.info(f'Dropping duplicate update {update.update_id}')
+            return
+        shard = shard_for(chat_key(update), len(self.inboxes))
+        self.inboxes[shard].put(('update', update.to_dict()))
+        self.tracker.done(update.update_id)
+        with self.lock:
+            self.routed[shard] += 1
+
+
+class ShardedBot(object):
+    '''
+    Front process receiving updates for `shards` worker processes.
+
+    Each worker runs its own `Bot` and plugins. The front process only
+    polls or listens to the webhook, drops duplicate updates and routes the
+    rest by chat. Plugins enabled or disabled in a worker are enabled or
+    disabled in every other one.
+    '''
+    def __init__(self, shards):
+        self.shards = shards
+        self.bot = TelegramBot(
+            os.getenv('TELEGRAM_BOT_TOKEN'),
+            base_url=os.getenv('TELEGRAM_BOT_API_URL'),
+        )
+        self.updates = UpdateTracker(
+            UpdateStore(os.getenv('TELEGRAM_UPDATES_DB', 'updates.db')),
+            window=get_int_from_environment('TELEGRAM_DEDUP_WINDOW', 600),
+        )
+        self.control = multiprocessing.Queue()
+        self.inboxes = [multiprocessing.Queue() for _ in range(shards)]
+        self.router = ShardRouter(self.inboxes, self.updates)
+        self.processes = [
+            multiprocessing.Process(
+                target=run_worker,
+                name=f'reventlov-shard-{shard}',
+                args=(shard, shards, inbox, self.control),
+            )
+            for shard, inbox in enumerate(self.inboxes)
+        ]
+        self.ready = threading.Event()
+        self.ready_shards = set()
+        self.stopped = threading.Event()
+        self.threads = []
+        self.webhook_server = None
+        self.metrics_server = None
+
+    @property
+    def gauges(self):
+        gauges = {
+            f'routed_updates{{shard="{shard}"}}': routed
+            for shard, routed in enumerate(self.router.routed)
+        }
+        gauges['duplicate_updates'] = self.updates.duplicates
+        return gauges
+
+    def relay(self):
+        while True:
+            message = self.control.get()
+            if message is None:
+                break
+            action, shard, payload = message
+            if action == 'ready':
+                self.ready_shards.add(shard)
+                if len(self.ready_shards) == self.shards:
+                    self.ready.set()
+                continue
+            for peer, inbox in enumerate(self.inboxes):
+                if peer != shard:
+                    inbox.put((action, payload))
+
+    def poll(self):
+        offset = self.updates.offset + 1
+        timeout = get_int_from_environment('TELEGRAM_POLL_TIMEOUT', 10)
+        while not self.stopped.is_set():
+            try:
+                updates = self.bot.get_updates(offset=offset, timeout=timeout)
+            except TelegramError:
+                logger.exception('Could not get updates')
+                self.stopped.wait(1)
+                continue
+            for update in updates:
+                self.router.put(update)
+                offset = max(offset, update.update_id + 1)
+
+    def start_thread(self, target, name):
+        thread = threading.Thread(target=target, name=name)
+        thread.start()
+        self.threads.append(thread)
+
+    def run(self):
+        for process in self.processes:
+            process.start()
+        self.updates.start()
+        self.start_thread(self.relay, 'shard-relay')
+        if os.getenv('REVENTLOV_METRICS_PORT') is not None:
+            self.metrics_server = MetricsServer(
+                (
+                    os.getenv('REVENTLOV_METRICS_LISTEN', '127.0.0.1'),
+                    get_int_from_environment('REVENTLOV_METRICS_PORT'),
+                ),
+                gauges=lambda: self.gauges,
+            )
+            self.metrics_server.start()
+        logger.info(f'Routing updates to {self.shards} shards')
+        if os.getenv('TELEGRAM_BOT_MODE', 'polling') == 'webhook':
+            self.start_webhook()
+        else:
+            self.start_thread(self.poll, 'shard-polling')
+
+    def start_webhook(self):
+        self.webhook_server = TelegramWebhookServer(
+            (
+                os.getenv('TELEGRAM_WEBHOOK_LISTEN', '0.0.0.0'),
+                get_int_from_environment(
+                    'TELEGRAM_WEBHOOK_PORT',
+                    get_int_from_environment('PORT', 8443),
+                ),
+            ),
+            self.bot,
+            self.router,
+            url_path=os.getenv(
+                'TELEGRAM_WEBHOOK_PATH',
+                os.getenv('TELEGRAM_BOT_TOKEN', ''),
+            ),
+            workers=get_int_from_environment('TELEGRAM_WEBHOOK_WORKERS', 4),
+            max_body_size=get_int_from_environment(
+                'TELEGRAM_WEBHOOK_MAX_BODY',
+                1 << 20,
+            ),
+        )
+        self.webhook_server.start()
+        webhook_url = os.getenv('TELEGRAM_WEBHOOK_URL')
+        if webhook_url is not None:
+            self.bot.set_webhook(url=webhook_url)
+
+    def stop(self):
+        self.stopped.set()
+        if self.webhook_server is not None:
+            self.webhook_server.stop()
+        if self.metrics_server is not None:
+            self.metrics_server.stop()
+        for inbox in self.inboxes:
+            inbox.put(None)
+        for process in self.processes:
+            process.join()
+        self.control.put(None)
+        for thread in self.threads:
+            thread.join()
+        self.updates.close()
@@ -0,0 +1,277 @@
+import json
+import logging
+import sqlite3
+import threading
+import zlib
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+compress_above = 256
+
+
+def dump_state(data):
+    '''
+    Compact JSON, deflated when it is long enough to be worth it.
+    '''
+    raw = json.dumps(data, separators=(',', ':')).encode()
+    if len(raw) > compress_above:
+        return b'z' + zlib.compress(raw)
+    return b'j' + raw
+
+
+def load_state(blob):
+    blob = bytes(blob)
+    if blob[:1] == b'z':
+        return json.loads(zlib.decompress(blob[1:]).decode())
+    return json.loads(blob[1:].decode())
+
+
+class SQLiteStateBackend(object):
+    '''
+    SQLite table keeping plugin state across restarts.
+
+    The database is memory mapped, up to `mmap_size` bytes, so hot pages
+    are read without copies. Several processes may share it.
+    '''
+    def __init__(self, path, mmap_size=64 << 20):
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock, self.connection:
+            self.connection.execute('PRAGMA journal_mode=WAL')
+            self.connection.execute('PRAGMA synchronous=NORMAL')
+            self.connection.execute(f'PRAGMA mmap_size={int(mmap_size)}')
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS state ('
+                ' namespace TEXT NOT NULL,'
+                ' key INTEGER NOT NULL,'
+                ' value BLOB NOT NULL,'
+                ' PRIMARY KEY (namespace, key)) WITHOUT ROWID'
+            )
+
+    def load(self, namespace, key):
+        with self.lock:
+            row = self.connection.execute(
+                'SELECT value FROM state WHERE namespace = ? AND key = ?',
+                (namespace, key),
+            ).fetchone()
+        return None if row is None else load_state(row[0])
+
+    def save(self, namespace, items):
+        '''
+        Write `(key, data)` items in one transaction, empty data deleting.
+        '''
+        with self.lock, self.connection:
+            self.connection.executemany(
+                'INSERT OR REPLACE INTO state VALUES (?, ?, ?)',
+                [
+                    (namespace, key, dump_state(data))
+                    for key, data in items
+                    if len(data) > 0
+                ],
+            )
+            self.connection.executemany(
+                'DELETE FROM state WHERE namespace = ? AND key = ?',
+                [(namespace, key) for key, data in items if len(data) == 0],
+            )
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+
+class StateDict(dict):
+    '''
+    Plugin state of a chat or user, marking itself dirty when changed.
+
+    Values must be JSON serialisable. Only changes of its own keys are
+    noticed: plugins changing values in place must set them again to get
+    them saved. Changes to an entry dropped from the store while a
+    handler still holds it bring it back.
+    '''
+    __slots__ = ('store', 'key')
+
+    def __init__(self, store, key, data=()):
+        super().__init__(data)
+        self.store = store
+        self.key = key
+
+    def __setitem__(self, name, value):
+        super().__setitem__(name, value)
+        self.store.mark(self)
+
+    def __delitem__(self, name):
+        super().__delitem__(name)
+        self.store.mark(self)
+
+    def pop(self, *args):
+        value = super().pop(*args)
+        self.store.mark(self)
+        return value
+
+    def popitem(self):
+        item = super().popitem()
+        self.store.mark(self)
+        return item
+
+    def setdefault(self, name, default=None):
+        if name not in self:
+            self[name] = default
+        return self[name]
+
+    def update(self, *args, **kwargs):
+        super().update(*args, **kwargs)
+        self.store.mark(self)
+
+    def clear(self):
+        super().clear()
+        self.store.mark(self)
+
+
+class StateStore(object):
+    '''
+    Stand-in for the dispatcher `chat_data` or `user_data` dictionaries.
+
+    Up to `capacity` entries are kept in memory, least recently used ones
+    being dropped first. Changed entries are written to `backend` in
+    batches by `flush`, or right away when dropped. Entries that can not
+    be serialised are logged and left out. Backends are objects
+    with `load(namespace, key)`, `save(namespace, items)` and `close()`.
+    '''
+    def __init__(self, backend, namespace, capacity=10000):
+        self.backend = backend
+        self.namespace = namespace
+        self.capacity = capacity
+        self.entries = OrderedDict()
+        self.dirty = set()
+        self.loads = 0
+        self.writes = 0
+        self.lock = threading.RLock()
+
+    def mark(self, entry):
+        with self.lock:
+            if self.entries.get(entry.key) is not entry:
+                self.entries[entry.key] = entry
+                self.entries.move_to_end(entry.key)
+                while len(self.entries) > self.capacity:
+                    self.evict()
+            self.dirty.add(entry.key)
+
+    def __getitem__(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                return entry
+            data = None
+            if key is not None:
+                data = self.backend.load(self.namespace, key)
+                self.loads += 1
+            entry = self.entries[key] = StateDict(self, key, data or ())
+            while len(self.entries) > self.capacity:
+                self.evict()
+            return entry
+
+    def __contains__(self, key):
+        with self.lock:
+            return key in self.entries or \
+                self.backend.load(self.namespace, key) is not None
+
+    def __len__(self):
+        return len(self.entries)
+
+    def evict(self):
+        key, entry = self.entries.popitem(last=False)
+        if key in self.dirty:
+            self.dirty.discard(key)
+            self.write([(key, dict(entry))])
+
+    def write(self, items):
+        '''
+        Save `items` in one batch, falling back to one at a time when some
+        can not be serialised, so they are dropped without losing the rest.
+        '''
+        items = [(key, data) for key, data in items if key is not None]
+        if len(items) == 0:
+            return
+        try:
+            self.backend.save(self.namespace, items)
+        except (TypeError, ValueError):
+            if len(items) == 1:
+                logger.exception(
+                    f'Dropped unserialisable {self.namespace} data of'
+                    f' {items[0][0]}'
+                )
+                return
+            for item in items:
+                self.write([item])
+            return
+        self.writes += len(items)
+
+    def flush(self):
+        with self.lock:
+            items = [
+                (key, dict(self.entries[key]))
+                for key in self.dirty
+                if key in self.entries
+            ]
+            self.write(items)
+            self.dirty.clear()
+
+    @property
+    def stats(self):
+        return {
+            'cached': len(self.entries),
+            'dirty': len(self.dirty),
+            'loads': self.loads,
+            'writes': self.writes,
+        }
+
+
+class BotState(object):
+    '''
+    Persistent `chat_data` and `user_data`, flushed every `interval`
+    seconds by a background thread.
+    '''
+    def __init__(self, backend, capacity=10000, interval=1.0):
+        self.backend = backend
+        self.chat_data = StateStore(backend, 'chat', capacity)
+        self.user_data = StateStore(backend, 'user', capacity)
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def flush(self):
+        for store in (self.chat_data, self.user_data):
+            try:
+                store.flush()
+            except (sqlite3.Error, TypeError, ValueError):
+                logger.exception(f'Could not save {store.namespace} data')
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.flush()
+
+    def start(self):
+        self.stopped.clear()
+        self.thread = threading.Thread(
+            target=self.run,
+            name='state-flush',
+            daemon=True,
+        )
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+        self.flush()
+        self.backend.close()
+
+    @property
+    def stats(self):
+        return {
+            f'{store.namespace}_{name}': value
+            for store in (self.chat_data, self.user_data)
+            for name, value in store.stats.items()
+        }
@@ -0,0 +1,65 @@
+import os
+import logging
+
+from reventlov.bot import Bot
+from reventlov.bot_loop import event_loop
+from reventlov.bot_metrics import MetricsServer
+from reventlov.bot_plugins import get_int_from_environment
+from reventlov.bot_resources import shared_resources
+
+logger = logging.getLogger(__name__)
+
+
+def with_label(name, label):
+    if name.endswith('}'):
+        return f'{name[:-1]},{label}}}'
+    return f'{name}{{{label}}}'
+
+
+class TenantBots(object):
+    '''
+    One bot per tenant, all served by the same process.
+
+    Every setting can be given per tenant by prefixing it with the tenant
+    name, e.g. `ALPHA_TELEGRAM_BOT_TOKEN` or `ALPHA_TELEGRAM_BOT_ADMINS`,
+    falling back to the unprefixed one. Plugins of tenants using the same
+    upstream account share their clients, caches and background workers,
+    and webhooks on the same address share one server.
+    '''
+    def __init__(self, tenants):
+        self.bots = {tenant: Bot(tenant) for tenant in tenants}
+        self.metrics_server = None
+
+    @property
+    def gauges(self):
+        gauges = {
+            with_label(name, f'tenant="{tenant}"'): value
+            for tenant, bot in self.bots.items()
+            for name, value in bot.gauges.items()
+        }
+        gauges.update({
+            f'shared_{name}': value
+            for name, value in shared_resources.stats.items()
+        })
+        return gauges
+
+    def run(self):
+        if os.getenv('REVENTLOV_METRICS_PORT') is not None:
+            self.metrics_server = MetricsServer(
+                (
+                    os.getenv('REVENTLOV_METRICS_LISTEN', '127.0.0.1'),
+                    get_int_from_environment('REVENTLOV_METRICS_PORT'),
+                ),
+                gauges=lambda: self.gauges,
+            )
+            self.metrics_server.start()
+        for bot in self.bots.values():
+            bot.run()
+        logger.info(f'Serving {len(self.bots)} tenants')
+
+    def stop(self):
+        for bot in self.bots.values():
+            bot.stop()
+        if self.metrics_server is not None:
+            self.metrics_server.stop()
+        event_loop.stop()
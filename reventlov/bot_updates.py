@@ -0,0 +1,183 @@
+import logging
+import sqlite3
+import threading
+import time
+
+from telegram.ext import DispatcherHandlerStop
+
+logger = logging.getLogger(__name__)
+
+
+class UpdateStore(object):
+    '''
+    SQLite table keeping the id of the last processed update.
+    '''
+    def __init__(self, path):
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock, self.connection:
+            self.connection.execute('PRAGMA journal_mode=WAL')
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS offsets ('
+                ' name TEXT PRIMARY KEY,'
+                ' update_id INTEGER NOT NULL)'
+            )
+
+    def load(self):
+        with self.lock:
+            row = self.connection.execute(
+                'SELECT update_id FROM offsets WHERE name = ?',
+                ('last',),
+            ).fetchone()
+        return 0 if row is None else row[0]
+
+    def save(self, update_id):
+        with self.lock, self.connection:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO offsets VALUES (?, ?)',
+                ('last', update_id),
+            )
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+
+class RecentUpdates(object):
+    '''
+    Ids of the updates seen in the last `window` seconds, or more.
+
+    Ids are kept in two generations, the older one being dropped when the
+    newer one is `window` seconds old or holds `max_size` ids, so memory
+    stays bounded whatever the traffic.
+    '''
+    def __init__(self, window=600, max_size=100000):
+        self.window = window
+        self.max_size = max_size
+        self.current = set()
+        self.previous = set()
+        self.rotated = None
+
+    def add(self, update_id, now=None):
+        '''
+        Remember `update_id`, returning whether it was not seen yet.
+        '''
+        now = time.monotonic() if now is None else now
+        if self.rotated is None:
+            self.rotated = now
+        if now - self.rotated >= self.window or \
+                len(self.current) >= self.max_size:
+            self.previous = self.current
+            self.current = set()
+            self.rotated = now
+        if update_id in self.current or update_id in self.previous:
+            return False
+        self.current.add(update_id)
+        return True
+
+    def __len__(self):
+        return len(self.current) + len(self.previous)
+
+
+class UpdateTracker(object):
+    '''
+    Drops the updates already processed, including before a restart.
+
+    The id of the last processed update is saved in `store`, at most every
+    `save_interval` seconds, by `done` or by a background thread once
+    started: polling resumes after it, and older updates
+    replayed through a webhook are dropped. Duplicates within a run are
+    caught by `RecentUpdates`. Telegram restarts update ids from a random
+    value after a week without updates, so ids `reset_gap` or more below
+    the last one start over instead of being dropped.
+    '''
+    def __init__(
+            self,
+            store,
+            window=600,
+            max_size=100000,
+            save_interval=1.0,
+            reset_gap=100000,
+    ):
+        self.store = store
+        self.resumed_from = store.load()
+        self.offset = self.resumed_from
+        self.saved = self.offset
+        self.saved_at = time.monotonic()
+        self.save_interval = save_interval
+        self.reset_gap = reset_gap
+        self.recent = RecentUpdates(window, max_size)
+        self.duplicates = 0
+        self.resets = 0
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def accept(self, update_id):
+        with self.lock:
+            if update_id <= self.resumed_from:
+                if self.resumed_from - update_id < self.reset_gap:
+                    self.duplicates += 1
+                    return False
+                logger.warning(f'Update ids restarted from {update_id}')
+                self.resumed_from = update_id - 1
+                self.resets += 1
+            if not self.recent.add(update_id):
+                self.duplicates += 1
+                return False
+            return True
+
+    def done(self, update_id, now=None):
+        '''
+        Record `update_id` as processed, saving it when due.
+        '''
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            if update_id > self.offset or \
+                    self.offset - update_id >= self.reset_gap:
+                self.offset = update_id
+            if now - self.saved_at >= self.save_interval:
+                self.save(now)
+
+    def save(self, now=None):
+        if self.offset != self.saved:
+            self.store.save(self.offset)
+            self.saved = self.offset
+        self.saved_at = time.monotonic() if now is None else now
+
+    def track(self, bot, update):
+        '''
+        Dispatcher callback stopping duplicate updates before any handler.
+        '''
+        if not self.accept(update.update_id):
+            logger.info(f'Dropping duplicate update {update.update_id}')
+            raise DispatcherHandlerStop()
+
+    def processed(self, bot, update):
+        '''
+        Dispatcher callback recording updates once handlers went through.
+        '''
+        self.done(update.update_id)
+
+    def run(self):
+        while not self.stopped.wait(self.save_interval):
+            with self.lock:
+                if time.monotonic() - self.saved_at >= self.save_interval:
+                    self.save()
+
+    def start(self):
+        self.stopped.clear()
+        self.thread = threading.Thread(
+            target=self.run,
+            name='update-offsets',
+            daemon=True,
+        )
+        self.thread.start()
+
+    def close(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+        with self.lock:
+            self.save()
+        self.store.close()
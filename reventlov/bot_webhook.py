@@ -0,0 +1,143 @@
+import json
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import urlsplit
+
+from telegram import Update
+
+logger = logging.getLogger(__name__)
+
+
+def route_path(path):
+    '''
+    Key of the route serving `path`, without query string nor slashes
+    around.
+    '''
+    return '/' + urlsplit(path).path.strip('/')
+
+
+class WebhookRequestHandler(BaseHTTPRequestHandler):
+    def reply(self, status):
+        self.send_response(status)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def refuse(self, status):
+        self.server.count('rejected')
+        self.reply(status)
+
+    def read_body(self):
+        '''
+        The request body, or None after refusing a bad Content-Length.
+        '''
+        length = self.headers.get('Content-Length')
+        if length is None:
+            self.refuse(411)
+            return None
+        try:
+            length = int(length)
+        except ValueError:
+            self.refuse(400)
+            return None
+        if length < 0:
+            self.refuse(400)
+            return None
+        if length > self.server.max_body_size:
+            self.refuse(413)
+            return None
+        return self.rfile.read(length)
+
+    def do_POST(self):
+        route = self.server.routes.get(route_path(self.path))
+        if route is None:
+            self.reply(404)
+            return
+        bot, update_queue = route
+        body = self.read_body()
+        if body is None:
+            return
+        try:
+            update = Update.de_json(dict(json.loads(body.decode())), bot)
+        except (ValueError, KeyError, TypeError):
+            self.refuse(400)
+            return
+        update_queue.put(update)
+        self.server.count('received')
+        self.reply(200)
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+
+class TelegramWebhookServer(HTTPServer):
+    '''
+    HTTP listener feeding Telegram webhook updates to a dispatcher.
+
+    Requests are handled by a pool of `workers` threads and bodies larger
+    than `max_body_size` bytes are refused. More bots can be served on
+    other paths with `add_route`.
+    '''
+    def __init__(
+            self,
+            address,
+            bot,
+            update_queue,
+            url_path='/',
+            workers=4,
+            max_body_size=1 << 20,
+    ):
+        super().__init__(address, WebhookRequestHandler)
+        self.routes = {}
+        self.add_route(url_path, bot, update_queue)
+        self.max_body_size = max_body_size
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.received = 0
+        self.rejected = 0
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def count(self, outcome):
+        with self.lock:
+            setattr(self, outcome, getattr(self, outcome) + 1)
+
+    def add_route(self, url_path, bot, update_queue):
+        self.routes[route_path(url_path)] = (bot, update_queue)
+
+    def remove_route(self, url_path):
+        self.routes.pop(route_path(url_path), None)
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def process_request(self, request, client_address):
+        self.executor.submit(
+            self.process_pooled_request,
+            request,
+            client_address,
+        )
+
+    def process_pooled_request(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def start(self):
+        if self.thread is not None:
+            return
+        self.thread = threading.Thread(
+            target=self.serve_forever,
+            name='telegram-webhook',
+        )
+        self.thread.start()
+        logger.info(f'Listening to Telegram webhooks on port {self.port}')
+
+    def stop(self):
+        self.shutdown()
+        self.executor.shutdown()
+        self.server_close()
@@ -2,69 +2,209 @@ import logging
 
 from telegram.ext import CommandHandler
 
+from reventlov.bot_outbox import PRIORITY_BACKGROUND
 from reventlov.bot_plugin import BotPlugin
+from reventlov.bot_plugins import get_float_from_environment
+from reventlov.bot_plugins import get_path_from_environment
+from reventlov.bot_sharding import owns_chat
+from reventlov.plugins.pomodoro.cycles import CycleConfig, CycleTicker
+from reventlov.plugins.pomodoro.timers import TimerEngine, TimerStore
 
 version = '0.0.1'
 logger = logging.getLogger(__name__)
 logger.info(f'Pomodoro module v{version} loaded')
 
+default_timer = 'default'
+
 
 class PomodoroPlugin(BotPlugin):
     '''
     I can manage pomodoro alarms for you
     '''
-    def __init__(self, dispatcher):
+    def __init__(self, dispatcher, tenant=None):
+        self.tenant = tenant
+        self.bot = dispatcher.bot
+        tick = get_float_from_environment('POMODORO_TICK', 1.0, tenant)
+        self.timers = TimerEngine(
+            self.alarm,
+            store=TimerStore(get_path_from_environment(
+                'POMODORO_DB',
+                'pomodoro.db',
+                tenant,
+            )),
+            tick=tick,
+        )
+        self.cycles = CycleTicker(
+            self.notify_cycles,
+            tick=tick,
+        )
         self.handlers = [
             CommandHandler(
                 'set',
                 self.set_timer,
                 pass_args=True,
-                pass_job_queue=True,
                 pass_chat_data=True,
             ),
             CommandHandler(
                 'unset',
                 self.unset_timer,
+                pass_args=True,
                 pass_chat_data=True,
-            )
+            ),
+            CommandHandler(
+                'timers',
+                self.list_timers,
+            ),
+            CommandHandler(
+                'cycle',
+                self.start_cycle,
+                pass_args=True,
+            ),
+            CommandHandler(
+                'pause',
+                self.pause_cycle,
+            ),
+            CommandHandler(
+                'resume',
+                self.resume_cycle,
+            ),
+            CommandHandler(
+                'stop_cycle',
+                self.stop_cycle,
+            ),
         ]
         self.add_handlers(dispatcher)
         logger.info(f'Pomodoro plugin v{version} enabled')
 
-    def alarm(self, bot, job):
-        bot.send_message(job.context['chat_id'], text=job.context['text'])
+    def bootstrap(self):
+        self.timers.load(owns_chat)
+        self.timers.start()
+        self.cycles.start()
 
-    def set_timer(self, bot, update, args, job_queue, chat_data):
+    def stop(self):
+        self.timers.stop()
+        self.cycles.stop()
+        if self.timers.store is not None:
+            self.timers.store.close()
+        super().stop()
+
+    def alarm(self, chat_id, timers):
+        self.bot.send_message(
+            chat_id,
+            text='\n'.join([timer.text for timer in timers]),
+            priority=PRIORITY_BACKGROUND,
+        )
+
+    def notify_cycles(self, sessions):
+        for session in sessions:
+            minutes = session.config.duration(session.index) // 60
+            self.bot.send_message(
+                session.chat_id,
+                text=f'Time for a {session.phase} ({minutes} minutes)',
+                priority=PRIORITY_BACKGROUND,
+            )
+
+    def set_timer(self, bot, update, args, chat_data):
         '''
-        `seconds [message...]` Set alarm to fire in `seconds`.
+        `[name] seconds [message...]` Set alarm to fire in `seconds`.
         '''
         chat_id = update.message.chat_id
+        name = default_timer
         try:
+            if not args[0].lstrip('-').isdigit():
+                name, args = args[0], args[1:]
             due = int(args[0])
             if due < 0:
                 update.message.reply_text(
                     'Sorry we can not go back to future!'
                 )
                 return
-            job = job_queue.run_once(self.alarm, due, context={
-                'chat_id': chat_id,
-                'text': ' '.join(args[1:]) or 'Beep!'
-            })
-            chat_data['job'] = job
-            update.message.reply_text('Timer successfully set!')
+            replaced = self.timers.set(
+                chat_id,
+                name,
+                due,
+                ' '.join(args[1:]) or 'Beep!',
+            )
+            chat_data['last_timer'] = name
+            if replaced is None:
+                update.message.reply_text('Timer successfully set!')
+            else:
+                update.message.reply_text('Timer successfully replaced!')
         except (IndexError, ValueError):
-            update.message.reply_markdown('Usage: `/set seconds [message...]`')
+            update.message.reply_markdown(
+                'Usage: `/set [name] seconds [message...]`'
+            )
 
-    def unset_timer(self, bot, update, chat_data):
+    def unset_timer(self, bot, update, args, chat_data):
         '''
-        Unset last alarm set.
+        `[name]` Unset alarm `name`, or last alarm set.
         '''
-        if 'job' not in chat_data:
+        chat_id = update.message.chat_id
+        name = args[0] if len(args) > 0 else chat_data.get('last_timer')
+        if name is None or self.timers.cancel(chat_id, name) is None:
             update.message.reply_text('You have no active timer')
             return
-
-        job = chat_data['job']
-        job.schedule_removal()
-        del chat_data['job']
+        if chat_data.get('last_timer') == name:
+            del chat_data['last_timer']
 
         update.message.reply_text('Timer successfully unset!')
+
+    def list_timers(self, bot, update):
+        '''
+        List your active alarms.
+        '''
+        timers = self.timers.chat_timers(update.message.chat_id)
+        if len(timers) == 0:
+            update.message.reply_text('You have no active timer')
+            return
+        update.message.reply_text('\n'.join([
+            f'- {timer.name}: {timer.text}'
+            for timer in timers
+        ]))
+
+    def start_cycle(self, bot, update, args):
+        '''
+        `[work short_break long_break]` Start a pomodoro cycle (minutes).
+        '''
+        try:
+            minutes = [int(arg) for arg in args[:3]]
+            if len(minutes) not in (0, 3) or min(minutes + [1]) <= 0:
+                raise ValueError(args)
+        except ValueError:
+            update.message.reply_markdown(
+                'Usage: `/cycle [work short_break long_break]`'
+            )
+            return
+        config = CycleConfig(*[minute * 60 for minute in minutes])
+        self.cycles.start_cycle(update.message.chat_id, config)
+        update.message.reply_text(
+            f'Pomodoro cycle started, {config.work // 60} minutes of work!'
+        )
+
+    def pause_cycle(self, bot, update):
+        '''
+        Pause your pomodoro cycle.
+        '''
+        if self.cycles.pause(update.message.chat_id) is None:
+            update.message.reply_text('You have no running cycle')
+            return
+        update.message.reply_text('Cycle paused')
+
+    def resume_cycle(self, bot, update):
+        '''
+        Resume your paused pomodoro cycle.
+        '''
+        session = self.cycles.resume(update.message.chat_id)
+        if session is None:
+            update.message.reply_text('You have no paused cycle')
+            return
+        update.message.reply_text(f'Cycle resumed, back to {session.phase}')
+
+    def stop_cycle(self, bot, update):
+        '''
+        Stop your pomodoro cycle.
+        '''
+        if self.cycles.stop_cycle(update.message.chat_id) is None:
+            update.message.reply_text('You have no running cycle')
+            return
+        update.message.reply_text('Cycle stopped')
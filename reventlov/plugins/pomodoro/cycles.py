@@ -0,0 +1,175 @@
+import heapq
+import itertools
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+WORK = 'work'
+SHORT_BREAK = 'short break'
+LONG_BREAK = 'long break'
+
+
+class CycleConfig(object):
+    '''
+    Durations, in seconds, of a pomodoro cycle.
+
+    Configs are shared between the sessions using the same durations.
+    '''
+    __slots__ = ('work', 'short_break', 'long_break', 'rounds')
+
+    def __init__(
+            self,
+            work=25 * 60,
+            short_break=5 * 60,
+            long_break=15 * 60,
+            rounds=4,
+    ):
+        self.work = work
+        self.short_break = short_break
+        self.long_break = long_break
+        self.rounds = rounds
+
+    def phase(self, index):
+        if index % 2 == 0:
+            return WORK
+        if (index // 2 + 1) % self.rounds == 0:
+            return LONG_BREAK
+        return SHORT_BREAK
+
+    def duration(self, index):
+        return {
+            WORK: self.work,
+            SHORT_BREAK: self.short_break,
+            LONG_BREAK: self.long_break,
+        }[self.phase(index)]
+
+    @property
+    def key(self):
+        return self.work, self.short_break, self.long_break, self.rounds
+
+
+class Session(object):
+    __slots__ = ('chat_id', 'config', 'index', 'ends', 'remaining', 'seq')
+
+    def __init__(self, chat_id, config, ends):
+        self.chat_id = chat_id
+        self.config = config
+        self.index = 0
+        self.ends = ends
+        self.remaining = None
+        self.seq = 0
+
+    @property
+    def phase(self):
+        return self.config.phase(self.index)
+
+    @property
+    def paused(self):
+        return self.remaining is not None
+
+
+class CycleTicker(object):
+    '''
+    Single ticker driving every pomodoro cycle.
+
+    Every `tick` seconds, all the sessions whose phase is over are moved to
+    their next phase in one batch, which is handed to `on_advance` as a
+    list of sessions. Paused sessions are out of the heap until resumed.
+    '''
+    def __init__(self, on_advance, tick=1.0):
+        self.on_advance = on_advance
+        self.tick = tick
+        self.sessions = {}
+        self.configs = {}
+        self.heap = []
+        self.counter = itertools.count(1)
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def shared_config(self, config):
+        return self.configs.setdefault(config.key, config)
+
+    def schedule(self, session):
+        session.seq = next(self.counter)
+        heapq.heappush(self.heap, (session.ends, session.seq, session))
+
+    def start_cycle(self, chat_id, config, now=None):
+        now = time.time() if now is None else now
+        with self.lock:
+            config = self.shared_config(config)
+            session = Session(chat_id, config, now + config.duration(0))
+            self.sessions[chat_id] = session
+            self.schedule(session)
+        return session
+
+    def stop_cycle(self, chat_id):
+        with self.lock:
+            return self.sessions.pop(chat_id, None)
+
+    def pause(self, chat_id, now=None):
+        now = time.time() if now is None else now
+        with self.lock:
+            session = self.sessions.get(chat_id)
+            if session is None or session.paused:
+                return None
+            session.remaining = max(0.0, session.ends - now)
+            session.seq = 0
+        return session
+
+    def resume(self, chat_id, now=None):
+        now = time.time() if now is None else now
+        with self.lock:
+            session = self.sessions.get(chat_id)
+            if session is None or not session.paused:
+                return None
+            session.ends = now + session.remaining
+            session.remaining = None
+            self.schedule(session)
+        return session
+
+    def advance(self, now):
+        advanced = []
+        with self.lock:
+            while len(self.heap) > 0 and self.heap[0][0] <= now:
+                _, seq, session = heapq.heappop(self.heap)
+                if session.seq != seq or \
+                        self.sessions.get(session.chat_id) is not session:
+                    continue
+                session.index += 1
+                session.ends += session.config.duration(session.index)
+                if session.ends <= now:
+                    # Missed whole phases, e.g. after a long pause of the
+                    # process: restart the phase from now.
+                    session.ends = now + session.config.duration(session.index)
+                self.schedule(session)
+                advanced.append(session)
+        return advanced
+
+    def run(self):
+        while not self.stopped.wait(self.tick):
+            advanced = self.advance(time.time())
+            if len(advanced) > 0:
+                try:
+                    self.on_advance(advanced)
+                except Exception:
+                    logger.exception('Could not notify pomodoro cycles')
+
+    def start(self):
+        self.stopped.clear()
+        self.thread = threading.Thread(
+            target=self.run,
+            name='pomodoro-cycles',
+            daemon=True,
+        )
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+
+    def __len__(self):
+        return len(self.sessions)
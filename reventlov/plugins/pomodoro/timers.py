@@ -0,0 +1,209 @@
+import heapq
+import itertools
+import logging
+import math
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class Timer(object):
+    __slots__ = ('chat_id', 'name', 'due', 'text', 'seq')
+
+    def __init__(self, chat_id, name, due, text, seq=0):
+        self.chat_id = chat_id
+        self.name = name
+        self.due = due
+        self.text = text
+        self.seq = seq
+
+    @property
+    def key(self):
+        return self.chat_id, self.name
+
+
+class TimerStore(object):
+    '''
+    SQLite table keeping pending timers across restarts.
+    '''
+    def __init__(self, path):
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock, self.connection:
+            self.connection.execute('PRAGMA journal_mode=WAL')
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS timers ('
+                ' chat_id INTEGER NOT NULL,'
+                ' name TEXT NOT NULL,'
+                ' due REAL NOT NULL,'
+                ' text TEXT NOT NULL,'
+                ' PRIMARY KEY (chat_id, name))'
+            )
+
+    def put(self, timer):
+        with self.lock, self.connection:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO timers VALUES (?, ?, ?, ?)',
+                (timer.chat_id, timer.name, timer.due, timer.text),
+            )
+
+    def delete(self, timers):
+        with self.lock, self.connection:
+            self.connection.executemany(
+                'DELETE FROM timers'
+                ' WHERE chat_id = ? AND name = ? AND due = ?',
+                [(timer.chat_id, timer.name, timer.due) for timer in timers],
+            )
+
+    def load(self):
+        with self.lock:
+            rows = self.connection.execute(
+                'SELECT chat_id, name, due, text FROM timers',
+            ).fetchall()
+        return [Timer(*row) for row in rows]
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+
+class TimerEngine(object):
+    '''
+    Heap of pending timers fired from a single thread.
+
+    Timers are rounded up to `tick` seconds, and all the timers of a chat
+    firing in the same tick are handed together to `on_fire`. Replaced or
+    cancelled timers are left in the heap and skipped when popped. Timers
+    are also indexed by chat, to list them without going through all.
+    '''
+    def __init__(self, on_fire, store=None, tick=1.0):
+        self.on_fire = on_fire
+        self.store = store
+        self.tick = tick
+        self.timers = {}
+        self.chats = {}
+        self.heap = []
+        self.counter = itertools.count(1)
+        self.condition = threading.Condition()
+        self.running = False
+        self.thread = None
+
+    def fire_at(self, due):
+        return math.ceil(due / self.tick) * self.tick
+
+    def schedule(self, timer):
+        timer.seq = next(self.counter)
+        self.timers[timer.key] = timer
+        self.chats.setdefault(timer.chat_id, {})[timer.name] = timer
+        heapq.heappush(self.heap, (self.fire_at(timer.due), timer.seq, timer))
+        self.condition.notify()
+
+    def set(self, chat_id, name, seconds, text):
+        timer = Timer(chat_id, name, time.time() + seconds, text)
+        with self.condition:
+            # Stored first, so a timer firing right away never leaves a row.
+            if self.store is not None:
+                self.store.put(timer)
+            replaced = self.timers.get(timer.key)
+            self.schedule(timer)
+        return replaced
+
+    def unindex(self, timer):
+        chat_timers = self.chats.get(timer.chat_id, {})
+        chat_timers.pop(timer.name, None)
+        if len(chat_timers) == 0:
+            self.chats.pop(timer.chat_id, None)
+
+    def cancel(self, chat_id, name):
+        with self.condition:
+            timer = self.timers.pop((chat_id, name), None)
+            if timer is not None:
+                self.unindex(timer)
+            if len(self.heap) > 2 * len(self.timers) + 1024:
+                self.compact()
+        if timer is not None and self.store is not None:
+            self.store.delete([timer])
+        return timer
+
+    def compact(self):
+        self.heap = [
+            entry for entry in self.heap
+            if self.timers.get(entry[2].key) is entry[2]
+        ]
+        heapq.heapify(self.heap)
+
+    def chat_timers(self, chat_id):
+        with self.condition:
+            timers = list(self.chats.get(chat_id, {}).values())
+        return sorted(timers, key=lambda timer: timer.due)
+
+    def load(self, owns=None):
+        '''
+        Schedule the stored timers, only those of chats `owns` accepts.
+        '''
+        if self.store is None:
+            return
+        timers = [
+            timer for timer in self.store.load()
+            if owns is None or owns(timer.chat_id)
+        ]
+        with self.condition:
+            for timer in timers:
+                self.schedule(timer)
+        logger.info(f'Loaded {len(timers)} pending timers')
+
+    def pop_due(self, now):
+        due = {}
+        while len(self.heap) > 0 and self.heap[0][0] <= now:
+            _, seq, timer = heapq.heappop(self.heap)
+            if self.timers.get(timer.key) is not timer or timer.seq != seq:
+                continue
+            del self.timers[timer.key]
+            self.unindex(timer)
+            due.setdefault(timer.chat_id, []).append(timer)
+        return due
+
+    def next_delay(self, now):
+        if len(self.heap) == 0:
+            return None
+        return max(0.0, self.heap[0][0] - now)
+
+    def run(self):
+        while True:
+            with self.condition:
+                due = self.pop_due(time.time())
+                while self.running and len(due) == 0:
+                    self.condition.wait(self.next_delay(time.time()))
+                    due = self.pop_due(time.time())
+                if not self.running:
+                    return
+            if self.store is not None:
+                self.store.delete([
+                    timer for timers in due.values() for timer in timers
+                ])
+            for chat_id, timers in due.items():
+                try:
+                    self.on_fire(chat_id, timers)
+                except Exception:
+                    logger.exception(f'Could not fire timers for {chat_id}')
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(
+            target=self.run,
+            name='pomodoro-timers',
+            daemon=True,
+        )
+        self.thread.start()
+
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+        if self.thread is not None:
+            self.thread.join()
+
+    def __len__(self):
+        return len(self.timers)
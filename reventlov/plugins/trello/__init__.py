@@ -1,68 +1,269 @@
-import os
+import itertools
 import logging
+import threading
+import time
+from urllib.parse import urlsplit
 
 from telegram import ParseMode
 from telegram.ext import CommandHandler
-from trello import TrelloClient
 
+from reventlov.bot_messages import iter_chunks
+from reventlov.bot_plugins import get_from_environment
+from reventlov.bot_plugins import get_int_from_environment
 from reventlov.bot_plugins import get_list_from_environment
 from reventlov.bot_plugin import BotPlugin
+from reventlov.plugins.trello.account import TrelloAccount
+from reventlov.plugins.trello.async_client import AsyncTrelloClient
+from reventlov.plugins.trello.cache import TrelloCache
+from reventlov.plugins.trello.cache import get_ttls_from_environment
+from reventlov.plugins.trello.client import TrelloClient
+from reventlov.plugins.trello.transport import TrelloTransport
+from reventlov.plugins.trello.webhook import TrelloWebhookServer
 
 version = '0.0.1'
 logger = logging.getLogger(__name__)
 logger.info(f'Trello module v{version} loaded')
+list_usage = 'You can specify either one of: `orgs`, `boards`, ' \
+             'or use a `board_name` to list its cards'
+
+
+def parse_page(args):
+    if len(args) == 3 and args[1] == 'page' and args[2].isdigit():
+        return int(args[2])
+    return 1
 
 
 class TrelloPlugin(BotPlugin):
     '''
     I can manage Trello boards for you
     '''
-    def __init__(self, dispatcher):
-        self.client = TrelloClient(
-            api_key=os.getenv('TRELLO_API_KEY'),
-            api_secret=os.getenv('TRELLO_API_SECRET'),
-            token=os.getenv('TRELLO_API_TOKEN'),
+    command_costs = {'list': 3, 'find': 2}
+
+    def __init__(self, dispatcher, tenant=None):
+        self.tenant = tenant
+        max_connections = get_int_from_environment(
+            'TRELLO_MAX_CONNECTIONS',
+            10,
+            tenant,
+        )
+        connect_timeout = get_int_from_environment(
+            'TRELLO_CONNECT_TIMEOUT',
+            5,
+            tenant,
+        )
+        read_timeout = get_int_from_environment(
+            'TRELLO_READ_TIMEOUT',
+            30,
+            tenant,
+        )
+        api_key = get_from_environment('TRELLO_API_KEY', tenant=tenant)
+        api_secret = get_from_environment('TRELLO_API_SECRET', tenant=tenant)
+        api_token = get_from_environment('TRELLO_API_TOKEN', tenant=tenant)
+        api_url = get_from_environment('TRELLO_API_URL', tenant=tenant)
+        # Tenants using the same Trello account share clients and data.
+        self.account_key = (api_key, api_token, api_url)
+
+        def create_account():
+            return TrelloAccount(
+                TrelloClient(
+                    api_key=api_key,
+                    api_secret=api_secret,
+                    token=api_token,
+                    api_url=api_url,
+                    transport=TrelloTransport(
+                        pool_size=max_connections,
+                        connect_timeout=connect_timeout,
+                        read_timeout=read_timeout,
+                    ),
+                ),
+                AsyncTrelloClient(
+                    api_key=api_key,
+                    token=api_token,
+                    api_url=api_url,
+                    max_connections=max_connections,
+                    connect_timeout=connect_timeout,
+                    read_timeout=read_timeout,
+                ),
+                TrelloCache(
+                    ttls=get_ttls_from_environment(tenant),
+                    max_entries=get_int_from_environment(
+                        'TRELLO_CACHE_SIZE',
+                        256,
+                        tenant,
+                    ),
+                    stale_ttl=get_int_from_environment(
+                        'TRELLO_CACHE_STALE',
+                        300,
+                        tenant,
+                    ),
+                ),
+                prefetch_top=get_int_from_environment(
+                    'TRELLO_PREFETCH_BOARDS',
+                    5,
+                    tenant,
+                ),
+                prefetch_interval=get_int_from_environment(
+                    'TRELLO_PREFETCH_INTERVAL',
+                    30,
+                    tenant,
+                ),
+                prefetch_budget=get_int_from_environment(
+                    'TRELLO_PREFETCH_BUDGET',
+                    30,
+                    tenant,
+                ),
+            )
+
+        self.account = self.share(
+            'account',
+            self.account_key,
+            create_account,
+            close=TrelloAccount.stop,
+        )
+        self.client = self.account.client
+        self.async_client = self.account.async_client
+        self.cache = self.account.cache
+        self.index = self.account.index
+        self.prefetcher = self.account.prefetcher
+        self.admins = get_list_from_environment('TRELLO_ADMINS', tenant)
+        self.page_columns = get_int_from_environment(
+            'TRELLO_PAGE_COLUMNS',
+            10,
+            tenant,
         )
-        self.admins = get_list_from_environment('TRELLO_ADMINS')
-        self.load_orgs()
-        self.__boards = []
         self.handlers = [
             CommandHandler(
                 'list',
                 self.list_objects,
                 pass_args=True,
-            )
+            ),
+            CommandHandler(
+                'find',
+                self.find,
+                pass_args=True,
+            ),
+            CommandHandler(
+                'flush_trello',
+                self.flush_cache,
+            ),
         ]
         self.add_handlers(dispatcher)
+        self.webhook_server = None
+        if get_from_environment('TRELLO_WEBHOOK_PORT', tenant=tenant) \
+                is not None:
+            self.start_webhook_server()
         self.version = '0.0.1'
         logger.info(f'Trello plugin v{version} enabled')
 
+    @property
+    def gauges(self):
+        gauges = dict(self.client.transport.stats)
+        gauges['async_connections_opened'] = self.async_client.pool.opened
+        gauges['async_connections_reused'] = self.async_client.pool.reused
+        gauges['cache_entries'] = len(self.cache)
+        gauges['index_documents'] = len(self.index)
+        gauges.update({
+            f'prefetch_{name}': value
+            for name, value in self.prefetcher.stats.items()
+        })
+        return gauges
+
     @property
     def organization(self):
-        if len(self.__orgs) == 1:
-            return self.__orgs[0]
+        if len(self.orgs) == 1:
+            return self.orgs[0]
         else:
-            return os.getenv('TRELLO_DEFAULT_ORGANIZATION')
+            return get_from_environment(
+                'TRELLO_DEFAULT_ORGANIZATION',
+                tenant=self.tenant,
+            )
 
     def load_orgs(self):
         logger.info('Getting organizations')
-        self.__orgs = self.client.list_organizations()
+        return self.client.list_organizations()
 
     def load_boards(self):
         logger.info('Getting boards')
-        self.__boards = self.organization.get_boards('open')
+        return self.organization.get_boards('open')
 
     @property
     def orgs(self):
-        if len(self.__orgs) == 0:
-            self.load_orgs()
-        return self.__orgs
+        return self.cache.get('orgs', 'all', self.load_orgs)
 
     @property
     def boards(self):
-        if len(self.__boards) == 0:
-            self.load_boards()
-        return self.__boards
+        return self.cache.get('boards', 'open', self.load_boards)
+
+    def bootstrap(self):
+        self.cache.load('orgs', 'all', self.load_orgs)
+        threading.Thread(
+            target=self.build_index,
+            name='trello-index',
+            daemon=True,
+        ).start()
+        self.prefetcher.start()
+
+    @property
+    def index_ready(self):
+        return self.index.ready
+
+    def build_index(self):
+        started = time.perf_counter()
+        try:
+            for board in self.boards:
+                if board.id not in self.index.board_documents:
+                    self.index.put_snapshot(
+                        self.account.get_board_snapshot(board),
+                    )
+        except Exception:
+            logger.exception('Could not index Trello boards')
+            return
+        self.index.ready = True
+        logger.info(
+            f'Indexed {len(self.index)} Trello objects in '
+            f'{time.perf_counter() - started:.1f}s'
+        )
+
+    def start_webhook_server(self):
+        address = (
+            get_from_environment(
+                'TRELLO_WEBHOOK_HOST',
+                '127.0.0.1',
+                self.tenant,
+            ),
+            get_int_from_environment('TRELLO_WEBHOOK_PORT', 0, self.tenant),
+        )
+        callback_url = get_from_environment(
+            'TRELLO_WEBHOOK_CALLBACK_URL',
+            tenant=self.tenant,
+        )
+        path = urlsplit(callback_url or '').path
+        self.webhook_server = self.share(
+            'webhook',
+            address,
+            lambda: self.create_webhook_server(address),
+            close=TrelloWebhookServer.stop,
+        )
+        # Each account gets its own callback path and secret.
+        self.share(
+            'webhook_route',
+            self.account_key + address + (path,),
+            lambda: self.webhook_server.add_route(
+                path,
+                self.account.apply_webhook_action,
+                secret=get_from_environment(
+                    'TRELLO_API_SECRET',
+                    tenant=self.tenant,
+                ),
+                callback_url=callback_url,
+            ),
+            close=self.webhook_server.remove_route,
+        )
+
+    def create_webhook_server(self, address):
+        webhook_server = TrelloWebhookServer(address)
+        webhook_server.start()
+        return webhook_server
 
     @property
     def org_names(self):
@@ -73,12 +274,7 @@ class TrelloPlugin(BotPlugin):
         return [board.name for board in self.boards]
 
     def get_board(self, board_name):
-        board_found = None
-        for board in self.boards:
-            if board.name == board_name:
-                board_found = board
-                break
-        return board_found
+        return self.account.find_board(self.boards, board_name)
 
     def list_orgs(self):
         msg = '\n'.join([
@@ -95,52 +291,122 @@ class TrelloPlugin(BotPlugin):
         ])
         return msg, ParseMode.MARKDOWN
 
-    def list_column_cards(self, column):
-        msg = '\n'.join([
-            f'    + {card.name}'
-            for card in column.list_cards()
-        ])
-        return msg
-
-    def list_board_columns(self, board_name):
-        msg = f'No such board `{board_name}`'
-        board = self.get_board(board_name)
-        if board is not None:
-            msg = '\n'.join([
-                f'- {column.name} ({column.cardsCnt()} cards) '
-                f'\n{self.list_column_cards(column)}'.strip()
-                for column in board.open_lists()
-            ])
-        return msg, ParseMode.HTML
-
-    def list_objects(self, bot, update, args):
+    def iter_board_lines(self, columns):
+        for column, cards in columns:
+            if len(cards) == 0:
+                yield f'- {column["name"]} (0 cards)'
+                continue
+            yield f'- {column["name"]} ({len(cards)} cards) '
+            for card in cards:
+                yield f'    + {card["name"]}'
+
+    def iter_board_page(self, board_name, snapshot, page):
+        pages = max(1, -(-snapshot.column_count // self.page_columns))
+        if page < 1 or page > pages:
+            yield f'No page {page} in `{board_name}`, it has {pages} pages'
+            return
+        yield from self.iter_board_lines(snapshot.iter_columns(
+            (page - 1) * self.page_columns,
+            page * self.page_columns,
+        ))
+        if page < pages:
+            yield ''
+            yield f'Page {page} of {pages}, use ' \
+                  f'`/list {board_name} page {page + 1}` for more'
+
+    async def list_board_page(self, board, page=1):
+        self.prefetcher.record(board.id)
+        snapshot = await self.account.get_board_snapshot_async(board)
+        return self.iter_board_page(board.name, snapshot, page), ParseMode.HTML
+
+    async def list_objects(self, bot, update, args):
         '''
         List Trello objects visible to me.
 
         Object type depends on first argument:
           - `orgs`: List organizations.
           - `boards`: List boards.
-          - `board_name`: List cards in `board_name`.
+          - `board_name`: List cards in `board_name`, followed by
+            `page N` for its Nth page of columns.
         By default it lists organizations.
+        Long lists are sent in several messages.
         '''
-        msg = ''
+        lines = []
         parse_mode = None
         if update.message.from_user.username in self.admins:
             if len(args) < 1 or args[0] == 'orgs':
-                msg, parse_mode = self.list_orgs()
+                msg, parse_mode = await self.run_blocking(self.list_orgs)
+                lines = msg.split('\n')
             elif args[0] == 'boards':
-                msg, parse_mode = self.list_boards()
-            elif args[0] in self.board_names:
-                msg, parse_mode = self.list_board_columns(args[0])
+                msg, parse_mode = await self.run_blocking(self.list_boards)
+                lines = msg.split('\n')
             else:
-                msg = f'No such board `{args[0]}`'
-                parse_mode = ParseMode.MARKDOWN
-            msg += '\n\nYou can specify either one of: `orgs`, `boards`, ' \
-                   'or use a `board_name` to list its cards'
+                board = await self.run_blocking(self.get_board, args[0])
+                if board is not None:
+                    lines, parse_mode = await self.list_board_page(
+                        board,
+                        parse_page(args),
+                    )
+                else:
+                    lines = [f'No such board `{args[0]}`']
+                    parse_mode = ParseMode.MARKDOWN
+            lines = itertools.chain(lines, ['', list_usage])
+        else:
+            lines = ['You must be admin to list Trello objects']
+        for chunk in iter_chunks(lines):
+            bot.send_message(
+                chat_id=update.message.chat_id,
+                text=chunk,
+                parse_mode=parse_mode,
+            )
+
+    def describe_match(self, document):
+        _, board_name = document.board
+        if document.kind == 'board':
+            return f'- board {document.name}'
+        if document.kind == 'list':
+            return f'- list {document.name} ({board_name})'
+        return f'- card {document.name} ({board_name} / {document.column})'
+
+    def find(self, bot, update, args):
+        '''
+        `query` Find boards, lists and cards matching `query`.
+
+        Words are matched against names and card descriptions, allowing
+        prefixes and typos. Best matches come first.
+        '''
+        if update.message.from_user.username not in self.admins:
+            msg = 'You must be admin to find Trello objects'
+        elif len(args) == 0:
+            msg = 'You must specify what you want to find'
+        else:
+            query = ' '.join(args)
+            matches = self.index.search(query)
+            if len(matches) > 0:
+                msg = '\n'.join([
+                    self.describe_match(document) for document in matches
+                ])
+            else:
+                msg = f'Nothing found for {query}'
+                if not self.index_ready:
+                    msg += ', I am still indexing boards'
+        bot.send_message(
+            chat_id=update.message.chat_id,
+            text=msg,
+        )
+
+    def flush_cache(self, bot, update):
+        '''
+        Flush cached Trello objects.
+
+        Next requests will reload organizations, boards and cards from Trello.
+        '''
+        if update.message.from_user.username in self.admins:
+            flushed = self.cache.flush()
+            msg = f'Flushed {flushed} cached Trello objects'
         else:
-            msg = 'You must be admin to list Trello objects'
+            msg = 'You must be admin to flush Trello cache'
         bot.send_message(
             chat_id=update.message.chat_id,
             text=msg,
-            parse_mode=parse_mode,
         )
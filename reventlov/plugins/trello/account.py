@@ -0,0 +1,138 @@
+import logging
+
+from reventlov.plugins.trello.board_snapshot import BoardSnapshot
+from reventlov.plugins.trello.prefetch import BoardPrefetcher
+from reventlov.plugins.trello.search import SearchIndex
+
+logger = logging.getLogger(__name__)
+board_list_actions = (
+    'createBoard',
+    'deleteBoard',
+    'addToOrganizationBoard',
+    'removeFromOrganizationBoard',
+)
+
+
+class TrelloAccount(object):
+    '''
+    Clients, cache, search index and prefetcher of one Trello account.
+
+    Plugins of the tenant bots using the same account share it, so it only
+    refers to these shared objects, never to a plugin.
+    '''
+    def __init__(
+            self,
+            client,
+            async_client,
+            cache,
+            prefetch_top=5,
+            prefetch_interval=30,
+            prefetch_budget=30,
+    ):
+        self.client = client
+        self.async_client = async_client
+        self.cache = cache
+        self.index = SearchIndex()
+        self.boards_by_name = (None, {})
+        self.prefetcher = BoardPrefetcher(
+            self.refresh_snapshot,
+            lambda board_id: self.cache.expires_in('snapshots', board_id),
+            top=prefetch_top,
+            interval=prefetch_interval,
+            budget=prefetch_budget,
+        )
+
+    def find_board(self, boards, board_name):
+        indexed_boards, by_name = self.boards_by_name
+        if indexed_boards is not boards:
+            by_name = {}
+            for board in boards:
+                by_name.setdefault(board.name, board)
+            self.boards_by_name = (boards, by_name)
+        return by_name.get(board_name)
+
+    def load_snapshot(self, board_id):
+        snapshot = BoardSnapshot.fetch(self.client, board_id)
+        self.index.put_snapshot(snapshot)
+        return snapshot
+
+    async def load_snapshot_async(self, board_id):
+        snapshot = await BoardSnapshot.fetch_async(self.async_client, board_id)
+        self.index.put_snapshot(snapshot)
+        return snapshot
+
+    def refresh_snapshot(self, board_id):
+        self.cache.load(
+            'snapshots',
+            board_id,
+            lambda: self.load_snapshot(board_id),
+        )
+
+    def get_board_snapshot(self, board):
+        return self.cache.get(
+            'snapshots',
+            board.id,
+            lambda: self.load_snapshot(board.id),
+        )
+
+    async def get_board_snapshot_async(self, board):
+        return await self.cache.get_async(
+            'snapshots',
+            board.id,
+            lambda: self.load_snapshot_async(board.id),
+        )
+
+    def patch_board(self, board_data):
+        boards = self.cache.peek('boards', 'open')
+        if boards is None:
+            return
+        if board_data.get('closed'):
+            self.cache.put('boards', 'open', [
+                board for board in boards if board.id != board_data['id']
+            ])
+            return
+        for board in boards:
+            if board.id == board_data['id'] and 'name' in board_data:
+                board.name = board_data['name']
+                self.boards_by_name = (None, {})
+                if board.id in self.index.board_documents:
+                    self.index.put_board(board.id, board.name)
+
+    def apply_webhook_action(self, action):
+        action_type = action.get('type')
+        board_data = action.get('data', {}).get('board', {})
+        logger.info(f'Applying Trello {action_type} action')
+        if action_type == 'updateBoard':
+            self.patch_board(board_data)
+        elif action_type in board_list_actions:
+            self.cache.invalidate('boards')
+        snapshot = self.cache.peek('snapshots', board_data.get('id'))
+        if snapshot is None:
+            return
+        if snapshot.apply_action(action):
+            self.index_action(snapshot, action)
+        else:
+            self.cache.invalidate('snapshots', snapshot.id)
+
+    def index_action(self, snapshot, action):
+        if action.get('type') == 'updateBoard':
+            self.index.put_snapshot(snapshot)
+            return
+        board = (snapshot.id, snapshot.name)
+        data = action.get('data', {})
+        if 'list' in data:
+            column = snapshot.columns.get(data['list'].get('id'))
+            if column is None:
+                self.index.remove(('list', data['list'].get('id')))
+            else:
+                self.index.put_column(board, column)
+        if 'card' in data:
+            card = snapshot.cards.get(data['card'].get('id'))
+            if card is None:
+                self.index.remove(('card', data['card'].get('id')))
+            else:
+                column = snapshot.columns.get(card.get('idList'), {})
+                self.index.put_card(board, column.get('name'), card)
+
+    def stop(self):
+        self.prefetcher.stop()
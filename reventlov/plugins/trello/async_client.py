@@ -0,0 +1,184 @@
+import asyncio
+import json
+import ssl
+from collections import namedtuple
+from urllib.parse import urlencode, urlsplit
+
+from trello.exceptions import ResourceUnavailable, Unauthorized
+
+from reventlov.bot_metrics import registry
+from reventlov.plugins.trello.client import default_api_url, endpoint
+
+Response = namedtuple('Response', ('status_code', 'headers', 'content'))
+
+
+class ConnectionPool(object):
+    '''
+    Keep-alive HTTP/1.1 connections to a single host, for coroutines.
+
+    At most `max_connections` requests are in flight at once; connections
+    are reused once their response has been read in full.
+    '''
+    def __init__(
+            self,
+            url,
+            max_connections=10,
+            connect_timeout=5,
+            read_timeout=30,
+    ):
+        parts = urlsplit(url)
+        self.host = parts.hostname
+        self.ssl = ssl.create_default_context() \
+            if parts.scheme == 'https' else None
+        self.port = parts.port or (443 if self.ssl else 80)
+        self.max_connections = max_connections
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.idle = []
+        self.semaphore = None
+        self.opened = 0
+        self.reused = 0
+
+    async def connect(self):
+        if len(self.idle) > 0:
+            self.reused += 1
+            return self.idle.pop(), True
+        self.opened += 1
+        connection = await asyncio.wait_for(
+            asyncio.open_connection(self.host, self.port, ssl=self.ssl),
+            self.connect_timeout,
+        )
+        return connection, False
+
+    async def read_body(self, reader, headers):
+        if headers.get('transfer-encoding', '').lower() == 'chunked':
+            chunks = []
+            while True:
+                size = int((await reader.readline()).split(b';')[0], 16)
+                if size == 0:
+                    while (await reader.readline()) not in (b'\r\n', b''):
+                        pass
+                    return b''.join(chunks), True
+                chunks.append(await reader.readexactly(size))
+                await reader.readexactly(2)
+        if 'content-length' in headers:
+            length = int(headers['content-length'])
+            return await reader.readexactly(length), True
+        return await reader.read(), False
+
+    async def read_response(self, reader):
+        status_line = await reader.readline()
+        if status_line == b'':
+            raise ConnectionResetError('Connection closed by the server')
+        status_code = int(status_line.split()[1])
+        headers = {}
+        while True:
+            line = (await reader.readline()).decode('latin-1').strip()
+            if line == '':
+                break
+            name, value = line.split(':', 1)
+            headers[name.strip().lower()] = value.strip()
+        content, reusable = await self.read_body(reader, headers)
+        reusable = reusable and headers.get('connection') != 'close'
+        return Response(status_code, headers, content), reusable
+
+    async def exchange(self, method, path, headers):
+        (reader, writer), reused = await self.connect()
+        request = [f'{method} {path} HTTP/1.1', f'Host: {self.host}']
+        request.extend([f'{name}: {value}' for name, value in headers.items()])
+        try:
+            writer.write(('\r\n'.join(request) + '\r\n\r\n').encode())
+            response, reusable = await asyncio.wait_for(
+                self.read_response(reader),
+                self.read_timeout,
+            )
+        except (ConnectionError, asyncio.IncompleteReadError):
+            writer.close()
+            if reused:
+                # The server closed the idle connection: retry on a new one.
+                return await self.exchange(method, path, headers)
+            raise
+        except BaseException:
+            writer.close()
+            raise
+        if reusable:
+            self.idle.append((reader, writer))
+        else:
+            writer.close()
+        return response
+
+    async def request(self, method, path, headers=None):
+        if self.semaphore is None:
+            self.semaphore = asyncio.Semaphore(self.max_connections)
+        async with self.semaphore:
+            return await self.exchange(method, path, dict(headers or {}))
+
+    def close(self):
+        while len(self.idle) > 0:
+            _, writer = self.idle.pop()
+            writer.close()
+
+
+class AsyncTrelloClient(object):
+    '''
+    Read-only Trello client for coroutines, over a pool of keep-alive
+    connections, so many calls can wait on Trello at once.
+
+    Identical calls in flight at the same time are sent once.
+    '''
+    def __init__(
+            self,
+            api_key,
+            token,
+            api_url=None,
+            max_connections=10,
+            connect_timeout=5,
+            read_timeout=30,
+    ):
+        self.api_key = api_key
+        self.token = token
+        self.api_url = (api_url or default_api_url).rstrip('/')
+        self.pool = ConnectionPool(
+            self.api_url,
+            max_connections,
+            connect_timeout,
+            read_timeout,
+        )
+        self.flights = {}
+
+    async def get(self, path, operation):
+        with registry.timed('trello', operation):
+            return await self.pool.request(
+                'GET',
+                path,
+                headers={'Accept': 'application/json'},
+            )
+
+    async def coalesced_get(self, path, operation):
+        flight = self.flights.get(path)
+        if flight is not None:
+            registry.count('trello', operation, 'coalesced')
+            return await asyncio.shield(flight)
+        flight = asyncio.ensure_future(self.get(path, operation))
+        self.flights[path] = flight
+        try:
+            return await asyncio.shield(flight)
+        finally:
+            if self.flights.get(path) is flight:
+                del self.flights[path]
+
+    async def fetch_json(self, uri_path, query_params=None):
+        query_params = dict(query_params or {})
+        query_params['key'] = self.api_key
+        query_params['token'] = self.token
+        url = f'{self.api_url}/{uri_path.lstrip("/")}'
+        response = await self.coalesced_get(
+            f'{urlsplit(url).path}?{urlencode(sorted(query_params.items()))}',
+            f'GET {endpoint(uri_path)}',
+        )
+        text = response.content.decode('utf-8')
+        if response.status_code == 401:
+            raise Unauthorized(f'{text} at {url}', response)
+        if response.status_code != 200:
+            raise ResourceUnavailable(f'{text} at {url}', response)
+        return json.loads(text)
@@ -0,0 +1,169 @@
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+snapshot_query_params = {
+    'fields': 'name',
+    'lists': 'open',
+    'list_fields': 'name,pos,closed',
+    'cards': 'open',
+    'card_fields': 'name,desc,idList,pos,closed',
+}
+
+ignored_actions = (
+    'addMemberToCard',
+    'removeMemberFromCard',
+    'commentCard',
+    'addLabelToCard',
+    'removeLabelFromCard',
+    'addChecklistToCard',
+    'updateCheckItemStateOnCard',
+)
+
+
+def by_pos(trello_obj):
+    return trello_obj.get('pos') or 0
+
+
+class BoardSnapshot(object):
+    '''
+    Open lists and open cards of a Trello board, fetched in one request.
+
+    Cards are grouped by list in memory so columns can be rendered, and
+    their cards counted, without any further call to Trello.
+    '''
+    def __init__(self, board_id, name, columns, cards):
+        self.id = board_id
+        self.name = name
+        self.columns = {column['id']: column for column in columns}
+        self.cards = {card['id']: card for card in cards}
+        self.lock = threading.RLock()
+        self.group_cards()
+
+    @classmethod
+    def from_json(cls, json_obj):
+        return cls(
+            json_obj['id'],
+            json_obj.get('name', ''),
+            json_obj.get('lists', []),
+            json_obj.get('cards', []),
+        )
+
+    @classmethod
+    def fetch(cls, client, board_id):
+        logger.info(f'Getting snapshot of board {board_id}')
+        json_obj = client.fetch_json(
+            f'/boards/{board_id}',
+            query_params=dict(snapshot_query_params),
+        )
+        return cls.from_json(json_obj)
+
+    @classmethod
+    async def fetch_async(cls, client, board_id):
+        logger.info(f'Getting snapshot of board {board_id}')
+        json_obj = await client.fetch_json(
+            f'/boards/{board_id}',
+            query_params=dict(snapshot_query_params),
+        )
+        return cls.from_json(json_obj)
+
+    def group_cards(self):
+        self.__cards_by_column = {column_id: [] for column_id in self.columns}
+        for card in self.cards.values():
+            if card['idList'] in self.__cards_by_column:
+                self.__cards_by_column[card['idList']].append(card)
+        for cards in self.__cards_by_column.values():
+            cards.sort(key=by_pos)
+
+    def column_cards(self, column_id):
+        with self.lock:
+            return list(self.__cards_by_column.get(column_id, []))
+
+    def iter_columns(self, start=0, stop=None):
+        '''
+        Columns, with their cards, from the `start`th to the `stop`th.
+
+        Only the cards of the columns asked for are gathered.
+        '''
+        with self.lock:
+            columns = [
+                (column, self.column_cards(column['id']))
+                for column in sorted(
+                    self.columns.values(),
+                    key=by_pos,
+                )[start:stop]
+            ]
+        return iter(columns)
+
+    @property
+    def column_count(self):
+        return len(self.columns)
+
+    def put_card(self, card):
+        with self.lock:
+            if card.get('closed'):
+                self.cards.pop(card['id'], None)
+            else:
+                self.cards[card['id']] = card
+            self.group_cards()
+
+    def update_card(self, card_data, column_id=None):
+        with self.lock:
+            card = dict(self.cards.get(card_data['id'], {}))
+            card.update(card_data)
+            if column_id is not None:
+                card['idList'] = column_id
+            if 'idList' not in card:
+                return False
+            self.put_card(card)
+        return True
+
+    def remove_card(self, card_id):
+        with self.lock:
+            self.cards.pop(card_id, None)
+            self.group_cards()
+
+    def put_column(self, column_data):
+        with self.lock:
+            column = dict(self.columns.get(column_data['id'], {}))
+            column.update(column_data)
+            if column.get('closed'):
+                self.columns.pop(column['id'], None)
+            else:
+                self.columns[column['id']] = column
+            self.group_cards()
+
+    def apply_action(self, action):
+        '''
+        Patch this snapshot with a Trello webhook action.
+
+        Returns `False` if the action type is not supported, so the caller
+        can fall back to fetching the board again.
+        '''
+        action_type = action.get('type')
+        data = action.get('data', {})
+        if action_type in ('createCard', 'copyCard', 'moveCardToBoard'):
+            card = dict(data['card'])
+            card.setdefault('pos', float('inf'))
+            return self.update_card(card, data.get('list', {}).get('id'))
+        if action_type == 'updateCard':
+            column_id = data.get('listAfter', data.get('list', {})).get('id')
+            return self.update_card(data['card'], column_id)
+        if action_type in ('deleteCard', 'moveCardFromBoard'):
+            self.remove_card(data['card']['id'])
+            return True
+        if action_type in ('createList', 'updateList', 'moveListToBoard'):
+            self.put_column(data['list'])
+            return True
+        if action_type == 'moveListFromBoard':
+            self.put_column(dict(data['list'], closed=True))
+            return True
+        if action_type == 'updateBoard':
+            self.name = data['board'].get('name', self.name)
+            return True
+        return action_type in ignored_actions
+
+    @property
+    def column_names(self):
+        return [column['name'] for column, _ in self.iter_columns()]
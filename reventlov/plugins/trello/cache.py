@@ -0,0 +1,189 @@
+import asyncio
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from reventlov.bot_plugins import get_int_from_environment
+from reventlov.plugins.trello.transport import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+default_ttls = {
+    'orgs': 3600,
+    'boards': 600,
+    'snapshots': 60,
+}
+
+
+def get_ttls_from_environment(tenant=None):
+    return {
+        kind: get_int_from_environment(
+            f'TRELLO_CACHE_TTL_{kind.upper()}',
+            ttl,
+            tenant,
+        )
+        for kind, ttl in default_ttls.items()
+    }
+
+
+class CacheEntry(object):
+    def __init__(self, value, ttl, stale_ttl):
+        self.value = value
+        self.loaded_at = time.monotonic()
+        self.expires_at = self.loaded_at + ttl
+        self.stale_until = self.expires_at + stale_ttl
+
+    @property
+    def fresh(self):
+        return time.monotonic() < self.expires_at
+
+    @property
+    def usable(self):
+        return time.monotonic() < self.stale_until
+
+
+class TrelloCache(object):
+    '''
+    Bounded LRU cache of Trello objects with per-kind TTLs.
+
+    Expired entries are still served for `stale_ttl` seconds while a
+    background thread reloads them (stale-while-revalidate). Past that
+    window, they are reloaded synchronously, concurrent misses of the same
+    key waiting for a single load.
+    '''
+    def __init__(self, ttls=None, max_entries=256, stale_ttl=300):
+        self.ttls = dict(default_ttls if ttls is None else ttls)
+        self.max_entries = max_entries
+        self.stale_ttl = stale_ttl
+        self.entries = OrderedDict()
+        self.refreshing = set()
+        self.flights = SingleFlight()
+        self.lock = threading.RLock()
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def ttl(self, kind):
+        return self.ttls.get(kind, 0)
+
+    def put(self, kind, key, value):
+        entry = CacheEntry(value, self.ttl(kind), self.stale_ttl)
+        with self.lock:
+            self.entries[(kind, key)] = entry
+            self.entries.move_to_end((kind, key))
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+        return value
+
+    def peek(self, kind, key):
+        with self.lock:
+            entry = self.entries.get((kind, key))
+        return None if entry is None else entry.value
+
+    def expires_in(self, kind, key):
+        '''
+        Seconds left before the entry for `key` needs reloading.
+        '''
+        with self.lock:
+            entry = self.entries.get((kind, key))
+        if entry is None:
+            return 0.0
+        return entry.expires_at - time.monotonic()
+
+    def load(self, kind, key, loader):
+        return self.put(kind, key, loader())
+
+    def revalidate(self, kind, key, loader):
+        try:
+            self.load(kind, key, loader)
+        except Exception:
+            logger.exception(f'Could not revalidate {kind} {key}')
+        finally:
+            with self.lock:
+                self.refreshing.discard((kind, key))
+
+    def claim_revalidation(self, kind, key):
+        with self.lock:
+            if (kind, key) in self.refreshing:
+                return False
+            self.refreshing.add((kind, key))
+            return True
+
+    def start_revalidation(self, kind, key, loader):
+        if not self.claim_revalidation(kind, key):
+            return
+        threading.Thread(
+            target=self.revalidate,
+            args=(kind, key, loader),
+            daemon=True,
+        ).start()
+
+    async def revalidate_async(self, kind, key, loader):
+        try:
+            self.put(kind, key, await loader())
+        except Exception:
+            logger.exception(f'Could not revalidate {kind} {key}')
+        finally:
+            with self.lock:
+                self.refreshing.discard((kind, key))
+
+    def lookup(self, kind, key):
+        with self.lock:
+            entry = self.entries.get((kind, key))
+            if entry is None or not entry.usable:
+                self.misses += 1
+                return None
+            self.entries.move_to_end((kind, key))
+            if entry.fresh:
+                self.hits += 1
+            else:
+                self.stale_hits += 1
+            return entry
+
+    def load_once(self, kind, key, loader):
+        def load():
+            with self.lock:
+                entry = self.entries.get((kind, key))
+            # Loaded by a call that finished while this one was starting.
+            if entry is not None and entry.fresh:
+                return entry.value
+            return self.load(kind, key, loader)
+        value, _ = self.flights.do((kind, key), load)
+        return value
+
+    def get(self, kind, key, loader):
+        entry = self.lookup(kind, key)
+        if entry is None:
+            return self.load_once(kind, key, loader)
+        if not entry.fresh:
+            self.start_revalidation(kind, key, loader)
+        return entry.value
+
+    async def get_async(self, kind, key, loader):
+        '''
+        Same as `get`, for a `loader` coroutine function.
+        '''
+        entry = self.lookup(kind, key)
+        if entry is None:
+            return self.put(kind, key, await loader())
+        if not entry.fresh and self.claim_revalidation(kind, key):
+            asyncio.ensure_future(self.revalidate_async(kind, key, loader))
+        return entry.value
+
+    def invalidate(self, kind, key=None):
+        with self.lock:
+            for entry_key in list(self.entries):
+                if entry_key[0] == kind and key in (None, entry_key[1]):
+                    del self.entries[entry_key]
+
+    def flush(self):
+        with self.lock:
+            flushed = len(self.entries)
+            self.entries.clear()
+        return flushed
+
+    def __len__(self):
+        return len(self.entries)
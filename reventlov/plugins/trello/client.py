@@ -0,0 +1,71 @@
+import json
+import re
+
+import trello
+from trello.exceptions import ResourceUnavailable, Unauthorized
+
+from reventlov.plugins.trello.transport import TrelloTransport
+
+trello_id = re.compile(r'^[0-9a-fA-F]{24}$')
+default_api_url = 'https://api.trello.com/1'
+
+
+def endpoint(uri_path):
+    '''
+    Path of a Trello API call with its object ids replaced by `{id}`.
+    '''
+    return '/' + '/'.join([
+        '{id}' if trello_id.match(part) else part
+        for part in uri_path.split('?')[0].strip('/').split('/')
+    ])
+
+
+class TrelloClient(trello.TrelloClient):
+    '''
+    Trello client sending its calls through a `TrelloTransport`, which
+    times every call in the metrics registry.
+
+    Calls go to `api_url`, so a local stand-in of the Trello API can be
+    used.
+    '''
+    def __init__(self, *args, api_url=None, transport=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.api_url = (api_url or default_api_url).rstrip('/')
+        self.transport = transport or TrelloTransport()
+
+    def fetch_json(
+            self,
+            uri_path,
+            http_method='GET',
+            headers=None,
+            query_params=None,
+            post_args=None,
+            files=None,
+    ):
+        headers = dict(headers or {})
+        query_params = dict(query_params or {})
+        data = None
+        if files is None:
+            data = json.dumps(post_args or {})
+        if http_method in ('POST', 'PUT', 'DELETE') and not files:
+            headers['Content-Type'] = 'application/json; charset=utf-8'
+        headers['Accept'] = 'application/json'
+        url = f'{self.api_url}/{uri_path.lstrip("/")}'
+        if self.oauth is None:
+            query_params['key'] = self.api_key
+            query_params['token'] = self.api_secret
+        response = self.transport.request(
+            http_method,
+            url,
+            f'{http_method} {endpoint(uri_path)}',
+            params=query_params,
+            headers=headers,
+            data=data,
+            auth=self.oauth,
+            files=files,
+        )
+        if response.status_code == 401:
+            raise Unauthorized(f'{response.text} at {url}', response)
+        if response.status_code != 200:
+            raise ResourceUnavailable(f'{response.text} at {url}', response)
+        return response.json()
@@ -0,0 +1,137 @@
+import heapq
+import logging
+import random
+import threading
+import time
+
+from reventlov.bot_outbox import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+
+class BoardPrefetcher(object):
+    '''
+    Keeps the most requested boards warm.
+
+    Board accesses are counted, with counts halved on every round so they
+    follow recent traffic. Every `interval` seconds, give or take `jitter`
+    of it, the `top` boards whose snapshot would expire before the next
+    round are reloaded by `refresh`, spending at most `budget` Trello calls
+    per minute.
+    '''
+    def __init__(
+            self,
+            refresh,
+            expires_in,
+            top=5,
+            interval=30,
+            jitter=0.2,
+            budget=30,
+            decay=0.5,
+    ):
+        self.refresh = refresh
+        self.expires_in = expires_in
+        self.top = top
+        self.interval = interval
+        self.jitter = jitter
+        self.bucket = TokenBucket(budget / 60, budget)
+        self.decay = decay
+        self.counts = {}
+        self.prefetched = set()
+        self.accesses = 0
+        self.warm_hits = 0
+        self.prefetch_hits = 0
+        self.refreshes = 0
+        self.budget_skips = 0
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def record(self, board_id):
+        '''
+        Count an access to `board_id`, before its snapshot is read.
+        '''
+        warm = self.expires_in(board_id) > 0
+        with self.lock:
+            self.counts[board_id] = self.counts.get(board_id, 0) + 1
+            self.accesses += 1
+            if warm:
+                self.warm_hits += 1
+                if board_id in self.prefetched:
+                    self.prefetch_hits += 1
+            else:
+                # The snapshot is about to be loaded by the caller.
+                self.prefetched.discard(board_id)
+
+    def hot_boards(self):
+        with self.lock:
+            hot = heapq.nlargest(
+                self.top,
+                self.counts,
+                key=self.counts.get,
+            )
+            self.counts = {
+                board_id: count * self.decay
+                for board_id, count in self.counts.items()
+                if count * self.decay >= 0.1
+            }
+        return hot
+
+    def next_delay(self):
+        return self.interval * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    def prefetch(self):
+        horizon = self.interval * (1 + self.jitter)
+        for board_id in self.hot_boards():
+            if self.expires_in(board_id) > horizon:
+                continue
+            now = time.monotonic()
+            if self.bucket.delay(now) > 0:
+                with self.lock:
+                    self.budget_skips += 1
+                continue
+            self.bucket.take(now)
+            try:
+                self.refresh(board_id)
+            except Exception:
+                logger.exception(f'Could not prefetch board {board_id}')
+                continue
+            with self.lock:
+                self.refreshes += 1
+                self.prefetched.add(board_id)
+
+    def run(self):
+        while not self.stopped.wait(self.next_delay()):
+            self.prefetch()
+
+    def start(self):
+        if self.thread is not None:
+            return
+        self.stopped.clear()
+        self.thread = threading.Thread(
+            target=self.run,
+            name='trello-prefetch',
+            daemon=True,
+        )
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    @property
+    def stats(self):
+        with self.lock:
+            return {
+                'accesses': self.accesses,
+                'warm_hits': self.warm_hits,
+                'hits': self.prefetch_hits,
+                'hit_ratio': round(
+                    self.prefetch_hits / max(1, self.accesses),
+                    3,
+                ),
+                'refreshes': self.refreshes,
+                'budget_skips': self.budget_skips,
+            }
@@ -0,0 +1,211 @@
+import heapq
+import re
+import threading
+from collections import namedtuple
+
+word = re.compile(r'\w+')
+
+Document = namedtuple('Document', ('kind', 'name', 'board', 'column'))
+
+name_weight = 3
+desc_weight = 1
+exact_score = 3
+prefix_score = 2
+fuzzy_score = 1
+
+
+def tokenize(text):
+    return [token.lower() for token in word.findall(text or '')]
+
+
+def deletes(token):
+    return {token[:index] + token[index + 1:] for index in range(len(token))}
+
+
+def discard(index, key, value):
+    values = index.get(key)
+    if values is None:
+        return
+    values.discard(value)
+    if len(values) == 0:
+        del index[key]
+
+
+def within_one_edit(first, second):
+    '''
+    Whether `second` is `first` with at most one character inserted,
+    deleted, replaced, or two adjacent ones swapped.
+    '''
+    if abs(len(first) - len(second)) > 1:
+        return False
+    if len(first) > len(second):
+        first, second = second, first
+    start = 0
+    while start < len(first) and first[start] == second[start]:
+        start += 1
+    if len(first) < len(second):
+        return first[start:] == second[start + 1:]
+    if first[start + 1:] == second[start + 1:]:
+        return True
+    return first[start:start + 2] == second[start + 1::-1][:2] and \
+        first[start + 2:] == second[start + 2:]
+
+
+class SearchIndex(object):
+    '''
+    Inverted index over the boards, lists and cards of board snapshots.
+
+    Query words match indexed words exactly, as prefixes, or within one
+    typo, scoring in that order. Names weigh more than card descriptions.
+    Documents are kept per board, so a board can be re-indexed, or a
+    single card or list of it updated, without touching the others.
+    '''
+    def __init__(self, min_prefix=2, min_fuzzy=4):
+        self.min_prefix = min_prefix
+        self.min_fuzzy = min_fuzzy
+        self.documents = {}
+        self.terms = {}
+        self.board_documents = {}
+        self.postings = {}
+        self.prefixes = {}
+        self.variants = {}
+        self.ready = False
+        self.lock = threading.RLock()
+
+    def add_token(self, token, doc_id, weight):
+        postings = self.postings.get(token)
+        if postings is None:
+            postings = self.postings[token] = {}
+            for length in range(self.min_prefix, len(token) + 1):
+                self.prefixes.setdefault(token[:length], set()).add(token)
+            if len(token) >= self.min_fuzzy:
+                for variant in deletes(token):
+                    self.variants.setdefault(variant, set()).add(token)
+        postings[doc_id] = max(postings.get(doc_id, 0), weight)
+
+    def remove_token(self, token, doc_id):
+        postings = self.postings.get(token, {})
+        postings.pop(doc_id, None)
+        if len(postings) > 0:
+            return
+        self.postings.pop(token, None)
+        for length in range(self.min_prefix, len(token) + 1):
+            discard(self.prefixes, token[:length], token)
+        if len(token) >= self.min_fuzzy:
+            for variant in deletes(token):
+                discard(self.variants, variant, token)
+
+    def put(self, doc_id, document, fields):
+        '''
+        Index `document` under `doc_id`, from `(text, weight)` fields.
+        '''
+        with self.lock:
+            self.remove(doc_id)
+            terms = {}
+            for text, weight in fields:
+                for token in tokenize(text):
+                    terms[token] = max(terms.get(token, 0), weight)
+            for token, weight in terms.items():
+                self.add_token(token, doc_id, weight)
+            self.documents[doc_id] = document
+            self.terms[doc_id] = terms
+            self.board_documents.setdefault(document.board[0], set()).add(
+                doc_id,
+            )
+
+    def remove(self, doc_id):
+        with self.lock:
+            document = self.documents.pop(doc_id, None)
+            if document is None:
+                return
+            for token in self.terms.pop(doc_id):
+                self.remove_token(token, doc_id)
+            discard(self.board_documents, document.board[0], doc_id)
+
+    def put_board(self, board_id, board_name):
+        self.put(
+            ('board', board_id),
+            Document('board', board_name, (board_id, board_name), None),
+            [(board_name, name_weight)],
+        )
+
+    def put_column(self, board, column):
+        self.put(
+            ('list', column['id']),
+            Document('list', column['name'], board, None),
+            [(column['name'], name_weight)],
+        )
+
+    def put_card(self, board, column_name, card):
+        self.put(
+            ('card', card['id']),
+            Document('card', card['name'], board, column_name),
+            [(card['name'], name_weight), (card.get('desc'), desc_weight)],
+        )
+
+    def put_snapshot(self, snapshot):
+        '''
+        Replace everything indexed for the board of `snapshot`.
+        '''
+        board = (snapshot.id, snapshot.name)
+        columns = list(snapshot.iter_columns())
+        with self.lock:
+            self.remove_board(snapshot.id)
+            self.put_board(*board)
+            for column, cards in columns:
+                self.put_column(board, column)
+                for card in cards:
+                    self.put_card(board, column['name'], card)
+
+    def remove_board(self, board_id):
+        with self.lock:
+            for doc_id in list(self.board_documents.get(board_id, ())):
+                self.remove(doc_id)
+
+    def matches(self, token):
+        '''
+        Indexed words matching `token`, with the score of the match.
+        '''
+        found = {}
+        if len(token) >= self.min_fuzzy:
+            candidates = set(self.variants.get(token, ()))
+            for variant in deletes(token):
+                candidates.update(self.variants.get(variant, ()))
+                if variant in self.postings:
+                    candidates.add(variant)
+            for candidate in candidates:
+                if within_one_edit(token, candidate):
+                    found[candidate] = fuzzy_score
+        if len(token) >= self.min_prefix:
+            for candidate in self.prefixes.get(token, ()):
+                found[candidate] = prefix_score
+        if token in self.postings:
+            found[token] = exact_score
+        return found
+
+    def search(self, query, limit=10):
+        '''
+        Documents matching `query`, best first.
+
+        Documents matching more query words rank first, then by score.
+        '''
+        tokens = set(tokenize(query))
+        scores = {}
+        with self.lock:
+            for token in tokens:
+                best = {}
+                for candidate, score in self.matches(token).items():
+                    for doc_id, weight in self.postings[candidate].items():
+                        best[doc_id] = max(best.get(doc_id, 0), score * weight)
+                for doc_id, score in best.items():
+                    matched, total = scores.get(doc_id, (0, 0))
+                    scores[doc_id] = (matched + 1, total + score)
+            ranked = heapq.nsmallest(
+                limit,
+                scores.items(),
+                key=lambda item: (-item[1][0], -item[1][1], item[0]),
+            )
+            return [self.documents[doc_id] for doc_id, _ in ranked]
+
+    def __len__(self):
+        return len(self.documents)
@@ -0,0 +1,117 @@
+import logging
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from reventlov.bot_metrics import registry
+
+logger = logging.getLogger(__name__)
+
+
+class Flight(object):
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight(object):
+    '''
+    Concurrent calls with the same key share the first call's result.
+
+    Returns the result, and whether it was shared from another call.
+    '''
+    def __init__(self):
+        self.flights = {}
+        self.lock = threading.Lock()
+
+    def do(self, key, call):
+        with self.lock:
+            flight = self.flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self.flights[key] = Flight()
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result, True
+        try:
+            flight.result = call()
+        except Exception as error:
+            flight.error = error
+            raise
+        finally:
+            with self.lock:
+                del self.flights[key]
+            flight.done.set()
+        return flight.result, False
+
+
+class TrelloTransport(object):
+    '''
+    HTTP transport of the Trello client.
+
+    Requests go through one keep-alive session holding up to `pool_size`
+    connections, with explicit connect and read timeouts. Identical GETs
+    in flight at the same time are sent once.
+    '''
+    def __init__(self, pool_size=10, connect_timeout=5, read_timeout=30):
+        self.session = requests.Session()
+        self.adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=pool_size,
+            max_retries=0,
+        )
+        self.session.mount('https://', self.adapter)
+        self.session.mount('http://', self.adapter)
+        self.timeout = (connect_timeout, read_timeout)
+        self.flights = SingleFlight()
+
+    def send(self, method, url, operation, **kwargs):
+        with registry.timed('trello', operation):
+            return self.session.request(
+                method,
+                url,
+                timeout=self.timeout,
+                **kwargs
+            )
+
+    def request(self, method, url, operation, params=None, **kwargs):
+        '''
+        Send a request, timed as `operation` in the metrics registry.
+
+        Responses may be shared between callers, which must not change
+        them.
+        '''
+        if method != 'GET' or kwargs.get('files'):
+            return self.send(method, url, operation, params=params, **kwargs)
+        key = (url, tuple(sorted((params or {}).items())))
+        response, shared = self.flights.do(
+            key,
+            lambda: self.send(method, url, operation, params=params, **kwargs),
+        )
+        if shared:
+            registry.count('trello', operation, 'coalesced')
+        return response
+
+    @property
+    def stats(self):
+        pools = self.adapter.poolmanager.pools
+        pools = [
+            pool
+            for pool in [pools.get(key) for key in pools.keys()]
+            if pool is not None
+        ]
+        return {
+            'connections_opened': sum(
+                [pool.num_connections for pool in pools],
+            ),
+            'requests_sent': sum([pool.num_requests for pool in pools]),
+        }
+
+    def close(self):
+        self.session.close()
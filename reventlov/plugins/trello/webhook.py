@@ -0,0 +1,143 @@
+import base64
+import hashlib
+import hmac
+import json
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+from reventlov.bot_webhook import route_path
+
+logger = logging.getLogger(__name__)
+
+
+def webhook_signature(secret, body, callback_url):
+    digest = hmac.new(
+        secret.encode(),
+        body + callback_url.encode(),
+        hashlib.sha1,
+    ).digest()
+    return base64.b64encode(digest).decode()
+
+
+class WebhookRequestHandler(BaseHTTPRequestHandler):
+    def reply(self, status):
+        self.send_response(status)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def do_HEAD(self):
+        # Trello checks the callback URL answers before creating a webhook.
+        self.reply(200)
+
+    def read_body(self):
+        '''
+        The request body, or None after refusing a bad Content-Length.
+        '''
+        length = self.headers.get('Content-Length')
+        if length is None:
+            self.reply(411)
+            return None
+        try:
+            length = int(length)
+        except ValueError:
+            self.reply(400)
+            return None
+        if length < 0:
+            self.reply(400)
+            return None
+        if length > self.server.max_body_size:
+            self.reply(413)
+            return None
+        return self.rfile.read(length)
+
+    def do_POST(self):
+        route = self.server.routes.get(route_path(self.path))
+        if route is None:
+            self.reply(404)
+            return
+        body = self.read_body()
+        if body is None:
+            return
+        if not route.verify(body, self.headers.get('X-Trello-Webhook')):
+            self.reply(401)
+            return
+        try:
+            action = json.loads(body.decode())['action']
+        except (ValueError, KeyError, TypeError):
+            self.reply(400)
+            return
+        try:
+            route.on_action(action)
+        except Exception:
+            logger.exception(f'Could not apply {action.get("type")} action')
+            self.reply(500)
+            return
+        self.reply(200)
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+
+class WebhookRoute(object):
+    '''
+    Receiver of the webhooks of one Trello account.
+
+    Every payload's action is handed to `on_action`. When both `secret`
+    and `callback_url` are set, payloads are checked against Trello's
+    `X-Trello-Webhook` signature.
+    '''
+    def __init__(self, on_action, secret=None, callback_url=None):
+        self.on_action = on_action
+        self.secret = secret
+        self.callback_url = callback_url
+
+    def verify(self, body, signature):
+        if not self.secret or not self.callback_url:
+            return True
+        expected = webhook_signature(self.secret, body, self.callback_url)
+        return hmac.compare_digest(expected, signature or '')
+
+
+class TrelloWebhookServer(ThreadingMixIn, HTTPServer):
+    '''
+    Local HTTP endpoint receiving Trello webhook payloads.
+
+    Payloads are handed to the route of their path, added with
+    `add_route`, so accounts with their own callback URL can share it.
+    '''
+    daemon_threads = True
+
+    def __init__(self, address, max_body_size=1 << 20):
+        super().__init__(address, WebhookRequestHandler)
+        self.routes = {}
+        self.max_body_size = max_body_size
+        self.thread = None
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def add_route(self, path, on_action, secret=None, callback_url=None):
+        path = route_path(path)
+        if path in self.routes:
+            logger.warning(f'Replacing the Trello webhook route of {path}')
+        self.routes[path] = WebhookRoute(on_action, secret, callback_url)
+        return path
+
+    def remove_route(self, path):
+        self.routes.pop(route_path(path), None)
+
+    def start(self):
+        self.thread = threading.Thread(
+            target=self.serve_forever,
+            name='trello-webhook',
+            daemon=True,
+        )
+        self.thread.start()
+        logger.info(f'Listening to Trello webhooks on port {self.port}')
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
@@ -2,6 +2,7 @@ import os
 
 import pytest
 from reventlov.bot import Bot
+from reventlov.bot_messages import iter_chunks
 
 example_bot_token = '343445268:31f983_134f98has_asdf9_q9dpheq09uro'
 empty_bot_admins_env_value = ''
@@ -18,6 +19,7 @@ basic_commands = [
     'settings',
     'disable_plugin',
     'enable_plugin',
+    'stats',
 ]
 pomodoro_plugin = 'pomodoro'
 pomodoro_feature_desc = 'I can handle alarms'
@@ -108,6 +110,7 @@ class Updater(object):
     def __init__(self, *args, **kwargs):
         self.dispatcher = Dispatcher()
         self.bot = BotInterface()
+        self.job_queue = JobQueue()
         self.polling = False
 
     def start_polling(self):
@@ -118,12 +121,25 @@ class Dispatcher(object):
     def __init__(self):
         self.registered_handlers = []
 
-    def add_handler(self, handler):
-        self.registered_handlers.append(handler.command[0])
+    def add_handler(self, handler, group=0):
+        if group == 0:
+            self.registered_handlers.append(handler)
+
+
+class JobQueue(object):
+    def __init__(self):
+        self.jobs = []
+
+    def run_repeating(self, callback, interval, first=None):
+        self.jobs.append((callback, interval, first))
 
 
 class BotInterface(object):
+    def __init__(self):
+        self.get_me_calls = 0
+
     def get_me(self):
+        self.get_me_calls += 1
         return {
             'first_name': 'R. Giskard Reventlov',
             'username': 'reventlovbot',
@@ -158,6 +174,10 @@ def test_bot(
         expected,
 ):
     mocker.patch.dict(os.environ, environ)
+    mocker.patch.dict(os.environ, {
+        'TELEGRAM_UPDATES_DB': ':memory:',
+        'REVENTLOV_STATE_DB': ':memory:',
+    })
     mocker.patch(
         'reventlov.bot.Updater',
         new=lambda *a, **kw: Updater(a, kw),
@@ -184,11 +204,12 @@ def test_bot(
     bot.run()
 
     assert bot.admins == expected['admins']
-    commands = [handler for handler in bot.dispatcher.registered_handlers]
+    assert bot.dispatcher.registered_handlers == [bot.router]
+    commands = bot.router.commands
     assert len(commands) == len(expected['commands'])
     for command in commands:
         assert command in expected['commands']
-    bot_plugins.assert_called_once_with(bot.dispatcher)
+    bot_plugins.assert_called_once_with(bot.router, None)
     assert bot.enabled_plugins == expected['enabled_plugins']
     assert bot.updater.polling
     greeting = 'I am R. Giskard Reventlov (@reventlovbot)'
@@ -203,7 +224,90 @@ def test_bot(
     assert '-/help' in help_msg
     assert '-/settings' in help_msg
     admin_help_msg = bot.admin_help_message
-    assert len(admin_help_msg.splitlines()) == 3
+    assert len(admin_help_msg.splitlines()) == 4
     assert '-/enable\_plugin' in admin_help_msg
     assert '-/disable\_plugin' in admin_help_msg
+    assert '-/stats' in admin_help_msg
     assert bot.plugin_help_messages == expected['plugin_help_messages']
+
+
+def test_bot_identity_cache(mocker):
+    mocker.patch.dict(os.environ, {
+        'TELEGRAM_BOT_TOKEN': example_bot_token,
+        'TELEGRAM_BOT_IDENTITY_REFRESH': '60',
+        'TELEGRAM_UPDATES_DB': ':memory:',
+        'REVENTLOV_STATE_DB': ':memory:',
+    })
+    mocker.patch(
+        'reventlov.bot.Updater',
+        new=lambda *a, **kw: Updater(a, kw),
+    )
+    mocker.patch('reventlov.bot.BotPlugins', spec=True, feature_descs=[])
+
+    bot = Bot()
+    bot.run()
+    bot.start_message
+    bot.start_message
+
+    assert bot.bot.get_me_calls == 1
+    assert bot.identity.avoided_calls == 4
+    assert len(bot.updater.job_queue.jobs) == 1
+    _, interval, first = bot.updater.job_queue.jobs[0]
+    assert interval == 60
+    assert first == 60
+
+    bot.identity.invalidate()
+    assert bot.username == 'reventlovbot'
+    assert bot.bot.get_me_calls == 2
+
+
+def test_bot_messages_cache(mocker):
+    mocker.patch.dict(os.environ, {
+        'TELEGRAM_BOT_TOKEN': example_bot_token,
+        'TELEGRAM_BOT_ADMINS': single_bot_admin_env_value,
+        'TELEGRAM_UPDATES_DB': ':memory:',
+        'REVENTLOV_STATE_DB': ':memory:',
+    })
+    mocker.patch(
+        'reventlov.bot.Updater',
+        new=lambda *a, **kw: Updater(a, kw),
+    )
+    plugins = mocker.patch(
+        'reventlov.bot.BotPlugins',
+        spec=True,
+        generation=0,
+        enabled_plugins=[pomodoro_plugin],
+        disabled_plugins=[trello_plugin],
+        feature_descs=[pomodoro_feature_desc],
+        command_descs={'/set': 'Set alarms'},
+    ).return_value
+
+    bot = Bot()
+    help_msg = bot.messages['help']
+    admin_help_msg = bot.messages['admin_help']
+    assert help_msg == bot.help_message + '\n-/set: Set alarms'
+    assert admin_help_msg == bot.help_message + bot.admin_help_message + \
+        '\n-/set: Set alarms'
+    assert bot.messages['help'] is help_msg
+    assert 'pomodoro' in bot.messages['settings']
+    assert bot.messages.builds == 3
+
+    plugins.generation = 1
+    plugins.enabled_plugins = []
+    plugins.disabled_plugins = [pomodoro_plugin, trello_plugin]
+    assert '`enabled_plugins`: \n' in bot.messages['settings']
+    assert bot.messages.builds == 4
+
+
+def test_iter_chunks():
+    lines = ['- To Do', '    + Fix bug', '    + Write docs', '', 'x' * 25]
+    chunks = list(iter_chunks(iter(lines), limit=20))
+    assert chunks == [
+        '- To Do',
+        '    + Fix bug',
+        '    + Write docs\n',
+        'x' * 20,
+        'x' * 5,
+    ]
+    assert all([len(chunk) <= 20 for chunk in chunks])
+    assert list(iter_chunks(lines[:2], limit=40)) == ['\n'.join(lines[:2])]
@@ -0,0 +1,56 @@
+import time
+
+from reventlov.bot_admission import AdmissionControl
+from reventlov.bot_admission import get_costs_from_environment
+
+
+def test_admission_buckets():
+    admission = AdmissionControl(
+        cost={'list': 3}.get,
+        core=['start'],
+        admins=['daneel'],
+        user_burst=5,
+        chat_burst=6,
+    )
+    start = time.monotonic()
+
+    def admit(user_id, chat_id, username, command, now=0):
+        return admission.admit(
+            user_id, chat_id, username, command, start + now,
+        )
+
+    assert [admit(1, 1, 'elijah', 'list', now=0) for _ in range(3)] == [
+        None, 'user', 'user',
+    ]
+    assert admit(1, 1, 'elijah', 'start', now=0) is None
+    assert admit(1, 1, 'daneel', 'list', now=0) is None
+    assert admit(1, 1, 'elijah', 'list', now=2) is None
+    assert admit(2, -1, 'gladia', 'list', now=0) is None
+    assert admit(3, -1, 'giskard', 'list', now=0) is None
+    assert admit(4, -1, 'vasilia', 'list', now=0) == 'chat'
+    assert admit(4, -1, 'vasilia', None, now=0) is None
+
+
+def test_admission_keeps_recent_buckets():
+    admission = AdmissionControl(max_buckets=3)
+    now = time.monotonic()
+    for user_id in range(10):
+        admission.admit(user_id, user_id, None, 'timers', now)
+    assert list(admission.user_buckets) == [7, 8, 9]
+    admission.admit(7, 7, None, 'timers', now)
+    admission.admit(10, 10, None, 'timers', now)
+    assert list(admission.user_buckets) == [9, 7, 10]
+
+
+def test_admission_sheds_expensive_commands_on_overload():
+    overloaded = []
+    admission = AdmissionControl(
+        cost=get_costs_from_environment('list=3, /find=2,bad').get,
+        overloaded=lambda: len(overloaded) > 0,
+    )
+    now = time.monotonic()
+    assert admission.admit(1, 1, 'elijah', 'find', now=now) is None
+    overloaded.append(True)
+    assert admission.admit(1, 1, 'elijah', 'find', now=now + 10) == 'overload'
+    assert admission.admit(1, 1, 'elijah', 'list', now=now + 10) == 'overload'
+    assert admission.admit(1, 1, 'elijah', None, now=now + 10) is None
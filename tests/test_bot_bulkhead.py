@@ -0,0 +1,152 @@
+import os
+import threading
+import time
+
+from telegram.ext import CommandHandler
+from reventlov.bot_bulkhead import Bulkhead
+from reventlov.bot_metrics import Metrics
+from reventlov.bot_plugin import BotPlugin
+
+
+class Message(object):
+    def __init__(self):
+        self.replies = []
+
+    def reply_text(self, text):
+        self.replies.append(text)
+
+
+class Update(object):
+    def __init__(self):
+        self.message = Message()
+
+
+class Dispatcher(object):
+    def __init__(self):
+        self.handlers = []
+
+    def add_handler(self, handler):
+        self.handlers.append(handler)
+
+
+class SlowPlugin(BotPlugin):
+    '''
+    I answer slowly
+    '''
+    blocking_commands = ('slow',)
+    bulkhead_workers = 1
+    bulkhead_queue = 1
+
+    def __init__(self, dispatcher):
+        self.released = threading.Event()
+        self.answered = []
+        self.handlers = [
+            CommandHandler('slow', self.slow),
+            CommandHandler('fast', self.fast),
+        ]
+        self.add_handlers(dispatcher)
+
+    def slow(self, bot, update):
+        '''
+        Answer once released.
+        '''
+        self.released.wait(5)
+        self.answered.append('slow')
+
+    def fast(self, bot, update):
+        '''
+        Answer right away.
+        '''
+        self.answered.append('fast')
+
+
+class AsyncPlugin(BotPlugin):
+    '''
+    I wait without holding the dispatcher
+    '''
+    bulkhead_workers = 1
+    bulkhead_queue = 0
+
+    def __init__(self, dispatcher):
+        self.released = threading.Event()
+        self.handlers = [CommandHandler('wait', self.wait)]
+        self.add_handlers(dispatcher)
+
+    async def wait(self, bot, update):
+        '''
+        Answer once released.
+        '''
+        await self.run_blocking(self.released.wait, 5)
+        update.message.reply_text('done')
+
+
+def test_bulkhead_rejects_when_full():
+    bulkhead = Bulkhead('test', workers=1, queue_size=1)
+    released = threading.Event()
+    running = bulkhead.submit(released.wait, 5)
+    waiting = bulkhead.submit(lambda: 'done')
+    assert bulkhead.submit(lambda: 'rejected') is None
+    stats = bulkhead.stats
+    assert stats['active'] + stats['queued'] == 2
+    assert stats['rejected'] == 1
+    released.set()
+    assert running.result(5) is True
+    assert waiting.result(5) == 'done'
+    bulkhead.shutdown()
+    assert bulkhead.stats['completed'] == 2
+    assert bulkhead.stats['queued'] == 0
+
+
+def test_blocking_commands_are_offloaded():
+    dispatcher = Dispatcher()
+    plugin = SlowPlugin(dispatcher)
+    slow, fast = dispatcher.handlers
+    updates = [Update() for _ in range(3)]
+    for update in updates:
+        slow.callback(None, update)
+    fast.callback(None, Update())
+    assert plugin.answered == ['fast']
+    assert updates[2].message.replies == [plugin.busy_message]
+    plugin.released.set()
+    plugin.stop_bulkhead()
+    assert plugin.answered == ['fast', 'slow', 'slow']
+    assert plugin.bulkhead.stats['rejected'] == 1
+    assert slow.callback.__doc__.strip().startswith('Answer once released.')
+
+
+def test_bulkhead_size_per_tenant(mocker):
+    mocker.patch.dict(os.environ, {
+        'TEST_BOT_BULKHEAD_BULKHEAD_WORKERS': '2',
+        'ALPHA_TEST_BOT_BULKHEAD_BULKHEAD_WORKERS': '3',
+    })
+    plugin = SlowPlugin(Dispatcher())
+    assert plugin.bulkhead.workers == 2
+    plugin.stop_bulkhead()
+    plugin.tenant = 'alpha'
+    plugin.start_bulkhead()
+    assert (plugin.bulkhead.workers, plugin.bulkhead.queue_size) == (3, 1)
+    plugin.stop_bulkhead()
+
+
+def test_labelled_gauges_are_typed_once():
+    output = Metrics().render_prometheus({
+        'bulkhead_queued{plugin="a"}': 1,
+        'bulkhead_queued{plugin="b"}': 2,
+    })
+    assert output.count('# TYPE reventlov_bulkhead_queued gauge') == 1
+    assert 'reventlov_bulkhead_queued{plugin="b"} 2' in output
+
+
+def test_async_handlers_run_on_event_loop():
+    plugin = AsyncPlugin(Dispatcher())
+    wait = plugin.handlers[0].callback
+    first_update, second_update = Update(), Update()
+    first = wait(None, first_update)
+    while plugin.bulkhead.stats['active'] == 0:
+        time.sleep(0.01)
+    wait(None, second_update).result(5)
+    assert second_update.message.replies == [plugin.busy_message]
+    plugin.released.set()
+    first.result(5)
+    assert first_update.message.replies == ['done']
+    plugin.stop_bulkhead()
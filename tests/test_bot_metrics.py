@@ -0,0 +1,97 @@
+import urllib.request
+
+import pytest
+from reventlov.bot_metrics import Histogram, Metrics, MetricsServer
+from reventlov.plugins.trello.client import endpoint
+
+
+def test_histogram_percentiles():
+    histogram = Histogram(buckets=(0.1, 1.0, float('inf')))
+    for value in [0.05] * 90 + [0.5] * 9 + [5.0]:
+        histogram.observe(value)
+    assert histogram.count == 100
+    assert histogram.percentile(0.5) == pytest.approx(0.1 * 50 / 90)
+    assert 0.1 < histogram.percentile(0.95) < 1.0
+    assert histogram.percentile(0.999) == 1.0
+
+
+def test_instrument_records_calls_and_errors():
+    metrics = Metrics()
+
+    def handler(bot, update):
+        '''
+        Handle things.
+        '''
+        if update == 'boom':
+            raise ValueError(update)
+
+    instrumented = metrics.instrument('trello', 'list', handler)
+    assert instrumented.__doc__ == handler.__doc__
+    instrumented(None, 'ok')
+    with pytest.raises(ValueError):
+        instrumented(None, 'boom')
+    with metrics.timed('trello', 'GET /boards/{id}'):
+        pass
+
+    stats = metrics.handlers[('trello', 'list')]
+    assert (stats.calls, stats.errors) == (2, 1)
+    assert metrics.plugin_totals() == {'trello': (2, 1)}
+    summary = metrics.summary()
+    assert '- trello/list: 2 calls, 1 errors' in summary
+    assert '- trello/GET /boards/{id}: 1 calls, 0 errors' in summary
+
+
+def test_tenant_handlers_are_summarised_apart():
+    metrics = Metrics()
+    metrics.instrument('core', 'start', lambda: None)()
+    metrics.instrument('core', 'start', lambda: None, 'acme')()
+    metrics.instrument('trello', 'list', lambda: None, 'acme')()
+    metrics.instrument('trello', 'list', lambda: None, 'globex')()
+    with metrics.timed('trello', 'GET /boards/{id}'):
+        pass
+
+    assert metrics.plugin_totals('acme') == {'core': (1, 0), 'trello': (1, 0)}
+    summary = metrics.summary('globex')
+    assert '- trello/list: 1 calls' in summary
+    assert 'core' not in summary
+    assert 'Upstream' not in summary
+    assert metrics.plugin_totals() == {'core': (1, 0)}
+    assert 'reventlov_handler_calls_total{plugin="trello",command="list",' \
+        'tenant="acme"} 1' in metrics.render_prometheus()
+
+
+def test_metrics_server():
+    metrics = Metrics()
+    metrics.instrument('core', 'start', lambda: None)()
+    server = MetricsServer(
+        ('127.0.0.1', 0),
+        registry=metrics,
+        gauges=lambda: {'outbox_depth': 3},
+    )
+    server.start()
+    try:
+        body = urllib.request.urlopen(
+            f'http://127.0.0.1:{server.port}/metrics',
+        ).read().decode()
+    finally:
+        server.stop()
+    assert 'reventlov_handler_calls_total{plugin="core",command="start"} 1' \
+        in body
+    assert 'reventlov_handler_seconds_bucket{plugin="core",command="start",' \
+        'le="+Inf"} 1' in body
+    assert 'reventlov_outbox_depth 3' in body
+
+
+def test_trello_endpoint():
+    assert endpoint('/boards/5b0d7b0b0b0b0b0b0b0b0b0b/lists') == \
+        '/boards/{id}/lists'
+    assert endpoint('members/me/organizations') == '/members/me/organizations'
+
+
+def test_upstream_counters():
+    metrics = Metrics()
+    metrics.count('trello', 'GET /boards/{id}', 'coalesced')
+    metrics.count('trello', 'GET /boards/{id}', 'coalesced')
+    assert '- trello/GET /boards/{id}: 2 coalesced' in metrics.summary()
+    assert 'reventlov_upstream_coalesced_total{service="trello",' \
+        'operation="GET /boards/{id}"} 2' in metrics.render_prometheus()
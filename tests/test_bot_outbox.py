@@ -0,0 +1,76 @@
+from telegram.error import RetryAfter
+from reventlov.bot_outbox import Outbox
+from reventlov.bot_outbox import PRIORITY_BACKGROUND, PRIORITY_INTERACTIVE
+
+
+class Sender(object):
+    def __init__(self, failures=None):
+        self.sent = []
+        self.failures = failures or []
+
+    def send(self, chat_id, text):
+        if len(self.failures) > 0:
+            raise self.failures.pop(0)
+        self.sent.append((chat_id, text))
+        return text
+
+
+def drain(outbox):
+    while True:
+        message, _ = outbox.next_message()
+        if message is None:
+            return
+        outbox.deliver(message)
+
+
+def test_interactive_replies_go_first():
+    outbox = Outbox()
+    sender = Sender()
+    outbox.put(sender.send, 1, PRIORITY_BACKGROUND, 1, 'alarm')
+    outbox.put(sender.send, 2, PRIORITY_BACKGROUND, 2, 'alarm')
+    future = outbox.put(sender.send, 3, PRIORITY_INTERACTIVE, 3, 'reply')
+    assert outbox.depth == 3
+    drain(outbox)
+    assert sender.sent == [(3, 'reply'), (1, 'alarm'), (2, 'alarm')]
+    assert future.result() == 'reply'
+    assert outbox.stats['sent'] == 3
+    assert outbox.stats['depth'] == 0
+
+
+def test_chat_bucket_limits_bursts():
+    outbox = Outbox(chat_rate=1, burst=2)
+    sender = Sender()
+    for number in range(3):
+        outbox.put(sender.send, 1, PRIORITY_INTERACTIVE, 1, str(number))
+    outbox.put(sender.send, 2, PRIORITY_INTERACTIVE, 2, 'other')
+    drain(outbox)
+    assert sender.sent == [(1, '0'), (1, '1'), (2, 'other')]
+    message, delay = outbox.next_message()
+    assert message is None
+    assert 0 < delay <= 1
+    assert outbox.depth == 1
+
+
+def test_retry_after_pauses_chat():
+    outbox = Outbox()
+    sender = Sender(failures=[RetryAfter(5)])
+    future = outbox.put(sender.send, 1, PRIORITY_INTERACTIVE, 1, 'hello')
+    drain(outbox)
+    assert sender.sent == []
+    assert outbox.stats['retried'] == 1
+    assert not future.done()
+    assert outbox.chat_bucket(1).delay(outbox.chat_bucket(1).updated) > 4
+
+
+def test_long_chat_queue_does_not_hold_back_others():
+    outbox = Outbox(chat_rate=1, burst=1)
+    sender = Sender(failures=[RetryAfter(0)])
+    for number in range(1000):
+        outbox.put(sender.send, 1, PRIORITY_BACKGROUND, 1, str(number))
+    outbox.put(sender.send, 2, PRIORITY_BACKGROUND, 2, 'other')
+    drain(outbox)
+    assert sender.sent == [(2, 'other')]
+    assert outbox.depth == 1000
+    assert len(outbox.ready) == 0
+    assert outbox.waiting_chats == {1}
+    assert outbox.queues[1][0][2].args == (1, '0')
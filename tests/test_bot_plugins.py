@@ -0,0 +1,147 @@
+import importlib
+import os
+import threading
+import time
+
+from telegram.ext import CommandHandler
+from reventlov.bot_plugin import BotPlugin
+from reventlov.bot_plugins import BotPlugins, discover_plugins
+
+
+class Dispatcher(object):
+    def __init__(self):
+        self.bot = None
+        self.handlers = []
+
+    def add_handler(self, handler):
+        self.handlers.append(handler)
+
+
+def test_discover_plugins():
+    infos = discover_plugins()
+    pomodoro = infos['reventlov.plugins.pomodoro']
+    assert pomodoro.name == 'pomodoro'
+    assert pomodoro.entry_class == 'PomodoroPlugin'
+    assert pomodoro.description == 'I can manage pomodoro alarms for you'
+    assert pomodoro.commands == {
+        'set': '`[name] seconds [message...]` Set alarm to fire in `seconds`.',
+        'unset': '`[name]` Unset alarm `name`, or last alarm set.',
+        'timers': 'List your active alarms.',
+        'cycle': '`[work short_break long_break]` Start a pomodoro cycle '
+                 '(minutes).',
+        'pause': 'Pause your pomodoro cycle.',
+        'resume': 'Resume your paused pomodoro cycle.',
+        'stop_cycle': 'Stop your pomodoro cycle.',
+    }
+    trello = infos['reventlov.plugins.trello']
+    assert trello.entry_class == 'TrelloPlugin'
+    assert trello.commands['list'] == 'List Trello objects visible to me.'
+
+
+def test_disabled_plugins_are_not_imported(mocker):
+    mocker.patch.dict(os.environ, {
+        'REVENTLOV_DISABLED_PLUGINS': 'trello',
+        'POMODORO_DB': ':memory:',
+    })
+    import_module = mocker.patch(
+        'reventlov.bot_plugins.importlib.import_module',
+        side_effect=importlib.import_module,
+    )
+
+    plugins = BotPlugins(Dispatcher())
+
+    import_module.assert_called_once_with('reventlov.plugins.pomodoro')
+    assert list(plugins.enabled_plugins) == ['pomodoro']
+    assert list(plugins.timings) == ['reventlov.plugins.pomodoro']
+    assert 'reventlov.plugins.pomodoro: import' in plugins.timing_report
+
+
+class Message(object):
+    def __init__(self):
+        self.replies = []
+
+    def reply_text(self, text):
+        self.replies.append(text)
+
+
+class Update(object):
+    def __init__(self):
+        self.message = Message()
+
+
+class SlowPlugin(BotPlugin):
+    '''
+    I need some time to start
+    '''
+    def __init__(self, dispatcher, fail=False):
+        self.fail = fail
+        self.released = threading.Event()
+        self.answered = []
+        self.handlers = [CommandHandler('slow', self.slow)]
+        self.add_handlers(dispatcher)
+
+    def bootstrap(self):
+        self.released.wait(5)
+        if self.fail:
+            raise RuntimeError('Trello is down')
+
+    def slow(self, bot, update):
+        '''
+        Answer slowly.
+        '''
+        if update is None:
+            raise ValueError(update)
+        self.answered.append(update)
+
+
+def wait_bootstrap(plugin):
+    for _ in range(100):
+        if plugin.state != 'warming':
+            break
+        time.sleep(0.01)
+
+
+def test_plugin_bootstrap_queues_commands():
+    plugin = SlowPlugin(Dispatcher())
+    plugin.max_pending_calls = 3
+    callback = plugin.handlers[0].callback
+    assert callback.__doc__.splitlines()[1].strip() == 'Answer slowly.'
+    plugin.start_bootstrap()
+    assert plugin.state == 'warming'
+    update = Update()
+    callback(None, update)
+    assert update.message.replies == [BotPlugin.warming_message]
+    assert plugin.answered == []
+    plugin._pending_calls.insert(0, (plugin.slow, (None, None), {}))
+    callback(None, update)
+    busy = Update()
+    callback(None, busy)
+    assert busy.message.replies == [BotPlugin.busy_message]
+
+    plugin.released.set()
+    wait_bootstrap(plugin)
+    assert plugin.ready
+    assert plugin.answered == [update, update]
+    callback(None, update)
+    assert plugin.answered == [update, update, update]
+
+
+def test_plugin_bootstrap_failure():
+    plugin = SlowPlugin(Dispatcher(), fail=True)
+    plugin.bootstrap_backoff = 0.05
+    plugin.released.set()
+    plugin.start_bootstrap()
+    wait_bootstrap(plugin)
+    assert plugin.state == 'failed'
+    update = Update()
+    plugin.handlers[0].callback(None, update)
+    assert update.message.replies == [BotPlugin.failed_message]
+    assert plugin.answered == []
+
+    plugin.fail = False
+    for _ in range(100):
+        if plugin.ready:
+            break
+        time.sleep(0.01)
+    assert plugin.ready
+    plugin.stop()
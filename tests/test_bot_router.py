@@ -0,0 +1,59 @@
+from telegram import Update
+from telegram.ext import CommandHandler, MessageHandler, Filters
+from reventlov.bot_router import CommandRouter
+
+
+class BotInterface(object):
+    username = 'reventlovbot'
+
+
+class Dispatcher(object):
+    def __init__(self):
+        self.bot = BotInterface()
+        self.handlers = []
+
+    def add_handler(self, handler, group=0):
+        self.handlers.append(handler)
+
+    def remove_handler(self, handler, group=0):
+        self.handlers.remove(handler)
+
+
+def update(text, edited=False):
+    return Update.de_json({
+        'update_id': 1,
+        'edited_message' if edited else 'message': {
+            'message_id': 1,
+            'date': 0,
+            'text': text,
+            'chat': {'id': 1, 'type': 'private'},
+        },
+    }, BotInterface())
+
+
+def test_command_router():
+    dispatcher = Dispatcher()
+    router = CommandRouter(dispatcher)
+    start = CommandHandler('start', None)
+    edited_start = CommandHandler('start', None, allow_edited=True)
+    timers = CommandHandler(['timers', 'Alarms'], None)
+    echo = MessageHandler(Filters.text, None)
+    for handler in (start, edited_start, timers, echo):
+        router.add_handler(handler)
+
+    assert router.bot is dispatcher.bot
+    assert dispatcher.handlers == [echo]
+    assert router.commands == ['start', 'timers', 'alarms']
+    assert router.find(update('/start now')) is start
+    assert router.find(update('/START@reventlovbot')) is start
+    assert router.find(update('/start', edited=True)) is edited_start
+    assert router.find(update('/alarms')) is timers
+    assert router.find(update('/start@otherbot')) is None
+    assert router.find(update('/stop')) is None
+    assert not router.check_update(update('start'))
+
+    router.remove_handler(timers)
+    router.remove_handler(echo)
+    assert router.commands == ['start']
+    assert dispatcher.handlers == []
+    assert router.find(update('/timers')) is None
@@ -0,0 +1,82 @@
+import os
+import queue
+
+from telegram import Update
+from reventlov.bot_sharding import owns_chat
+from reventlov.bot_shards import ShardedBot, worker_environment
+
+example_bot_token = '343445268:31f983_134f98has_asdf9_q9dpheq09uro'
+
+
+def update(update_id, chat_id):
+    return Update.de_json({
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': 0,
+            'text': '/start',
+            'chat': {'id': chat_id, 'type': 'private'},
+        },
+    }, None)
+
+
+def drain(inbox):
+    messages = []
+    while True:
+        try:
+            messages.append(inbox.get(timeout=0.2))
+        except queue.Empty:
+            return messages
+
+
+def test_sharded_bot_routes_by_chat(mocker):
+    mocker.patch.dict(os.environ, {
+        'TELEGRAM_BOT_TOKEN': example_bot_token,
+        'TELEGRAM_UPDATES_DB': ':memory:',
+    })
+    bot = ShardedBot(3)
+    for update_id, chat_id in enumerate([4, 7, 5, 4, -3], 1):
+        bot.router.put(update(update_id, chat_id))
+    bot.router.put(update(2, 7))
+
+    assert bot.router.routed == [1, 3, 1]
+    routed = [
+        [payload['message']['chat']['id'] for _, payload in drain(inbox)]
+        for inbox in bot.inboxes
+    ]
+    assert routed == [[-3], [4, 7, 4], [5]]
+    assert bot.gauges['duplicate_updates'] == 1
+
+
+def test_sharded_bot_broadcasts_plugin_changes(mocker):
+    mocker.patch.dict(os.environ, {
+        'TELEGRAM_BOT_TOKEN': example_bot_token,
+        'TELEGRAM_UPDATES_DB': ':memory:',
+    })
+    bot = ShardedBot(3)
+    bot.control.put(('ready', 0, None))
+    bot.control.put(('disable', 1, 'trello'))
+    bot.control.put(('ready', 1, None))
+    bot.control.put(('ready', 2, None))
+    bot.control.put(None)
+    bot.relay()
+
+    assert bot.ready.is_set()
+    assert [drain(inbox) for inbox in bot.inboxes] == [
+        [('disable', 'trello')],
+        [],
+        [('disable', 'trello')],
+    ]
+
+
+def test_worker_environment(mocker):
+    mocker.patch.dict(os.environ, {'TELEGRAM_OUTBOX_GLOBAL_RATE': '30'})
+    environment, removed = worker_environment(1, 4)
+    assert environment['TELEGRAM_OUTBOX_GLOBAL_RATE'] == '7'
+    assert environment['TRELLO_PREFETCH_BUDGET'] == '7'
+    assert 'TRELLO_WEBHOOK_PORT' in removed
+
+    mocker.patch.dict(os.environ, environment)
+    assert [owns_chat(chat_id) for chat_id in range(4)] == [
+        False, True, False, False,
+    ]
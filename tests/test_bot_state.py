@@ -0,0 +1,71 @@
+from reventlov.bot_state import BotState, SQLiteStateBackend, load_state
+from reventlov.bot_state import dump_state
+
+
+def test_state_survives_restart(tmpdir):
+    path = str(tmpdir.join('state.db'))
+    state = BotState(SQLiteStateBackend(path), capacity=2)
+    state.chat_data[1]['last_timer'] = 'tea'
+    state.chat_data[2]['last_timer'] = 'coffee'
+    state.user_data[1].update(language='en')
+    assert state.chat_data.stats['dirty'] == 2
+
+    state.chat_data[3]
+    assert len(state.chat_data) == 2
+    assert state.chat_data.stats['writes'] == 1
+    del state.chat_data[2]['last_timer']
+    state.stop()
+
+    state = BotState(SQLiteStateBackend(path))
+    assert state.chat_data[1] == {'last_timer': 'tea'}
+    assert state.chat_data[2] == {}
+    assert 3 not in state.chat_data
+    assert state.user_data[1] == {'language': 'en'}
+    assert state.chat_data.stats['loads'] == 2
+    state.stop()
+
+
+def test_state_keeps_changes_to_evicted_entries(tmpdir):
+    path = str(tmpdir.join('state.db'))
+    state = BotState(SQLiteStateBackend(path), capacity=1)
+    chat_data = state.chat_data[1]
+    state.chat_data[2]
+    assert 1 not in state.chat_data.entries
+    chat_data['last_timer'] = 'tea'
+    state.stop()
+
+    state = BotState(SQLiteStateBackend(path))
+    assert state.chat_data[1] == {'last_timer': 'tea'}
+    state.stop()
+
+
+def test_state_serialisation():
+    short = {'last_timer': 'tea'}
+    long = {'notes': ['x' * 100] * 10}
+    assert dump_state(short) == b'j{"last_timer":"tea"}'
+    assert dump_state(long)[:1] == b'z'
+    assert len(dump_state(long)) < 100
+    assert load_state(dump_state(short)) == short
+    assert load_state(dump_state(long)) == long
+
+
+def test_unserialisable_entry_does_not_block_others(tmpdir):
+    path = str(tmpdir.join('state.db'))
+    state = BotState(SQLiteStateBackend(path), capacity=2)
+    state.chat_data[1]['callback'] = object()
+    state.chat_data[2]['last_timer'] = 'tea'
+    state.chat_data[3]['last_timer'] = 'coffee'
+    assert 1 not in state.chat_data.entries
+    state.chat_data[2]['callback'] = object()
+    state.chat_data[4]['last_timer'] = 'mate'
+    state.flush()
+    assert state.chat_data.stats['dirty'] == 0
+    assert state.chat_data.stats['writes'] == 2
+    state.stop()
+
+    state = BotState(SQLiteStateBackend(path))
+    assert 1 not in state.chat_data
+    assert 2 not in state.chat_data
+    assert state.chat_data[3] == {'last_timer': 'coffee'}
+    assert state.chat_data[4] == {'last_timer': 'mate'}
+    state.stop()
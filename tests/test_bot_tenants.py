@@ -0,0 +1,66 @@
+import os
+
+from reventlov.bot_plugins import get_path_from_environment
+from reventlov.bot_resources import shared_resources
+from reventlov.bot_tenants import TenantBots, with_label
+from test_bot_webhook import example_bot_token, get_me, post_update
+from test_bot_webhook import telegram_update, wait_for
+
+
+def test_tenant_settings(mocker):
+    mocker.patch.dict(os.environ, {
+        'POMODORO_DB': 'data/pomodoro.db',
+        'BETA_POMODORO_DB': 'beta.db',
+    })
+    assert get_path_from_environment('POMODORO_DB', 'x.db') == \
+        'data/pomodoro.db'
+    assert get_path_from_environment('POMODORO_DB', 'x.db', 'alpha') == \
+        'data/alpha-pomodoro.db'
+    assert get_path_from_environment('POMODORO_DB', 'x.db', 'beta') == \
+        'beta.db'
+    assert with_label('sent', 'tenant="a"') == 'sent{tenant="a"}'
+    assert with_label('active{plugin="trello"}', 'tenant="a"') == \
+        'active{plugin="trello",tenant="a"}'
+
+
+def test_tenants_share_webhook_server(mocker):
+    mocker.patch.dict(os.environ, {
+        'TELEGRAM_BOT_TOKEN': example_bot_token,
+        'TELEGRAM_BOT_MODE': 'webhook',
+        'TELEGRAM_WEBHOOK_LISTEN': '127.0.0.1',
+        'TELEGRAM_WEBHOOK_PORT': '0',
+        'ALPHA_TELEGRAM_WEBHOOK_PATH': 'alpha',
+        'BETA_TELEGRAM_WEBHOOK_PATH': 'beta',
+        'BETA_TELEGRAM_BOT_ADMINS': 'daneel',
+        'REVENTLOV_DISABLED_PLUGINS': 'trello',
+        'BETA_REVENTLOV_DISABLED_PLUGINS': 'trello,pomodoro',
+        'POMODORO_DB': ':memory:',
+        'TELEGRAM_UPDATES_DB': ':memory:',
+        'REVENTLOV_STATE_DB': ':memory:',
+    })
+    mocker.patch('telegram.Bot.get_me', new=get_me)
+    sent = []
+    mocker.patch(
+        'telegram.Bot.send_message',
+        side_effect=lambda chat_id, text, **kwargs: sent.append(text),
+    )
+    tenants = TenantBots(['alpha', 'beta'])
+    tenants.run()
+    alpha, beta = tenants.bots['alpha'], tenants.bots['beta']
+    try:
+        assert alpha.webhook_server is beta.webhook_server
+        port = alpha.webhook_server.port
+        assert post_update(port, telegram_update(1, '/settings'), '/alpha') \
+            == 200
+        assert post_update(port, telegram_update(1, '/settings'), '/beta') \
+            == 200
+        assert wait_for(lambda: len(sent) == 2)
+        assert alpha.messages['settings'] in sent
+        assert beta.messages['settings'] in sent
+        assert list(alpha.plugins.enabled_plugins) == ['pomodoro']
+        assert list(beta.plugins.enabled_plugins) == []
+        assert beta.admins == ['daneel']
+        assert 'duplicate_updates{tenant="beta"}' in tenants.gauges
+    finally:
+        tenants.stop()
+    assert len(shared_resources) == 0
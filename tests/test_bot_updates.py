@@ -0,0 +1,97 @@
+import time
+
+import pytest
+from telegram.ext import DispatcherHandlerStop
+from reventlov.bot_updates import RecentUpdates, UpdateStore, UpdateTracker
+
+
+class Update(object):
+    def __init__(self, update_id):
+        self.update_id = update_id
+
+
+def test_recent_updates_window():
+    recent = RecentUpdates(window=10, max_size=100)
+    assert recent.add(1, now=0)
+    assert not recent.add(1, now=5)
+    assert recent.add(2, now=12)
+    assert not recent.add(1, now=15)
+    assert recent.add(3, now=25)
+    assert recent.add(1, now=26)
+    assert len(recent) == 3
+
+
+def test_recent_updates_bounded():
+    recent = RecentUpdates(window=600, max_size=2)
+    for update_id in range(10):
+        assert recent.add(update_id, now=0)
+    assert len(recent) <= 4
+
+
+def handle(tracker, update_id, now=0):
+    tracker.track(None, Update(update_id))
+    tracker.done(update_id, now)
+
+
+def test_tracker_resumes_after_restart(tmpdir):
+    path = str(tmpdir.join('updates.db'))
+    tracker = UpdateTracker(UpdateStore(path))
+    handle(tracker, 7)
+    handle(tracker, 9)
+    handle(tracker, 8)
+    with pytest.raises(DispatcherHandlerStop):
+        tracker.track(None, Update(9))
+    tracker.close()
+
+    restarted = UpdateTracker(UpdateStore(path))
+    assert restarted.offset == 9
+    with pytest.raises(DispatcherHandlerStop):
+        restarted.track(None, Update(8))
+    handle(restarted, 10)
+    assert restarted.duplicates == 1
+    restarted.close()
+    assert UpdateStore(path).load() == 10
+
+
+def test_tracker_saves_offsets_in_batches(tmpdir):
+    store = UpdateStore(str(tmpdir.join('updates.db')))
+    tracker = UpdateTracker(store, save_interval=10)
+    tracker.saved_at = 0
+    handle(tracker, 1, now=1)
+    handle(tracker, 2, now=2)
+    assert store.load() == 0
+    handle(tracker, 3, now=10)
+    assert store.load() == 3
+    handle(tracker, 4, now=11)
+    assert store.load() == 3
+    tracker.close()
+
+
+def test_tracker_saves_last_offset_without_later_updates(tmpdir):
+    store = UpdateStore(str(tmpdir.join('updates.db')))
+    tracker = UpdateTracker(store, save_interval=0.05)
+    tracker.start()
+    try:
+        handle(tracker, 1, now=time.monotonic())
+        deadline = time.monotonic() + 5
+        while store.load() == 0 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert store.load() == 1
+    finally:
+        tracker.close()
+
+
+def test_tracker_follows_update_id_resets(tmpdir):
+    path = str(tmpdir.join('updates.db'))
+    store = UpdateStore(path)
+    store.save(500000)
+    tracker = UpdateTracker(store, save_interval=0, reset_gap=1000)
+    with pytest.raises(DispatcherHandlerStop):
+        tracker.track(None, Update(499500))
+    handle(tracker, 1200)
+    handle(tracker, 1201)
+    assert (tracker.resets, tracker.offset) == (1, 1201)
+    with pytest.raises(DispatcherHandlerStop):
+        tracker.track(None, Update(1200))
+    tracker.close()
+    assert UpdateStore(path).load() == 1201
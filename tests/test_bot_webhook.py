@@ -0,0 +1,186 @@
+import http.client
+import json
+import os
+import queue
+import time
+import urllib.error
+import urllib.request
+
+import pytest
+from telegram import User
+from reventlov.bot import Bot
+from reventlov.bot_webhook import TelegramWebhookServer
+
+example_bot_token = '343445268:31f983_134f98has_asdf9_q9dpheq09uro'
+
+
+def telegram_update(update_id, text, chat_id=1):
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': 0,
+            'text': text,
+            'entities': [{
+                'type': 'bot_command',
+                'offset': 0,
+                'length': len(text.split()[0]),
+            }],
+            'chat': {'id': chat_id, 'type': 'private'},
+            'from': {
+                'id': chat_id,
+                'is_bot': False,
+                'first_name': 'Daneel',
+                'username': 'daneel',
+            },
+        },
+    }
+
+
+def get_me(bot, *args, **kwargs):
+    bot.bot = User(1, 'R. Giskard Reventlov', True, username='reventlovbot')
+    return bot.bot
+
+
+def post_update(port, payload, path='/hook'):
+    request = urllib.request.Request(
+        f'http://127.0.0.1:{port}{path}',
+        data=json.dumps(payload).encode(),
+        headers={'Content-Type': 'application/json'},
+        method='POST',
+    )
+    try:
+        return urllib.request.urlopen(request).status
+    except urllib.error.HTTPError as error:
+        return error.code
+
+
+@pytest.fixture
+def webhook_bot(mocker):
+    mocker.patch.dict(os.environ, {
+        'TELEGRAM_BOT_TOKEN': example_bot_token,
+        'TELEGRAM_BOT_MODE': 'webhook',
+        'TELEGRAM_WEBHOOK_LISTEN': '127.0.0.1',
+        'TELEGRAM_WEBHOOK_PORT': '0',
+        'TELEGRAM_WEBHOOK_PATH': 'hook',
+        'TELEGRAM_WEBHOOK_MAX_BODY': '2048',
+        'TELEGRAM_OUTBOX_CHAT_RATE': '100',
+        'REVENTLOV_DISABLED_PLUGINS': 'trello',
+        'POMODORO_DB': ':memory:',
+        'TELEGRAM_UPDATES_DB': ':memory:',
+        'REVENTLOV_STATE_DB': ':memory:',
+    })
+    mocker.patch('telegram.Bot.get_me', new=get_me)
+    sent = []
+    mocker.patch(
+        'telegram.Bot.send_message',
+        side_effect=lambda chat_id, text, **kwargs: sent.append(
+            dict(kwargs, chat_id=chat_id, text=text),
+        ),
+    )
+    bot = Bot()
+    bot.run()
+    bot.sent = sent
+    yield bot
+    bot.stop()
+
+
+def wait_for(condition):
+    for _ in range(200):
+        if condition():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+def test_webhook_mode_dispatches_updates(webhook_bot):
+    port = webhook_bot.webhook_server.port
+    assert post_update(port, telegram_update(1, '/start')) == 200
+    assert post_update(port, telegram_update(2, '/settings', 2)) == 200
+    assert wait_for(lambda: len(webhook_bot.sent) == 2)
+    by_chat = {
+        message['chat_id']: message['text']
+        for message in webhook_bot.sent
+    }
+    assert by_chat[1] == webhook_bot.start_message
+    assert by_chat[2] == webhook_bot.messages['settings']
+    assert webhook_bot.webhook_server.received == 2
+
+
+def test_webhook_mode_rejects_bad_requests(webhook_bot):
+    port = webhook_bot.webhook_server.port
+    update = telegram_update(1, '/start')
+    assert post_update(port, update, '/other') == 404
+    assert post_update(port, 'x' * 4096) == 413
+    assert post_update(port, '"{"') == 400
+    for length, status in [(None, 411), ('x', 400), ('-1', 400)]:
+        connection = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+        connection.putrequest('POST', '/hook')
+        if length is not None:
+            connection.putheader('Content-Length', length)
+        connection.endheaders()
+        assert connection.getresponse().status == status
+        connection.close()
+    assert webhook_bot.webhook_server.rejected == 5
+    assert webhook_bot.sent == []
+
+
+def test_webhook_root_path_and_query_strings():
+    updates = queue.Queue()
+    server = TelegramWebhookServer(('127.0.0.1', 0), None, updates)
+    server.start()
+    try:
+        for path in ('/', '/?token=x'):
+            update = telegram_update(updates.qsize() + 1, '/start')
+            assert post_update(server.port, update, path) == 200
+        assert post_update(server.port, telegram_update(3, '/start'),
+                           '/hook') == 404
+    finally:
+        server.stop()
+    assert [updates.get().update_id for _ in range(2)] == [1, 2]
+
+
+def test_webhook_mode_drops_duplicate_updates(webhook_bot):
+    port = webhook_bot.webhook_server.port
+    for update_id in (1, 2, 1):
+        update = telegram_update(update_id, '/start', update_id)
+        assert post_update(port, update) == 200
+    assert wait_for(lambda: webhook_bot.updates.duplicates == 1)
+    assert wait_for(lambda: len(webhook_bot.sent) == 2)
+    assert webhook_bot.updates.offset == 2
+
+
+def test_webhook_mode_sheds_floods(webhook_bot):
+    port = webhook_bot.webhook_server.port
+    for update_id in range(1, 9):
+        assert post_update(port, telegram_update(update_id, '/timers')) == 200
+    assert post_update(port, telegram_update(9, '/start')) == 200
+    assert wait_for(lambda: webhook_bot.updates.offset == 9)
+    assert wait_for(lambda: len(webhook_bot.sent) == 7)
+    texts = [message['text'] for message in webhook_bot.sent]
+    assert texts.count('You have no active timer') == 5
+    assert texts.count(webhook_bot.admission.shed_message) == 1
+    assert webhook_bot.gauges['admission_shed_user'] == 3
+
+
+def test_webhook_mode_toggles_plugins(webhook_bot):
+    port = webhook_bot.webhook_server.port
+    webhook_bot.admins = ['daneel']
+    commands = [
+        '/enable_plugin rello',
+        '/disable_plugin pomodoro',
+        '/timers',
+        '/enable_plugin pomodoro',
+        '/timers',
+    ]
+    for update_id, text in enumerate(commands, 1):
+        assert post_update(port, telegram_update(update_id, text)) == 200
+        assert wait_for(lambda: webhook_bot.updates.offset == update_id)
+    assert wait_for(lambda: len(webhook_bot.sent) == 4)
+    assert [message['text'] for message in webhook_bot.sent] == [
+        'Plugin rello is not disabled',
+        'Plugin pomodoro disabled',
+        'Plugin pomodoro enabled',
+        'You have no active timer',
+    ]
+    assert webhook_bot.plugins.disabled_plugins == {'trello'}
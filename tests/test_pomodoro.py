@@ -0,0 +1,199 @@
+import threading
+import time
+
+import pytest
+from reventlov.plugins.pomodoro import PomodoroPlugin
+from reventlov.plugins.pomodoro.cycles import CycleConfig, CycleTicker
+from reventlov.plugins.pomodoro.cycles import LONG_BREAK, SHORT_BREAK, WORK
+from reventlov.plugins.pomodoro.timers import TimerEngine, TimerStore
+
+
+class Message(object):
+    def __init__(self, chat_id):
+        self.chat_id = chat_id
+        self.replies = []
+
+    def reply_text(self, text):
+        self.replies.append(text)
+
+    reply_markdown = reply_text
+
+
+class Update(object):
+    def __init__(self, chat_id=1):
+        self.message = Message(chat_id)
+
+
+class Bot(object):
+    def __init__(self):
+        self.messages = []
+
+    def send_message(self, chat_id, text, **kwargs):
+        self.messages.append((chat_id, text))
+
+
+class Dispatcher(object):
+    def __init__(self):
+        self.bot = Bot()
+        self.handlers = []
+
+    def add_handler(self, handler):
+        self.handlers.append(handler)
+
+
+@pytest.fixture
+def plugin(mocker, tmpdir):
+    mocker.patch.dict('os.environ', {'POMODORO_DB': str(tmpdir / 'db')})
+    return PomodoroPlugin(Dispatcher())
+
+
+def test_named_timers(plugin):
+    update = Update()
+    chat_data = {}
+    plugin.set_timer(None, update, ['25', 'Work'], chat_data)
+    plugin.set_timer(None, update, ['break', '300', 'Rest'], chat_data)
+    plugin.set_timer(None, update, ['25', 'Work', 'again'], chat_data)
+    plugin.list_timers(None, update)
+    plugin.unset_timer(None, update, [], chat_data)
+    plugin.unset_timer(None, update, ['default'], chat_data)
+    plugin.unset_timer(None, update, ['break'], chat_data)
+    assert update.message.replies == [
+        'Timer successfully set!',
+        'Timer successfully set!',
+        'Timer successfully replaced!',
+        '- default: Work again\n- break: Rest',
+        'Timer successfully unset!',
+        'You have no active timer',
+        'Timer successfully unset!',
+    ]
+    assert len(plugin.timers) == 0
+
+
+def test_timers_survive_restart(plugin, tmpdir):
+    plugin.set_timer(None, Update(), ['work', '25', 'Work'], {})
+    plugin.set_timer(None, Update(2), ['60'], {})
+
+    restarted = PomodoroPlugin(Dispatcher())
+    restarted.timers.load()
+    assert [
+        (timer.chat_id, timer.name, timer.text)
+        for timer in sorted(restarted.timers.timers.values(),
+                            key=lambda timer: timer.chat_id)
+    ] == [(1, 'work', 'Work'), (2, 'default', 'Beep!')]
+
+
+def test_reenabled_plugin_fires_alarm_once(mocker, tmpdir):
+    mocker.patch.dict('os.environ', {
+        'POMODORO_DB': str(tmpdir / 'db'),
+        'POMODORO_TICK': '0.1',
+    })
+    dispatcher = Dispatcher()
+    disabled = PomodoroPlugin(dispatcher)
+    disabled.bootstrap()
+    disabled.set_timer(None, Update(), ['1', 'Work'], {})
+    disabled.stop()
+
+    enabled = PomodoroPlugin(dispatcher)
+    enabled.bootstrap()
+    try:
+        deadline = time.time() + 5
+        while len(dispatcher.bot.messages) == 0 and time.time() < deadline:
+            time.sleep(0.05)
+        time.sleep(0.3)
+    finally:
+        enabled.stop()
+    assert dispatcher.bot.messages == [(1, 'Work')]
+    assert not disabled.timers.thread.is_alive()
+    assert not disabled.cycles.thread.is_alive()
+
+
+def test_timers_firing_in_same_tick_are_coalesced(tmpdir, mocker):
+    fired = []
+    engine = TimerEngine(
+        lambda chat_id, timers: fired.append(
+            (chat_id, [timer.name for timer in timers]),
+        ),
+        store=TimerStore(str(tmpdir / 'db')),
+        tick=10,
+    )
+    time = mocker.patch('reventlov.plugins.pomodoro.timers.time.time')
+    time.return_value = 1001
+    engine.set(1, 'a', 1, 'A')
+    engine.set(1, 'b', 5, 'B')
+    engine.set(2, 'c', 8, 'C')
+    engine.set(2, 'd', 20, 'D')
+    engine.cancel(2, 'c')
+
+    due = engine.pop_due(1010)
+    assert {
+        chat_id: [timer.name for timer in timers]
+        for chat_id, timers in due.items()
+    } == {1: ['a', 'b']}
+    assert engine.pop_due(1015) == {}
+    assert list(engine.pop_due(1030)) == [2]
+    assert len(engine) == 0
+    assert engine.chats == {}
+
+
+def test_immediate_timer_leaves_no_stored_row(tmpdir):
+    fired = threading.Event()
+    store = TimerStore(str(tmpdir / 'db'))
+    engine = TimerEngine(lambda chat_id, timers: fired.set(), store=store)
+    engine.start()
+    try:
+        engine.set(1, 'now', 0, 'Now')
+        assert fired.wait(5)
+    finally:
+        engine.stop()
+    assert store.load() == []
+    assert engine.chat_timers(1) == []
+
+
+def test_cycles_advance_in_batches():
+    ticker = CycleTicker(lambda sessions: None)
+    config = CycleConfig(work=60, short_break=10, long_break=30, rounds=2)
+    ticker.start_cycle(1, config, now=0)
+    ticker.start_cycle(2, CycleConfig(60, 10, 30, 2), now=0)
+    ticker.start_cycle(3, config, now=30)
+
+    assert [session.chat_id for session in ticker.advance(60)] == [1, 2]
+    assert ticker.sessions[1].phase == SHORT_BREAK
+    assert ticker.sessions[1].config is ticker.sessions[2].config
+    assert [session.chat_id for session in ticker.advance(70)] == [1, 2]
+    assert ticker.sessions[1].phase == WORK
+    assert [session.chat_id for session in ticker.advance(90)] == [3]
+    ticker.advance(130)
+    assert ticker.sessions[1].phase == LONG_BREAK
+
+
+def test_cycles_pause_and_resume():
+    ticker = CycleTicker(lambda sessions: None)
+    ticker.start_cycle(1, CycleConfig(work=60), now=0)
+    assert ticker.pause(1, now=20).remaining == 40
+    assert ticker.advance(100) == []
+    session = ticker.resume(1, now=100)
+    assert session.ends == 140
+    assert ticker.advance(139) == []
+    assert ticker.advance(140) == [session]
+    assert ticker.stop_cycle(1) is session
+    assert ticker.pause(1) is None
+
+
+def test_cycle_commands(plugin):
+    update = Update()
+    plugin.start_cycle(None, update, ['50', '10', '20'])
+    plugin.pause_cycle(None, update)
+    plugin.resume_cycle(None, update)
+    plugin.stop_cycle(None, update)
+    plugin.start_cycle(None, update, ['50'])
+    assert update.message.replies == [
+        'Pomodoro cycle started, 50 minutes of work!',
+        'Cycle paused',
+        'Cycle resumed, back to work',
+        'Cycle stopped',
+        'Usage: `/cycle [work short_break long_break]`',
+    ]
+    session = plugin.cycles.start_cycle(1, CycleConfig(), now=0)
+    plugin.notify_cycles(plugin.cycles.advance(25 * 60))
+    assert session.phase == SHORT_BREAK
+    assert plugin.bot.messages == [(1, 'Time for a short break (5 minutes)')]
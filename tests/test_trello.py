@@ -0,0 +1,630 @@
+import asyncio
+import json
+import os
+import threading
+import time
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+import pytest
+from trello.exceptions import Unauthorized
+from reventlov.bot_resources import shared_resources
+from reventlov.plugins.trello import TrelloPlugin
+from reventlov.plugins.trello import async_client
+from reventlov.plugins.trello.board_snapshot import BoardSnapshot
+from reventlov.plugins.trello.cache import TrelloCache
+from reventlov.plugins.trello.prefetch import BoardPrefetcher
+from reventlov.plugins.trello.search import Document, SearchIndex
+from reventlov.plugins.trello.transport import SingleFlight, TrelloTransport
+from reventlov.plugins.trello.webhook import webhook_signature
+
+board_json = {
+    'id': 'b1',
+    'name': 'Sprint',
+    'lists': [
+        {'id': 'l2', 'name': 'Done', 'pos': 2, 'closed': False},
+        {'id': 'l1', 'name': 'To Do', 'pos': 1, 'closed': False},
+        {'id': 'l3', 'name': 'Empty', 'pos': 3, 'closed': False},
+    ],
+    'cards': [
+        {'id': 'c1', 'name': 'Write docs', 'idList': 'l1', 'pos': 2},
+        {'id': 'c2', 'name': 'Fix bug', 'idList': 'l1', 'pos': 1},
+        {'id': 'c3', 'name': 'Release', 'idList': 'l2', 'pos': 1},
+    ],
+}
+board_columns_msg = '- To Do (2 cards) \n    + Fix bug\n    + Write docs' \
+                    '\n- Done (1 cards) \n    + Release' \
+                    '\n- Empty (0 cards)'
+
+
+class Board(object):
+    def __init__(self, board_id, name):
+        self.id = board_id
+        self.name = name
+
+
+class Organization(object):
+    def __init__(self, name, boards):
+        self.name = name
+        self.boards = boards
+
+    def get_boards(self, list_filter):
+        return self.boards
+
+
+class TrelloClient(object):
+    def __init__(self, *args, **kwargs):
+        self.requests = []
+        self.orgs = [Organization('EDyO', [Board('b1', 'Sprint')])]
+
+    def list_organizations(self):
+        self.requests.append('/organizations')
+        return self.orgs
+
+    def fetch_json(self, uri_path, query_params=None):
+        self.requests.append(uri_path)
+        return board_json
+
+
+class AsyncTrelloClient(object):
+    def __init__(self, *args, **kwargs):
+        self.requests = []
+
+    async def fetch_json(self, uri_path, query_params=None):
+        self.requests.append(uri_path)
+        await asyncio.sleep(0)
+        return board_json
+
+
+class User(object):
+    def __init__(self, username):
+        self.username = username
+
+
+class Message(object):
+    def __init__(self, username, chat_id=1):
+        self.from_user = User(username)
+        self.chat_id = chat_id
+
+
+class Update(object):
+    def __init__(self, username, chat_id=1):
+        self.message = Message(username, chat_id)
+
+
+class Bot(object):
+    def __init__(self):
+        self.messages = []
+
+    def send_message(self, chat_id, text, **kwargs):
+        self.messages.append(text)
+
+
+class Dispatcher(object):
+    def __init__(self):
+        self.handlers = []
+
+    def add_handler(self, handler):
+        self.handlers.append(handler)
+
+
+def list_board(plugin, *args):
+    bot = Bot()
+    plugin.admins = ['admin']
+    plugin.handlers[0].callback(bot, Update('admin'), list(args)).result(5)
+    return '\n'.join(bot.messages).split('\n\nYou can specify')[0]
+
+
+@pytest.fixture
+def plugin(mocker):
+    mocker.patch('reventlov.plugins.trello.TrelloClient', new=TrelloClient)
+    mocker.patch(
+        'reventlov.plugins.trello.AsyncTrelloClient',
+        new=AsyncTrelloClient,
+    )
+    return TrelloPlugin(Dispatcher())
+
+
+def test_board_snapshot():
+    snapshot = BoardSnapshot.from_json(board_json)
+    assert snapshot.column_names == ['To Do', 'Done', 'Empty']
+    assert [card['name'] for card in snapshot.column_cards('l1')] == [
+        'Fix bug',
+        'Write docs',
+    ]
+    assert snapshot.column_cards('l3') == []
+
+
+def test_list_board_single_request(plugin):
+    assert list_board(plugin, 'Sprint') == board_columns_msg
+    assert plugin.async_client.requests == ['/boards/b1']
+    list_board(plugin, 'Sprint')
+    assert plugin.async_client.requests == ['/boards/b1']
+
+
+def test_iter_board_page(plugin):
+    snapshot = BoardSnapshot.from_json(board_json)
+    plugin.page_columns = 2
+    assert list(plugin.iter_board_page('Sprint', snapshot, 2)) == [
+        '- Empty (0 cards)',
+    ]
+    assert list(plugin.iter_board_page('Sprint', snapshot, 0)) == [
+        'No page 0 in `Sprint`, it has 2 pages',
+    ]
+
+
+def test_list_board_runs_on_event_loop(plugin):
+    bot = Bot()
+    plugin.admins = ['admin']
+    list_objects = plugin.handlers[0].callback
+    for chat_id in range(3):
+        list_objects(bot, Update('admin', chat_id), ['Sprint']).result(5)
+    assert len(bot.messages) == 3
+    assert bot.messages[0].startswith(board_columns_msg)
+    assert plugin.async_client.requests == ['/boards/b1']
+    assert plugin.client.requests == ['/organizations']
+
+
+class KeepAliveHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.server.paths.append(self.path)
+        if not self.path.startswith('/1/boards/b1?'):
+            self.send_response(401)
+            self.send_header('Content-Length', '7')
+            self.end_headers()
+            self.wfile.write(b'invalid')
+            return
+        body = json.dumps(board_json).encode()
+        self.send_response(200)
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        for start in range(0, len(body), 100):
+            chunk = body[start:start + 100]
+            self.wfile.write(b'%x\r\n%s\r\n' % (len(chunk), chunk))
+        self.wfile.write(b'0\r\n\r\n')
+
+    def log_message(self, format, *args):
+        pass
+
+
+class KeepAliveServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def test_async_client_reuses_connections():
+    server = KeepAliveServer(('127.0.0.1', 0), KeepAliveHandler)
+    server.paths = []
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    client = async_client.AsyncTrelloClient(
+        'key',
+        'secret',
+        api_url=f'http://127.0.0.1:{server.server_address[1]}/1',
+        max_connections=2,
+    )
+    loop = asyncio.new_event_loop()
+
+    async def fetch_boards(fields):
+        return await asyncio.gather(*[
+            client.fetch_json('/boards/b1', {'fields': field})
+            for field in fields
+        ])
+
+    try:
+        boards = loop.run_until_complete(fetch_boards(['name'] * 6))
+        assert boards == [board_json] * 6
+        assert server.paths == [
+            '/1/boards/b1?fields=name&key=key&token=secret',
+        ]
+        boards = loop.run_until_complete(fetch_boards(['a', 'b', 'c', 'd']))
+        assert boards == [board_json] * 4
+        assert client.pool.opened == 2
+        assert client.pool.reused == 3
+        with pytest.raises(Unauthorized):
+            loop.run_until_complete(client.fetch_json('/members/me'))
+    finally:
+        client.pool.close()
+        loop.close()
+        server.shutdown()
+        server.server_close()
+
+
+def test_async_client_sends_user_token(mocker):
+    server = KeepAliveServer(('127.0.0.1', 0), KeepAliveHandler)
+    server.paths = []
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    mocker.patch('reventlov.plugins.trello.TrelloClient', new=TrelloClient)
+    mocker.patch.dict(os.environ, {
+        'TRELLO_API_URL': f'http://127.0.0.1:{server.server_address[1]}/1',
+        'TRELLO_API_KEY': 'key',
+        'TRELLO_API_SECRET': 'secret',
+        'TRELLO_API_TOKEN': 'token',
+    })
+    plugin = TrelloPlugin(Dispatcher())
+    loop = asyncio.new_event_loop()
+    try:
+        loop.run_until_complete(plugin.async_client.fetch_json('/boards/b1'))
+        assert server.paths == ['/1/boards/b1?key=key&token=token']
+    finally:
+        plugin.async_client.pool.close()
+        plugin.stop()
+        loop.close()
+        server.shutdown()
+        server.server_close()
+
+
+def test_list_board_pages(plugin):
+    bot = Bot()
+    plugin.admins = ['admin']
+    plugin.page_columns = 2
+    list_objects = plugin.handlers[0].callback
+    list_objects(bot, Update('admin'), ['Sprint']).result(5)
+    list_objects(bot, Update('admin'), ['Sprint', 'page', '2']).result(5)
+    list_objects(bot, Update('admin'), ['Sprint', 'page', '3']).result(5)
+    first, second, missing = [
+        message.split('\n\nYou can specify')[0] for message in bot.messages
+    ]
+    assert first == board_columns_msg.split('\n- Empty')[0] + \
+        '\n\nPage 1 of 2, use `/list Sprint page 2` for more'
+    assert second == '- Empty (0 cards)'
+    assert missing == 'No page 3 in `Sprint`, it has 2 pages'
+
+
+def test_search_index():
+    index = SearchIndex()
+    snapshot = BoardSnapshot.from_json(board_json)
+    snapshot.cards['c3']['desc'] = 'Tag and publish the docs'
+    index.put_snapshot(snapshot)
+    board = ('b1', 'Sprint')
+    write_docs = Document('card', 'Write docs', board, 'To Do')
+    release = Document('card', 'Release', board, 'Done')
+    assert index.search('docs') == [write_docs, release]
+    assert index.search('wri') == [write_docs]
+    assert index.search('wirte dcos') == [write_docs, release]
+    assert index.search('sprint') == [Document('board', 'Sprint', board, None)]
+    assert index.search('to do')[0] == Document('list', 'To Do', board, None)
+    assert index.search('nothing') == []
+    index.remove(('card', 'c1'))
+    assert index.search('write') == []
+    assert 'write' not in index.postings
+    assert 'wr' not in index.prefixes
+    index.remove_board('b1')
+    assert len(index) == 0
+    assert index.postings == {}
+
+
+def test_find_command(plugin):
+    bot = Bot()
+    plugin.admins = ['admin']
+    plugin.build_index()
+    assert plugin.index_ready
+    plugin.find(bot, Update('admin'), ['fix', 'bgu'])
+    plugin.find(bot, Update('admin'), ['missing'])
+    plugin.find(bot, Update('someone'), ['fix'])
+    assert bot.messages == [
+        '- card Fix bug (Sprint / To Do)',
+        'Nothing found for missing',
+        'You must be admin to find Trello objects',
+    ]
+    assert plugin.client.requests == ['/organizations', '/boards/b1']
+
+
+def test_tenants_share_trello_resources(mocker, plugin):
+    mocker.patch.dict(os.environ, {
+        'ALPHA_TRELLO_ADMINS': 'daneel',
+        'GAMMA_TRELLO_API_KEY': 'other',
+    })
+    alpha = TrelloPlugin(Dispatcher(), tenant='alpha')
+    beta = TrelloPlugin(Dispatcher(), tenant='beta')
+    gamma = TrelloPlugin(Dispatcher(), tenant='gamma')
+    assert alpha.client is beta.client
+    assert alpha.cache is beta.cache
+    assert alpha.index is beta.index
+    assert alpha.prefetcher is beta.prefetcher
+    assert gamma.cache is not alpha.cache
+    assert plugin.cache is not alpha.cache
+    assert alpha.admins == ['daneel']
+    assert beta.admins == []
+
+    list_board(alpha, 'Sprint')
+    list_board(beta, 'Sprint')
+    assert alpha.client.requests == ['/organizations']
+    assert alpha.async_client.requests == ['/boards/b1']
+
+    alpha.stop()
+    assert beta.share('account', (None, None, None), dict) is beta.account
+    beta.stop()
+    gamma.stop()
+    assert len(shared_resources) == 0
+
+
+def test_prefetcher_refreshes_hot_boards():
+    expiry = {}
+    refreshed = []
+
+    def refresh(board_id):
+        refreshed.append(board_id)
+        expiry[board_id] = 60
+
+    prefetcher = BoardPrefetcher(
+        refresh,
+        lambda board_id: expiry.get(board_id, 0),
+        top=2,
+        interval=30,
+        budget=2,
+    )
+    for board_id in ['a', 'a', 'a', 'b', 'b', 'c']:
+        prefetcher.record(board_id)
+    prefetcher.prefetch()
+    assert refreshed == ['a', 'b']
+    expiry.update({'a': 10, 'b': 10})
+    prefetcher.record('a')
+    prefetcher.record('b')
+    prefetcher.prefetch()
+    assert refreshed == ['a', 'b']
+    assert prefetcher.stats == {
+        'accesses': 8,
+        'warm_hits': 2,
+        'hits': 2,
+        'hit_ratio': 0.25,
+        'refreshes': 2,
+        'budget_skips': 2,
+    }
+
+
+def test_single_flight_shares_result():
+    flights = SingleFlight()
+    started, released = threading.Event(), threading.Event()
+    results = []
+
+    def slow_call():
+        started.set()
+        released.wait(5)
+        return 'board'
+
+    leader = threading.Thread(
+        target=lambda: results.append(flights.do('b1', slow_call)),
+    )
+    leader.start()
+    started.wait(5)
+    follower = threading.Thread(
+        target=lambda: results.append(flights.do('b1', lambda: 'again')),
+    )
+    follower.start()
+    follower.join(0.2)
+    released.set()
+    leader.join()
+    follower.join()
+    assert sorted(results) == [('board', False), ('board', True)]
+    assert flights.do('b1', lambda: 'again') == ('again', False)
+
+
+def test_transport_reuses_connections():
+    server = KeepAliveServer(('127.0.0.1', 0), KeepAliveHandler)
+    server.paths = []
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    transport = TrelloTransport(pool_size=2)
+    url = f'http://127.0.0.1:{server.server_address[1]}/1/boards/b1'
+    try:
+        for _ in range(3):
+            response = transport.request(
+                'GET',
+                url,
+                'GET /boards/{id}',
+                params={'key': 'key'},
+            )
+            assert response.json() == board_json
+        assert transport.stats == {
+            'connections_opened': 1,
+            'requests_sent': 3,
+        }
+    finally:
+        transport.close()
+        server.shutdown()
+        server.server_close()
+
+
+def test_cache_lru_eviction():
+    cache = TrelloCache(ttls={'boards': 60}, max_entries=2)
+    cache.put('boards', 'a', 1)
+    cache.put('boards', 'b', 2)
+    assert cache.get('boards', 'a', lambda: 0) == 1
+    cache.put('boards', 'c', 3)
+    assert cache.peek('boards', 'b') is None
+    assert cache.peek('boards', 'a') == 1
+    assert cache.evictions == 1
+
+
+def test_cache_stale_while_revalidate(mocker):
+    cache = TrelloCache(ttls={'boards': 0}, stale_ttl=60)
+    cache.put('boards', 'open', 'old')
+    thread = mocker.patch('reventlov.plugins.trello.cache.threading.Thread')
+    assert cache.get('boards', 'open', lambda: 'new') == 'old'
+    assert cache.stale_hits == 1
+    thread.assert_called_once()
+    cache.revalidate('boards', 'open', lambda: 'new')
+    assert cache.peek('boards', 'open') == 'new'
+
+
+def test_cache_coalesces_concurrent_misses():
+    cache = TrelloCache(ttls={'snapshots': 60})
+    released = threading.Event()
+    loads = []
+
+    def load():
+        loads.append(1)
+        released.wait(5)
+        return 'snapshot'
+
+    results = []
+    threads = [
+        threading.Thread(
+            target=lambda: results.append(cache.get('snapshots', 'b1', load)),
+        )
+        for _ in range(6)
+    ]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.1)
+    released.set()
+    for thread in threads:
+        thread.join()
+    assert results == ['snapshot'] * 6
+    assert len(loads) == 1
+
+
+def test_cache_expired_past_stale_window():
+    cache = TrelloCache(ttls={'boards': 0}, stale_ttl=0)
+    cache.put('boards', 'open', 'old')
+    assert cache.get('boards', 'open', lambda: 'new') == 'new'
+    assert cache.misses == 1
+
+
+def test_flush_cache_admin_only(plugin):
+    bot = Bot()
+    plugin.admins = ['admin']
+    plugin.boards
+    plugin.flush_cache(bot, Update('someone'))
+    assert len(plugin.cache) == 2
+    plugin.flush_cache(bot, Update('admin'))
+    assert len(plugin.cache) == 0
+    assert bot.messages == [
+        'You must be admin to flush Trello cache',
+        'Flushed 2 cached Trello objects',
+    ]
+
+
+def send_webhook(port, payload, headers=None, path='/'):
+    request = urllib.request.Request(
+        f'http://127.0.0.1:{port}{path}',
+        data=json.dumps(payload).encode(),
+        headers=headers or {},
+        method='POST',
+    )
+    try:
+        return urllib.request.urlopen(request).status
+    except urllib.error.HTTPError as error:
+        return error.code
+
+
+@pytest.fixture
+def webhook_plugin(mocker, plugin):
+    mocker.patch.dict(os.environ, {'TRELLO_WEBHOOK_PORT': '0'})
+    plugin.start_webhook_server()
+    list_board(plugin, 'Sprint')
+    plugin.client.requests = []
+    plugin.async_client.requests = []
+    yield plugin
+    plugin.webhook_server.stop()
+
+
+def test_webhook_patches_board_snapshot(webhook_plugin):
+    port = webhook_plugin.webhook_server.port
+    actions = [
+        {'type': 'createCard', 'data': {
+            'board': {'id': 'b1'},
+            'list': {'id': 'l3', 'name': 'Empty'},
+            'card': {'id': 'c4', 'name': 'New card'},
+        }},
+        {'type': 'updateCard', 'data': {
+            'board': {'id': 'b1'},
+            'listBefore': {'id': 'l1'},
+            'listAfter': {'id': 'l2'},
+            'card': {'id': 'c1', 'idList': 'l2'},
+        }},
+        {'type': 'updateCard', 'data': {
+            'board': {'id': 'b1'},
+            'list': {'id': 'l1'},
+            'card': {'id': 'c2', 'closed': True},
+        }},
+        {'type': 'updateList', 'data': {
+            'board': {'id': 'b1'},
+            'list': {'id': 'l3', 'name': 'Later'},
+        }},
+        {'type': 'updateBoard', 'data': {
+            'board': {'id': 'b1', 'name': 'Sprint 2'},
+        }},
+    ]
+    for action in actions:
+        assert send_webhook(port, {'action': action}) == 200
+    assert list_board(webhook_plugin, 'Sprint 2') == '- To Do (0 cards)' \
+        '\n- Done (2 cards) \n    + Release\n    + Write docs' \
+        '\n- Later (1 cards) \n    + New card'
+    assert webhook_plugin.board_names == ['Sprint 2']
+    assert webhook_plugin.client.requests == []
+    assert webhook_plugin.async_client.requests == []
+    assert webhook_plugin.index.search('new card')[0] == Document(
+        'card', 'New card', ('b1', 'Sprint 2'), 'Later',
+    )
+    assert webhook_plugin.index.search('fix bug') == []
+
+
+def test_webhook_unknown_action_invalidates_snapshot(webhook_plugin):
+    port = webhook_plugin.webhook_server.port
+    action = {'type': 'somethingNew', 'data': {'board': {'id': 'b1'}}}
+    assert send_webhook(port, {'action': action}) == 200
+    assert webhook_plugin.cache.peek('snapshots', 'b1') is None
+
+
+def test_webhook_rejects_bad_payloads(webhook_plugin):
+    port = webhook_plugin.webhook_server.port
+    assert send_webhook(port, {'no': 'action'}) == 400
+    route = webhook_plugin.webhook_server.routes['/']
+    route.secret = 'secret'
+    route.callback_url = 'https://example.com/hook'
+    payload = {'action': {'type': 'commentCard', 'data': {}}}
+    assert send_webhook(port, payload) == 401
+    signature = webhook_signature(
+        'secret',
+        json.dumps(payload).encode(),
+        'https://example.com/hook',
+    )
+    headers = {'X-Trello-Webhook': signature}
+    assert send_webhook(port, payload, headers) == 200
+
+
+def test_tenant_webhooks_route_by_account(mocker):
+    mocker.patch('reventlov.plugins.trello.TrelloClient', new=TrelloClient)
+    mocker.patch(
+        'reventlov.plugins.trello.AsyncTrelloClient',
+        new=AsyncTrelloClient,
+    )
+    mocker.patch.dict(os.environ, {
+        'TRELLO_WEBHOOK_PORT': '0',
+        'ALPHA_TRELLO_API_KEY': 'alpha',
+        'ALPHA_TRELLO_API_SECRET': 'alpha-secret',
+        'ALPHA_TRELLO_WEBHOOK_CALLBACK_URL': 'https://example.com/alpha',
+        'BETA_TRELLO_API_KEY': 'beta',
+        'BETA_TRELLO_API_SECRET': 'beta-secret',
+        'BETA_TRELLO_WEBHOOK_CALLBACK_URL': 'https://example.com/beta',
+        'BETA_TRELLO_PAGE_COLUMNS': '2',
+    })
+    alpha = TrelloPlugin(Dispatcher(), tenant='alpha')
+    beta = TrelloPlugin(Dispatcher(), tenant='beta')
+    try:
+        assert alpha.webhook_server is beta.webhook_server
+        assert (alpha.page_columns, beta.page_columns) == (10, 2)
+        port = alpha.webhook_server.port
+        list_board(alpha, 'Sprint')
+        list_board(beta, 'Sprint')
+        payload = {'action': {'type': 'updateBoard', 'data': {
+            'board': {'id': 'b1', 'name': 'Sprint 2'},
+        }}}
+        body = json.dumps(payload).encode()
+        headers = {'X-Trello-Webhook': webhook_signature(
+            'beta-secret',
+            body,
+            'https://example.com/beta',
+        )}
+        assert send_webhook(port, payload, headers, '/alpha') == 401
+        assert send_webhook(port, payload, headers, '/beta') == 200
+        assert send_webhook(port, payload, headers, '/gamma') == 404
+        assert alpha.board_names == ['Sprint']
+        assert beta.board_names == ['Sprint 2']
+    finally:
+        alpha.stop()
+        beta.stop()
+    assert len(shared_resources) == 0